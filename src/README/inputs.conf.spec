@@ -37,3 +37,11 @@ interval = <value>
 
 ports = <value>
 * Indicates which ports to scan
+
+discovery = <value>
+* The method used to find the hosts that are up before scanning them (icmp or tcp)
+* Only the hosts that respond will be scanned; all hosts will be scanned if this is left blank
+* The outcome is written as separate events with the sourcetype of the input followed by "_discovery"
+
+discovery_ports = <value>
+* The TCP ports to check when using TCP discovery (defaults to 22,80,443,3389)
@@ -16,7 +16,72 @@ index = <string>
 
 thread_limit = <string>
     * Defines the maximum number of the threads that the input will run when doing pings via the ping input
+    * This also limits the number of hosts that will be pinged at once when pinging a network (via the ping input or the ping search command)
     * Raising this will increase the number of inputs that can be done at any one time
     * Lower this value if you experience excesssive resource utilization upon startup due to the inputs trying to catch up
     * Raise this value if you have a large number of inputs and Splunk is unable to keep up
-    * Defaults to 20
\ No newline at end of file
+    * Defaults to 20
+
+output_mode = <string>
+    * Defines where the results created by the search commands and inputs are written
+    * stash: the results are written to stash files that are indexed by Splunk's spool directory input
+    * hec: the results are sent to the HTTP Event Collector defined by hec_url (the token is read from storage/passwords, see hec_url)
+    * Scripted lookups don't get a session key to read the token with so they write their results to stash files even when this is hec
+    * Defaults to stash
+
+event_format = <string>
+    * Defines the format that the results are written in
+    * kv: key/value pairs (e.g. dest="10.0.0.1", status="open")
+    * json: a single-line JSON object for each result
+    * The app's sourcetypes extract both formats at search time (KV_MODE = auto with AUTO_KV_JSON = true in props.conf)
+    * If KV_MODE is overridden for the app's sourcetypes in local/props.conf, use KV_MODE = json for the json format
+    * Defaults to kv
+
+hec_url = <string>
+    * The URL of the HTTP Event Collector to send the results to when output_mode is hec
+    * The path defaults to /services/collector/event if the URL doesn't include one
+    * Example: https://localhost:8088
+    * The HEC token isn't stored in this file; store it in storage/passwords under the realm "network_tools" with the name "hec_token"
+    * Example: curl -k -u admin https://localhost:8089/servicesNS/nobody/network_tools/storage/passwords -d realm=network_tools -d name=hec_token -d password=<token>
+    * The users that run the search commands need the list_storage_passwords capability to read the token
+
+hec_verify_ssl = <bool>
+    * Indicates whether the certificate of the HTTP Event Collector ought to be verified
+    * Defaults to true
+
+whois_cache_kvstore = <bool>
+    * Indicates whether the results of the whois search command ought to be cached in the whois_cache KV store collection
+    * This allows the members of a search head cluster to share whois results instead of each one repeating the lookups
+    * Only the admin and power roles can write to the collection by default (see metadata/default.meta); the searches of other users read from the cache but their results aren't added to it
+    * Defaults to false
+
+whois_cache_ttl = <integer>
+    * The number of seconds that whois results are kept in the KV store cache
+    * Defaults to 86400
+
+parse_processes = <integer>
+    * The number of worker processes that the responses of domain whois lookups are parsed in
+    * Parsing is CPU-bound so this allows the whois lookup and search command to use more than one core
+    * Set this to 0 to parse the responses in the thread that performed the lookup
+    * Defaults to 0
+
+whois_queries_per_second = <integer>
+    * The number of whois queries per second that are sent to each whois server (per process)
+    * Whois servers block clients that send too many queries so this keeps lookups of many hosts from getting refused
+    * Set this to 0 to not limit the rate of queries
+    * Defaults to 5
+
+whois_max_connections = <integer>
+    * The number of connections that can be open to each whois server at once (per process)
+    * Set this to 0 to not limit the number of connections
+    * Defaults to 5
+
+whois_circuit_failures = <integer>
+    * The number of queries to a whois server that must fail in a row before queries to it are suspended
+    * Suspended queries fail immediately instead of waiting for the server to time out
+    * Set this to 0 to never suspend queries
+    * Defaults to 5
+
+whois_circuit_cooldown = <integer>
+    * The number of seconds that queries to a whois server are suspended for (a single query is then sent to see if the server recovered)
+    * Defaults to 60
@@ -9,6 +9,7 @@ This module includes a series of functions for performing network operations (pi
 import sys
 import os
 import errno
+import time
 
 try:
     from ConfigParser import SafeConfigParser as ConfigParser
@@ -23,40 +24,66 @@ if not lib_dir in sys.path:
     sys.path.append(lib_dir)
 
 # App provided imports
-from network_tools_app.event_writer import StashNewWriter
-from network_tools_app import pyspeedtest
+# The libraries that are slow to load (ipwhois, pythonwhois, dnspython, pyspeedtest, etc.) are
+# imported by the functions that use them so that the short-lived search command and lookup
+# processes only pay for what they use.
+from network_tools_app.event_writer import BufferedStashNewWriter, EventWriter
 from network_tools_app import pingparser
-from .tracerouteparser import Traceroute
-from network_tools_app.wakeonlan import wol
-from network_tools_app.ipwhois import IPWhois
-from network_tools_app.pythonwhois import get_whois
+from network_tools_app import icmp
+from network_tools_app.icmp import ICMPEchoEngine
+from network_tools_app import tcp_engine
+from network_tools_app.tcp_engine import TCPPingEngine
 from network_tools_app.flatten import flatten
+from network_tools_app.worker_pool import iterate_concurrently, DEFAULT_THREAD_LIMIT
 
 if sys.version_info >= (3, 3):  # pragma: no cover
     from ipaddress import ip_network
 else:
     from network_tools_app.ipaddr import ip_network
 
-from dns import resolver,reversename
-from network_tools_app.portscan import port_scan
-
 # Environment imports
 from platform import system as system_name
 import subprocess
 import collections
+import itertools
 import binascii
 import json
-from timeit import default_timer as timer
-import socket
 
 # Splunk imports
 import splunk
 import splunk.rest as rest
+from splunk.util import normalizeBoolean
 from splunk.models.base import SplunkAppObjModel
 from splunk.models.field import Field
 
 from compat import text_type
 
+# These are the destinations that results can be written to (see make_event_writer())
+OUTPUT_MODE_STASH = "stash"
+OUTPUT_MODE_HEC = "hec"
+
+# This is the KV store collection that whois results are cached in (see make_whois_cache())
+WHOIS_CACHE_COLLECTION = "whois_cache"
+
+# This is the realm and name that the HEC token is stored under in storage/passwords
+HEC_TOKEN_REALM = "network_tools"
+HEC_TOKEN_NAME = "hec_token"
+
+# This is the session key of the search command running in this process (see
+# set_default_session_key()). The functions that write events aren't given a session key so this
+# is used to read the secrets that the event writers need (such as the HEC token).
+default_session_key = None
+
+# This is the number of seconds that configuration loaded from the REST API is reused for
+APP_CONFIG_CACHE_TTL = 10
+
+# These hold the configuration that was already loaded by get_app_config(). The configuration read
+# from the conf files is keyed by stanza and is reused until one of the files changes while the
+# configuration from the REST API is keyed by session key and stanza and expires after
+# APP_CONFIG_CACHE_TTL.
+conf_file_config_cache = {}
+rest_config_cache = {}
+
 class CommandNotFoundException(Exception):
     """
     Represents the inability to run a command because it could not be found.
@@ -71,6 +98,18 @@ class NetworkToolsConfig(SplunkAppObjModel):
 
     resource = '/admin/network_tools'
     index = Field()
+    thread_limit = Field()
+    output_mode = Field()
+    event_format = Field()
+    hec_url = Field()
+    hec_verify_ssl = Field()
+    whois_cache_kvstore = Field()
+    whois_cache_ttl = Field()
+    parse_processes = Field()
+    whois_queries_per_second = Field()
+    whois_max_connections = Field()
+    whois_circuit_failures = Field()
+    whois_circuit_cooldown = Field()
 
 class AttrDict(dict):
     def __init__(self, *args, **kwargs):
@@ -83,9 +122,70 @@ def validate_ip(host):
 
     return ip_network(host)
 
+def get_conf_file_paths():
+    """
+    Get the paths of the network_tools.conf files in the order that they ought to be read.
+    """
+
+    return [
+        os.path.join(os.environ['SPLUNK_HOME'], 'etc', 'apps', 'network_tools', 'default', 'network_tools.conf'),
+        os.path.join(os.environ['SPLUNK_HOME'], 'etc', 'apps', 'network_tools', 'local', 'network_tools.conf'),
+        os.path.join(os.environ['SPLUNK_HOME'], 'etc', 'system', 'local', 'network_tools.conf')
+    ]
+
+def get_conf_file_signature(paths):
+    """
+    Get a value that changes when any of the files are created, modified or deleted.
+    """
+
+    signature = []
+
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+
+    return tuple(signature)
+
+def read_conf_files(paths, stanza):
+    """
+    Read the stanza from the conf files (later files override the earlier ones). None will be
+    returned if the files could not be read.
+    """
+
+    conf = ConfigParser()
+    try:
+        # Create an empty object with AttrDict type
+        app_config = AttrDict()
+
+        # Read the default, then local config for this app + system/local
+        for f in paths:
+            if os.path.isfile(f):
+                conf.read(f)
+                options = conf.options(stanza)
+                for o in options:
+                    app_config.update({o: conf.get(stanza, o)})
+    except BaseException as e:
+        # Could not read configuration file(s)
+        app_config = None
+
+    return app_config
+
+def clear_app_config_cache():
+    """
+    Forget the configuration loaded by get_app_config() so that it is loaded again on the next call
+    (such as after the configuration is changed).
+    """
+
+    conf_file_config_cache.clear()
+    rest_config_cache.clear()
+
 def get_app_config(session_key, stanza="default"):
     """
-    Get the app configuration
+    Get the app configuration. The configuration is cached for the life of the process; it is read
+    again once the conf files change (or once the TTL expires when it is loaded from the REST API).
     
     Arguments:
     session_key -- The session key to use when connecting to the REST API
@@ -99,30 +199,28 @@ def get_app_config(session_key, stanza="default"):
     # Get the configuration
     if session_key == None:
         # Scripted lookups don't get a session key
-        default_conf = os.path.join(os.environ['SPLUNK_HOME'], 'etc', 'apps', 'network_tools', 'default', 'network_tools.conf')
-        local_conf = os.path.join(os.environ['SPLUNK_HOME'], 'etc', 'apps', 'network_tools', 'local', 'network_tools.conf')
-        system_local_conf = os.path.join(os.environ['SPLUNK_HOME'], 'etc', 'system', 'local', 'network_tools.conf')
-        
-        conf = ConfigParser()
-        try:
-            # Create an empty object with AttrDict type
-            app_config = AttrDict()
-            
-            # Read the default, then local config for this app + system/local
-            for f in [default_conf, local_conf, system_local_conf]:
-                if os.path.isfile(f):
-                    conf.read(f)
-                    options = conf.options(stanza)
-                    for o in options:
-                        app_config.update({o: conf.get(stanza, o)})
-        except BaseException as e:
-            # Could not read configuration file(s)
-            app_config = None
+        paths = get_conf_file_paths()
+        signature = get_conf_file_signature(paths)
+
+        cached = conf_file_config_cache.get(stanza)
+
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        app_config = read_conf_files(paths, stanza)
+        conf_file_config_cache[stanza] = (signature, app_config)
     else:
+        cached = rest_config_cache.get((session_key, stanza))
+
+        if cached is not None and cached[0] > time.time():
+            return cached[1]
+
         try:
             app_config = NetworkToolsConfig.get(NetworkToolsConfig.build_id(stanza, "network_tools", "nobody"), sessionKey=session_key)
         except splunk.ResourceNotFound:
-            return None
+            app_config = None
+
+        rest_config_cache[(session_key, stanza)] = (time.time() + APP_CONFIG_CACHE_TTL, app_config)
     
     return app_config
 
@@ -137,6 +235,207 @@ def get_default_index(session_key=None):
     else:
         return app_config.index
 
+def get_thread_limit(session_key=None):
+    """
+    Get the maximum number of threads to use when performing operations concurrently.
+    """
+    app_config = get_app_config(session_key)
+
+    try:
+        thread_limit = int(app_config.thread_limit)
+    except (AttributeError, TypeError, ValueError):
+        return DEFAULT_THREAD_LIMIT
+
+    if thread_limit < 1:
+        return DEFAULT_THREAD_LIMIT
+
+    return thread_limit
+
+def make_parse_pool(session_key=None):
+    """
+    Make the pool of processes that whois responses ought to be parsed in. None will be returned
+    if parse_processes is not set in network_tools.conf (in which case, the responses ought to be
+    parsed in the thread that performed the lookup). The processes are started right away so call
+    this before starting any threads (see ParsePool). Make sure to call close() on the pool once
+    done.
+    """
+
+    try:
+        app_config = get_app_config(session_key)
+    except KeyError:
+        return None
+
+    try:
+        processes = int(app_config.parse_processes)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+    if processes < 1:
+        return None
+
+    from network_tools_app.parse_pool import ParsePool
+
+    parse_pool = ParsePool(processes)
+    parse_pool.start()
+
+    return parse_pool
+
+def make_whois_cache(session_key, logger=None):
+    """
+    Make the cache of whois results that is stored in the KV store (and thus shared across a
+    search head cluster). None will be returned unless whois_cache_kvstore is enabled in
+    network_tools.conf. Make sure to call close() on the cache once done so that the queued
+    results get written.
+
+    Arguments:
+    session_key -- The session key to use when connecting to the REST API
+    logger -- The logger to write errors to
+    """
+
+    app_config = get_app_config(session_key)
+
+    if not normalizeBoolean(getattr(app_config, 'whois_cache_kvstore', None) or "false"):
+        return None
+
+    from network_tools_app.kvstore_cache import KVStoreCache, DEFAULT_TTL as DEFAULT_WHOIS_CACHE_TTL
+
+    try:
+        ttl = int(app_config.whois_cache_ttl)
+    except (AttributeError, TypeError, ValueError):
+        ttl = DEFAULT_WHOIS_CACHE_TTL
+
+    return KVStoreCache(WHOIS_CACHE_COLLECTION, session_key, ttl=ttl, logger=logger)
+
+def configure_whois_governor(session_key=None, logger=None):
+    """
+    Apply the limits in network_tools.conf to the queries sent to whois servers (see
+    whois_governor). The governor is returned so that the statistics can be logged with
+    log_statistics() once the lookups are done.
+
+    Arguments:
+    session_key -- The session key to use when connecting to the REST API
+    logger -- The logger to write the changes of the circuits to
+    """
+
+    from network_tools_app import whois_governor
+
+    try:
+        app_config = get_app_config(session_key)
+    except KeyError:
+        app_config = None
+
+    settings = {}
+
+    for name, default in (('queries_per_second', whois_governor.DEFAULT_QUERIES_PER_SECOND),
+                          ('max_connections', whois_governor.DEFAULT_MAX_CONNECTIONS),
+                          ('circuit_failures', whois_governor.DEFAULT_CIRCUIT_FAILURES),
+                          ('circuit_cooldown', whois_governor.DEFAULT_CIRCUIT_COOLDOWN)):
+        try:
+            settings[name] = int(getattr(app_config, 'whois_' + name))
+        except (AttributeError, TypeError, ValueError):
+            settings[name] = default
+
+    whois_governor.governor.configure(logger=logger, **settings)
+
+    return whois_governor.governor
+
+def set_default_session_key(session_key):
+    """
+    Set the session key that make_event_writer() uses to read the HEC token (search commands call
+    this when they get their session key).
+    """
+
+    global default_session_key
+    default_session_key = session_key
+
+def get_hec_token(session_key, server_uri=None):
+    """
+    Get the HEC token from storage/passwords. None will be returned if it hasn't been stored.
+
+    Arguments:
+    session_key -- The session key to use when connecting to the REST API
+    server_uri -- The URI of splunkd (the local instance will be used if None)
+    """
+
+    uri = '%s/servicesNS/nobody/network_tools/storage/passwords/%s:%s:' % (server_uri or '', HEC_TOKEN_REALM, HEC_TOKEN_NAME)
+
+    try:
+        _, content = rest.simpleRequest(uri, sessionKey=session_key, getargs={'output_mode': 'json'},
+                                        raiseAllErrors=True)
+    except splunk.ResourceNotFound:
+        return None
+
+    for entry in json.loads(content).get('entry', []):
+        return entry['content'].get('clear_password')
+
+    return None
+
+def make_event_writer(index, source, sourcetype, session_key=None):
+    """
+    Make a writer that batches the events. By default, the events are written to stash files;
+    they will be sent to an HTTP Event Collector instead if output_mode is set to "hec" in
+    network_tools.conf. Make sure to call flush_event_writer() once done so that the remaining
+    events get written and the writer's connections and threads get released.
+
+    The HEC token is read from storage/passwords which requires a session key. Scripted lookups
+    don't get one so their events are written to stash files even if output_mode is "hec".
+
+    Arguments:
+    index -- The index to write the events to
+    source -- The source of the events
+    sourcetype -- The sourcetype of the events
+    session_key -- The session key to read the HEC token with (defaults to the one passed to
+                   set_default_session_key())
+    """
+
+    # Scripted lookups don't get a session key so the configuration is read from the conf files
+    try:
+        app_config = get_app_config(None)
+    except KeyError:
+        app_config = None
+
+    output_mode = getattr(app_config, 'output_mode', None) or OUTPUT_MODE_STASH
+    event_format = getattr(app_config, 'event_format', None) or EventWriter.KV_FORMAT
+
+    if session_key is None:
+        session_key = default_session_key
+
+    if output_mode == OUTPUT_MODE_HEC and session_key is not None:
+        from network_tools_app.event_writer import HECEventWriter
+
+        hec_url = getattr(app_config, 'hec_url', None)
+        hec_token = get_hec_token(session_key)
+
+        if not hec_url or not hec_token:
+            raise ValueError("The hec_url must be defined in network_tools.conf and the HEC token must be stored in storage/passwords (realm=%s, name=%s) when output_mode is hec" % (HEC_TOKEN_REALM, HEC_TOKEN_NAME))
+
+        verify_ssl = normalizeBoolean(getattr(app_config, 'hec_verify_ssl', None) or "true")
+
+        return HECEventWriter(hec_url, hec_token, index=index, source_name=source,
+                              sourcetype=sourcetype, event_format=event_format,
+                              verify_ssl=verify_ssl)
+
+    elif output_mode in (OUTPUT_MODE_STASH, OUTPUT_MODE_HEC):
+        return BufferedStashNewWriter(index=index, source_name=source, sourcetype=sourcetype,
+                                      file_extension=".stash_output", event_format=event_format)
+
+    raise ValueError("The output_mode in network_tools.conf must be either %s or %s" % (OUTPUT_MODE_STASH, OUTPUT_MODE_HEC))
+
+def flush_event_writer(writer, logger=None):
+    """
+    Write the events remaining in the writer's buffer and release the writer (the HEC writer's
+    sender threads and connections are closed). The writer cannot be used afterwards.
+    """
+
+    if hasattr(writer, 'close'):
+        writer.close()
+        return
+
+    stash_file = writer.flush()
+
+    if logger and stash_file is not None:
+        logger.debug("Wrote stash file=%s", stash_file)
+
 def traceroute(host, unique_id=None, index=None, sourcetype="traceroute",
                source="traceroute_search_command", logger=None, include_dest_info=True,
                include_raw_output=False):
@@ -174,6 +473,7 @@ def traceroute(host, unique_id=None, index=None, sourcetype="traceroute",
 
     # Parse the output
     try:
+        from network_tools_app.tracerouteparser import Traceroute
         trp = Traceroute.parse(output)
 
         # This will contain the hops
@@ -230,8 +530,7 @@ def traceroute(host, unique_id=None, index=None, sourcetype="traceroute",
 
     # Write the event as a stash new file
     if index is not None:
-        writer = StashNewWriter(index=index, source_name=source, sourcetype=sourcetype,
-                                file_extension=".stash_output")
+        writer = make_event_writer(index, source, sourcetype)
 
         # Let's store the basic information for the traceroute that will be included with each hop
         proto = collections.OrderedDict()
@@ -252,135 +551,121 @@ def traceroute(host, unique_id=None, index=None, sourcetype="traceroute",
             result.update(parsed_hop)
             result.update(proto)
 
-            # Log that we performed the traceroute
-            if logger:
-                logger.debug("Wrote stash file=%s", writer.write_event(result))
+            writer.write_event(result)
+
+        # Write all of the hops to a single stash file
+        flush_event_writer(writer, logger)
 
     return output, return_code, parsed
 
-def tcp_ping(host, port=80, count=1, index=None, sourcetype="ping", source="ping_search_command", logger=None):
+def tcp_ping(host, port=80, count=1, index=None, sourcetype="ping", source="ping_search_command", logger=None,
+             timeout=tcp_engine.DEFAULT_TIMEOUT, interval=tcp_engine.DEFAULT_INTERVAL, writer=None):
     """
-    Pings the host using TCP and returns a tuple consisting of:
+    Pings the host using TCP and returns a dictionary that summarizes the results including the
+    output, the number of probes sent and received, the packet loss and the response times.
 
-     1) the output string
-     2) the return code (0 is the expected return code)
-     3) parsed output from the ping command
+    Arguments:
+    timeout -- the number of seconds to wait for each connection to complete
+    interval -- the number of seconds to wait between probes
+    writer -- the event writer to write the result to instead of making one for the index (the
+              caller must flush it)
     """
-    sent = 0
-    packet_loss = 0
-    output = []
-    received = 0
-    response_times = []
 
-    for i in range(0, count):
-        success = False
+    result = TCPPingEngine(timeout=timeout, interval=interval, logger=logger).ping(host, port, count)
 
-        # New Socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Write the event as a stash new file
+    if writer is not None:
+        write_tcp_ping_result(result, writer, logger)
 
-        # 1 sec Timeout
-        sock.settimeout(1)
+    elif index is not None:
+        writer = make_event_writer(index, source, sourcetype)
+        write_tcp_ping_result(result, writer, logger)
+        flush_event_writer(writer, logger)
 
-        # Start a timer
-        timer_start = timer()
+    return result
 
-        # Try to Connect
-        try:
-            sock.connect((host, int(port)))
-            sent += 1
-            sock.shutdown(socket.SHUT_RD)
-            sock.close()
-            success = True
-        
-        # Connection Time Out
-        except socket.timeout:
-            output.append("Connection timeout to %s[%s]" % (host, port))
-            sent += 1
-            packet_loss += 1
-        # Connection Time Out
-        except OSError as e:
-            output.append("Error when connecting to %s[%s]: %r" % (host, port, str(e)))
-            sent += 1
-            packet_loss += 1
-
-        # Stop Timer
-        timer_stop = timer()
-        total_runtime = float("%.2f" % (1000 * (timer_stop - timer_start)))
-        response_times.append(total_runtime)
-
-        if success:
-            output.append("Connected to %s[%s]: tcp_seq=%s time=%.2f ms" % (host, port, i, total_runtime))
-            received += 1
-    
-    # Calculate the jitter
-    diff = 0
-    prev_response_time = None
-    for response_time in response_times:
-        if prev_response_time is not None:
-            diff += abs(prev_response_time - response_time)
-        
-        prev_response_time = response_time
-
-    jitter = (diff * 1.0) / len(response_times)
-
-    # Calculate the min_ping, max_ping, avg_ping
-    min_ping = None
-    max_ping = None
-    total = 0
-
-    for response_time in response_times:
-        # Figure out min_ping
-        if min_ping is None:
-            min_ping = response_time
-
-        if response_time < min_ping:
-            min_ping = response_time
-    
-        # Figure out max_ping
-        if max_ping is None:
-            max_ping = response_time
+def write_tcp_ping_result(result, writer, logger=None):
+    """
+    Write the result of a TCP ping to the stash writer.
+    """
 
-        if response_time > max_ping:
-            max_ping = response_time
+    stash_file = writer.write_event(result)
 
-        # Total up the value for the average calculation
-        total += response_time
+    # Log that we performed the ping
+    if logger and stash_file is not None:
+        logger.debug("Wrote stash file=%s", stash_file)
 
-    # Calculate the packet loss as a percent
-    if sent > 0:
-        packet_loss_percent = 100 * (packet_loss / sent)
-    else:
-        packet_loss_percent = 0
+def iter_tcp_ping_hosts(hosts, port=80, count=1, index=None, sourcetype="ping",
+                        source="ping_search_command", logger=None,
+                        timeout=tcp_engine.DEFAULT_TIMEOUT, interval=tcp_engine.DEFAULT_INTERVAL):
+    """
+    Pings the hosts concurrently using TCP and yields the result dictionary of each host as it
+    completes. The hosts may be a generator; they are consumed incrementally.
 
-    avg_ping = total / len(response_times)
+    Arguments:
+    timeout -- the number of seconds to wait for each connection to complete
+    interval -- the number of seconds to wait between the probes sent to the same host
+    """
 
-    output.append("\n--- %s ping statistics ---" % host)
-    output.append("%i packets transmitted, %i packets received, %i%% packet loss" % (sent, received, packet_loss_percent))
+    engine = TCPPingEngine(timeout=timeout, interval=interval, logger=logger)
 
-    # Make the summary dictionary
-    result = collections.OrderedDict()
-    result['dest'] = host
-    result['output'] = "\n".join(output)
-    result['sent'] = sent
-    result['received'] = received
-    result['packet_loss'] = int(round(packet_loss_percent, 0))
-    result['jitter'] = round(jitter, 2)
-    result['min_ping'] = round(min_ping, 2)
-    result['max_ping'] = round(max_ping, 2)
-    result['avg_ping'] = round(avg_ping, 2)
+    # The results of all of the hosts are batched into as few stash files as possible
+    writer = None
 
-    # Write the event as a stash new file
     if index is not None:
-        writer = StashNewWriter(index=index, source_name=source, sourcetype=sourcetype,
-                                file_extension=".stash_output")
+        writer = make_event_writer(index, source, sourcetype)
 
-        # Log that we performed the ping
-        if logger:
-            logger.debug("Wrote stash file=%s", writer.write_event(result))
+    try:
+        for _, result in engine.iter_ping(hosts, port, count):
 
-    return result
+            # Write the event as a stash new file
+            if writer is not None:
+                write_tcp_ping_result(result, writer, logger)
+
+            yield result
+
+    finally:
+        if writer is not None:
+            flush_event_writer(writer, logger)
+
+def use_icmp_engine(host):
+    """
+    Determine if the built-in ICMP echo engine can be used to ping the given host (as opposed to
+    the native ping command).
+    """
 
-def ping(host, count=1, index=None, sourcetype="ping", source="ping_search_command", logger=None):
+    # The engine only supports IPv4 and relies on the socket behavior of Unix-like platforms
+    if system_name().lower() == "windows" or ':' in host:
+        return False
+
+    return icmp.is_available()
+
+def write_ping_result(output, return_code, parsed, writer, logger=None):
+    """
+    Write the result of a ping to the stash writer.
+    """
+
+    result = collections.OrderedDict()
+    result.update(parsed)
+
+    if 'host' in result:
+        result['dest'] = result['host']
+        del result['host']
+
+    result['return_code'] = return_code
+    result['output'] = output
+
+    # Remove the jitter field on Windows since it doesn't get populated on Windows
+    if 'jitter' in result and (result['jitter'] is None or len(result['jitter']) == 0):
+        del result['jitter']
+
+    stash_file = writer.write_event(result)
+
+    # Log that we performed the ping
+    if logger and stash_file is not None:
+        logger.debug("Wrote stash file=%s", stash_file)
+
+def native_ping(host, count=1):
     """
     Pings the host using the native ping command on the platform and returns a tuple consisting of:
 
@@ -424,30 +709,105 @@ def ping(host, count=1, index=None, sourcetype="ping", source="ping_search_comma
             'output': output
         }
 
-    # Write the event as a stash new file
-    if index is not None:
-        writer = StashNewWriter(index=index, source_name=source, sourcetype=sourcetype,
-                                file_extension=".stash_output")
+    return output, return_code, parsed
+
+def ping(host, count=1, index=None, sourcetype="ping", source="ping_search_command", logger=None,
+         writer=None):
+    """
+    Pings the host and returns a tuple consisting of:
+
+     1) the output string
+     2) the return code (0 is the expected return code)
+     3) parsed output from the ping command
 
-        result = collections.OrderedDict()
-        result.update(parsed)
+    The built-in ICMP echo engine will be used if this process is allowed to open ICMP sockets;
+    otherwise, the native ping command on the platform will be used. The result will be written to
+    the writer if one is provided (the caller must flush it); otherwise, a writer will be made for
+    the index.
+    """
 
-        if 'host' in result:
-            result['dest'] = result['host']
-            del result['host']
+    results = []
 
-        result['return_code'] = return_code
-        result['output'] = output
+    def collect_result(_, output, return_code, parsed):
+        results.append((output, return_code, parsed))
 
-        # Remove the jitter field on Windows since it doesn't get populated on Windows
-        if 'jitter' in result and (result['jitter'] is None or len(result['jitter']) == 0):
-            del result['jitter']
+    ping_hosts([host], count, index=index, sourcetype=sourcetype, source=source, logger=logger,
+               callback=collect_result, writer=writer)
 
-        # Log that we performed the ping
-        if logger:
-            logger.debug("Wrote stash file=%s", writer.write_event(result))
+    return results[0]
 
-    return output, return_code, parsed
+def ping_hosts(hosts, count=1, index=None, sourcetype="ping", source="ping_search_command",
+               logger=None, callback=None, thread_limit=1, budget=None, writer=None):
+    """
+    Pings the list of hosts, calling the callback with the host, the output, the return code and
+    the parsed output as each host completes.
+
+    The hosts will be pinged concurrently using the built-in ICMP echo engine when possible.
+    Otherwise, up to thread_limit ping commands will be run at once.
+    """
+
+    for result in iter_ping_hosts(hosts, count, index, sourcetype, source, logger, thread_limit,
+                                  budget, writer):
+        if callback:
+            callback(*result)
+
+def iter_ping_hosts(hosts, count=1, index=None, sourcetype="ping", source="ping_search_command",
+                    logger=None, thread_limit=1, budget=None, writer=None):
+    """
+    Pings the hosts and yields a tuple of the host, the output, the return code and the parsed
+    output as each host completes. The hosts may be a generator; they are consumed incrementally.
+
+    The hosts will be pinged concurrently using the built-in ICMP echo engine when possible.
+    Otherwise, up to thread_limit ping commands will be run at once.
+
+    The results will be written to the writer if one is provided (the caller must flush it);
+    otherwise, a writer will be made for the index.
+    """
+
+    # This will contain the hosts that the ICMP echo engine cannot ping
+    native_hosts = []
+    hosts = iter(hosts)
+
+    def engine_hosts():
+        for host in hosts:
+            if use_icmp_engine(host):
+                yield host
+            else:
+                native_hosts.append(host)
+
+    # The results of all of the hosts are batched into as few stash files as possible
+    owns_writer = writer is None and index is not None
+
+    if owns_writer:
+        writer = make_event_writer(index, source, sourcetype)
+
+    def handle_result(host, output, return_code, parsed):
+
+        # Write the event as a stash new file
+        if writer is not None:
+            write_ping_result(output, return_code, parsed, writer, logger)
+
+        return host, output, return_code, parsed
+
+    try:
+        if system_name().lower() != "windows" and icmp.is_available():
+            try:
+                for result in ICMPEchoEngine(logger=logger).iter_ping(engine_hosts(), count):
+                    yield handle_result(*result)
+
+            except icmp.ICMPSocketUnavailable:
+                if logger:
+                    logger.warn("Unable to use the ICMP echo engine, the ping command will be used instead")
+
+        # Ping the remaining hosts with the ping command
+        for host, result in iterate_concurrently(lambda host: native_ping(host, count),
+                                                 itertools.chain(native_hosts, hosts),
+                                                 thread_limit, budget, 'ping_worker'):
+            yield handle_result(host, *result)
+
+    finally:
+        if owns_writer:
+            flush_event_writer(writer, logger)
 
 def speedtest(host, runs=2, index=None, sourcetype="speedtest", source="speedtest_search_command",
               logger=None):
@@ -458,6 +818,8 @@ def speedtest(host, runs=2, index=None, sourcetype="speedtest", source="speedtes
     # This will contain the event we will index and return
     result = {}
 
+    from network_tools_app import pyspeedtest
+
     speedtester = pyspeedtest.SpeedTest(host=host, runs=runs)
     result['ping'] = round(speedtester.ping(), 2)
 
@@ -471,12 +833,9 @@ def speedtest(host, runs=2, index=None, sourcetype="speedtest", source="speedtes
 
     # Write the event as a stash new file
     if index is not None:
-        writer = StashNewWriter(index=index, source_name=source, sourcetype=sourcetype,
-                                file_extension=".stash_output")
-
-        # Log that we performed the speedtest
-        if logger:
-            logger.debug("Wrote stash file=%s", writer.write_event(result))
+        writer = make_event_writer(index, source, sourcetype)
+        writer.write_event(result)
+        flush_event_writer(writer, logger)
 
     # Return the result
     return result
@@ -559,6 +918,7 @@ def wakeonlan(host, mac_address=None, ip_address=None, port=None, index=None,
         logger.debug("Arguments provided to wake-on-lan: %r", keyword_args)
 
     # Make the call
+    from network_tools_app.wakeonlan import wol
     wol.send_magic_packet(mac_address, **keyword_args)
 
     # Make a dictionary that indicates what happened
@@ -570,19 +930,38 @@ def wakeonlan(host, mac_address=None, ip_address=None, port=None, index=None,
 
     # Write the event as a stash new file
     if index is not None:
-        writer = StashNewWriter(index=index, source_name=source, sourcetype=sourcetype,
-                                file_extension=".stash_output")
-
-        # Log that we performed the wake-on-lan request
-        if logger:
-            logger.debug("Wrote stash file=%s", writer.write_event(result))
+        writer = make_event_writer(index, source, sourcetype)
+        writer.write_event(result)
+        flush_event_writer(writer, logger)
 
     return result
 
-def whois(host, index=None, sourcetype="whois", source="whois_search_command", logger=None):
+def domain_whois(host, parse_pool=None):
+    """
+    Performs a whois request against a domain name. The responses will be parsed in the parse
+    pool if one is provided.
+    """
+
+    from network_tools_app.pythonwhois.net import get_whois_raw
+    from network_tools_app.parse_pool import parse_domain_whois
+
+    raw_data, server_list = get_whois_raw(host, with_server_list=True)
+
+    # Unlisted handles will be looked up on the last whois server that was queried
+    if parse_pool is None:
+        return parse_domain_whois(raw_data, server_list[-1])
+    else:
+        return parse_pool.parse_domain_whois(raw_data, server_list[-1])
+
+def whois(host, index=None, sourcetype="whois", source="whois_search_command", logger=None,
+          parse_pool=None, writer=None):
     """
     Performs a whois request. If the host is a domain-name then a normal DNS whois will be
     performed. If the name is an IP address, then an IP whois will be done.
+
+    The responses of domain whois requests will be parsed by the parse_pool if one is provided
+    (see make_parse_pool()). The result will be written to the writer if one is provided (the
+    caller must flush it); otherwise, a writer will be made for the index.
     """
 
     # See if this is an IP address. If so, do an IP whois.
@@ -590,12 +969,14 @@ def whois(host, index=None, sourcetype="whois", source="whois_search_command", l
         # The following will throw a ValueError exception indicating that this is not an IP address
         validate_ip(host)
 
+        from network_tools_app.ipwhois import IPWhois
+
         whois_object = IPWhois(host)
         results_orig = whois_object.lookup_rdap(depth=1)
     except ValueError:
 
         # Since this isn't an IP address, run a domain whois
-        results_orig = get_whois(host)
+        results_orig = domain_whois(host, parse_pool)
 
     if 'query' not in results_orig:
         results_orig['query'] = host
@@ -613,23 +994,45 @@ def whois(host, index=None, sourcetype="whois", source="whois_search_command", l
         pass # Ok, raw didn't exist
 
     # Write the event as a stash new file
-    if index is not None:
-        writer = StashNewWriter(index=index, source_name=source, sourcetype=sourcetype,
-                                file_extension=".stash_output")
+    if writer is not None:
+        writer.write_event(result)
 
-        # Log that we performed the whois request
-        if logger:
-            logger.debug("Wrote stash file=%s", writer.write_event(result))
+    elif index is not None:
+        writer = make_event_writer(index, source, sourcetype)
+        writer.write_event(result)
+        flush_event_writer(writer, logger)
 
     return result
 
-def nslookup(host, server=None, index=None, sourcetype="nslookup",
-             source="nslookup_search_command", logger=None):
+def get_min_ttl(ttl, answers):
+    """
+    Get the smaller of the TTL and the TTL of the DNS answers (the TTL may be None).
+    """
+
+    if answers.rrset is None:
+        return ttl
+
+    if ttl is None:
+        return answers.rrset.ttl
+
+    return min(ttl, answers.rrset.ttl)
+
+def nslookup_with_ttl(host, server=None):
     """
     Perform a DNS lookup. If the input is an IP address, then a reverse lookup will be performed.
+
+    A tuple of the result and the lowest TTL of the records returned (or None if no records were
+    returned) will be provided.
+
+    Arguments:
+    host -- the host name or IP address to look up
+    server -- the DNS server to query (the system's resolvers will be used if None)
     """
 
+    from dns import resolver, reversename
+
     result = collections.OrderedDict()
+    ttl = None
 
     if host is None or host.strip() == "":
         raise ValueError("The host cannot be none or empty")
@@ -642,8 +1045,11 @@ def nslookup(host, server=None, index=None, sourcetype="nslookup",
         validate_ip(host)
         addr = reversename.from_address(host)
 
-        if len(resolver.query(addr, "PTR")) > 0:
-            result['host'] = str(resolver.query(addr, "PTR")[0])
+        answers = resolver.query(addr, "PTR")
+
+        if len(answers) > 0:
+            result['host'] = str(answers[0])
+            ttl = get_min_ttl(ttl, answers)
 
     # If this isn't an IP address, handle it as a DNS name.
     except ValueError as e:
@@ -656,97 +1062,108 @@ def nslookup(host, server=None, index=None, sourcetype="nslookup",
         # Log the server used
         result['server'] = custom_resolver.nameservers
 
-        # NS records
-        try:
-            answers = custom_resolver.query(host, 'NS')
-
-            ns_records = []
+        # Get the NS, A, AAAA and MX records
+        for record_type, field in (('NS', 'ns'), ('A', 'a'), ('AAAA', 'aaaa'), ('MX', 'mx')):
+            try:
+                answers = custom_resolver.query(host, record_type)
 
-            for answer in answers:
-                ns_records.append(str(answer))
+                records = []
 
-            if len(ns_records) > 0:
-                result['ns'] = ns_records
+                for answer in answers:
+                    records.append(str(answer))
 
-        except resolver.NoAnswer:
-            pass
+                if len(records) > 0:
+                    result[field] = records
+                    ttl = get_min_ttl(ttl, answers)
 
-        # A
-        try:
-            answers = custom_resolver.query(host, 'A')
+            except resolver.NoAnswer:
+                pass
 
-            a_records = []
+    return result, ttl
 
-            for answer in answers:
-                a_records.append(str(answer))
+def nslookup(host, server=None, index=None, sourcetype="nslookup",
+             source="nslookup_search_command", logger=None, writer=None):
+    """
+    Perform a DNS lookup. If the input is an IP address, then a reverse lookup will be performed.
+    The result will be written to the writer if one is provided (the caller must flush it);
+    otherwise, a writer will be made for the index.
+    """
 
-            if len(a_records) > 0:
-                result['a'] = a_records
-        except resolver.NoAnswer:
-            pass
+    result, _ = nslookup_with_ttl(host, server)
 
-        # AAAA
-        try:
-            answers = custom_resolver.query(host, 'AAAA')
+    # Write the event as a stash new file
+    if writer is not None:
+        writer.write_event(result)
 
-            aaaa_records = []
+    elif index is not None:
+        writer = make_event_writer(index, source, sourcetype)
+        writer.write_event(result)
+        flush_event_writer(writer, logger)
 
-            for answer in answers:
-                aaaa_records.append(str(answer))
+    return result
 
-            if len(aaaa_records) > 0:
-                result['aaaa'] = aaaa_records
+def portscan(host, ports="22,80,443,3389", index=None, sourcetype="portscan", source="portscan_search_command", logger=None, timeout=5, unique_id=None,
+             discovery=None, discovery_ports=None, discovery_sourcetype="portscan_discovery"):
+    """
+    Perform a port scan against the given host (or hosts). The host may be a host name, an IP
+    address, a CIDR block or a comma separated list of these.
 
-        except resolver.NoAnswer:
-            pass
+    If a discovery method (icmp or tcp) is provided, the hosts will be checked first and only those
+    that are up will be scanned. The outcome of the discovery will be written as separate events
+    with the discovery_sourcetype.
+    """
 
-        # MX
-        try:
-            answers = custom_resolver.query(host, 'MX')
+    from network_tools_app.portscan import port_scan, make_result as make_port_scan_result, make_discovery_result
 
-            mx_records = []
+    writer = None
+    discovery_writer = None
 
-            for answer in answers:
-                mx_records.append(str(answer))
+    if index is not None:
+        writer = make_event_writer(index, source, sourcetype)
 
-            if len(mx_records) > 0:
-                result['mx'] = mx_records
+        if discovery is not None:
+            discovery_writer = make_event_writer(index, source, discovery_sourcetype)
 
-        except resolver.NoAnswer:
-            pass
+        if unique_id is None:
+            unique_id = binascii.b2a_hex(os.urandom(4))
 
-    # Write the event as a stash new file
-    if index is not None:
-        writer = StashNewWriter(index=index, source_name=source, sourcetype=sourcetype,
-                                file_extension=".stash_output")
+    def write_event(event_writer, result):
+        result['unique_id'] = unique_id
+        stash_file = event_writer.write_event(result)
 
-        # Log the data
-        if logger:
-            logger.debug("Wrote stash file=%s", writer.write_event(result))
+        # Log that we performed the scan
+        if logger and stash_file is not None:
+            logger.debug("Wrote stash file=%s", stash_file)
 
-    return result
+    def write_result(scanned_host, scanned_port, status):
+        """
+        Write the event as a stash new file as each scan completes.
+        """
 
-def portscan(host, ports="22,80,443,3389", index=None, sourcetype="portscan", source="portscan_search_command", logger=None, timeout=5, unique_id=None):
-    """
-    Perform a port scan against the given host
-    """
+        if writer is not None:
+            write_event(writer, make_port_scan_result(scanned_host, scanned_port, status))
 
-    results = port_scan(host, ports, timeout=timeout)
+    def write_discovery_result(discovered_host, status, method):
+        """
+        Write an event noting whether the host is up.
+        """
 
-    # Write the event as a stash new file
-    if index is not None:
-        writer = StashNewWriter(index=index, source_name=source, sourcetype=sourcetype,
-                                file_extension=".stash_output")
+        if logger:
+            logger.debug("Host discovery completed, dest=%s, status=%s, method=%s", discovered_host, status, method)
 
-        if unique_id is None:
-            unique_id = binascii.b2a_hex(os.urandom(4))
+        if discovery_writer is not None:
+            write_event(discovery_writer, make_discovery_result(discovered_host, status, method))
 
-        # Log that we performed the scan
+    try:
+        results = port_scan(host, ports, callback=write_result, timeout=timeout, discovery=discovery,
+                            discovery_ports=discovery_ports, discovery_callback=write_discovery_result)
+    finally:
+        for event_writer in (discovery_writer, writer):
+            if event_writer is not None:
+                flush_event_writer(event_writer, logger)
+
+    if unique_id is not None:
         for result in results:
             result['unique_id'] = unique_id
-            if logger:
-                logger.debug("Wrote stash file=%s", writer.write_event(result))
-            else:
-                writer.write_event(result)
 
     return results
@@ -0,0 +1,146 @@
+"""
+This module provides a way to load reference datasets (such as the lists of countries and
+airports used when parsing whois responses) from a precompiled copy.
+
+Parsing the source files (CSV or XML) takes much longer than loading the same data with marshal so
+the parsed data is saved to the __pycache__ directory next to the source files and loaded in a
+single read afterwards. Like Python's own .pyc files, the compiled copy is rebuilt automatically
+when any of the source files change.
+
+Here is a sample of loading a dataset:
+
+from network_tools_app.compiled_data import load_compiled
+
+def read_countries():
+    countries = {}
+
+    with open('/path/to/countries.csv') as countries_file:
+        for row in csv.reader(countries_file):
+            countries[row[0]] = row[1]
+
+    return countries
+
+countries = load_compiled('countries', ['/path/to/countries.csv'], read_countries)
+"""
+
+import os
+import sys
+import marshal
+
+# The format of marshal changes between versions of Python so each version gets its own copy
+CACHE_TAG = 'py%i%i' % sys.version_info[:2]
+
+def get_compiled_path(name, source_path):
+    """
+    Get the path of the compiled copy of the dataset.
+
+    Arguments:
+    name -- the name of the dataset
+    source_path -- the path of one of the source files (the copy is stored next to it)
+    """
+
+    return os.path.join(os.path.dirname(os.path.abspath(source_path)), '__pycache__',
+                        '%s.%s.marshal' % (name, CACHE_TAG))
+
+def get_source_signature(source_paths):
+    """
+    Get a value that identifies the current version of the source files (which changes when any of
+    them are modified).
+
+    Arguments:
+    source_paths -- the paths of the source files
+    """
+
+    signature = []
+
+    for source_path in source_paths:
+        try:
+            stat = os.stat(source_path)
+            signature.append((os.path.basename(source_path), stat.st_mtime, stat.st_size))
+        except OSError:
+            # The dataset may be built without the missing file (it will be rebuilt once it exists)
+            signature.append((os.path.basename(source_path), None, None))
+
+    return tuple(signature)
+
+def read_compiled(compiled_path, signature):
+    """
+    Load the compiled copy of the dataset. None will be returned if the copy doesn't exist or is
+    out of date.
+
+    Arguments:
+    compiled_path -- the path of the compiled copy
+    signature -- the signature of the current version of the source files
+    """
+
+    try:
+        with open(compiled_path, 'rb') as compiled_file:
+            compiled_signature, data = marshal.loads(compiled_file.read())
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        # The copy doesn't exist or is corrupt
+        return None
+
+    if compiled_signature != signature:
+        return None
+
+    return data
+
+def write_compiled(compiled_path, signature, data):
+    """
+    Save the compiled copy of the dataset. Failures are ignored since the app directory may not be
+    writable (the dataset will just be parsed every time).
+
+    Arguments:
+    compiled_path -- the path of the compiled copy
+    signature -- the signature of the source files that the data was built from
+    data -- the dataset (must only contain types that marshal supports)
+    """
+
+    # Write to a temporary file first so that other processes never read a partial copy
+    temporary_path = '%s.%i.tmp' % (compiled_path, os.getpid())
+
+    try:
+        directory = os.path.dirname(compiled_path)
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(temporary_path, 'wb') as compiled_file:
+            compiled_file.write(marshal.dumps((signature, data)))
+
+        # Python 2 doesn't have os.replace() and os.rename() won't overwrite a file on Windows
+        if hasattr(os, 'replace'):
+            os.replace(temporary_path, compiled_path)
+        else:
+            if os.path.exists(compiled_path):
+                os.remove(compiled_path)
+
+            os.rename(temporary_path, compiled_path)
+
+    except (IOError, OSError):
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+
+def load_compiled(name, source_paths, build_function):
+    """
+    Load the dataset from the compiled copy, building it from the source files (and saving the
+    copy) if the copy doesn't exist or the source files changed.
+
+    Arguments:
+    name -- the name of the dataset (used for the file name of the compiled copy)
+    source_paths -- the paths of the files that the dataset is built from
+    build_function -- a function that parses the source files and returns the dataset
+    """
+
+    signature = get_source_signature(source_paths)
+    compiled_path = get_compiled_path(name, source_paths[0])
+
+    data = read_compiled(compiled_path, signature)
+
+    if data is None:
+        data = build_function()
+        write_compiled(compiled_path, signature, data)
+
+    return data
@@ -45,13 +45,21 @@ EchoLookup.main()
 
 import csv
 import sys
+import json
 import time
 import logging
 from logging import handlers
 import threading
 
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
 from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
 
+from network_tools_app.result_cache import ResultCache
+
 # Python 2+3 basestring
 try:
     basestring
@@ -59,9 +67,21 @@ except:
     basestring = str
 
 
+class LookupResult(dict):
+    """
+    The output of a lookup along with the number of seconds that it can be cached for. Lookups can
+    return this from do_lookup() when the lifetime of the result is known (such as the TTL of DNS
+    records).
+    """
+
+    def __init__(self, output=None, ttl=None):
+        dict.__init__(self, output or {})
+        self.ttl = ttl
+
+
 class CustomLookup(object):
 
-    def __init__(self, fieldnames=None, logger_name='custom_lookup_command', log_level=logging.INFO, thread_limit=25):
+    def __init__(self, fieldnames=None, logger_name='custom_lookup_command', log_level=logging.INFO, thread_limit=25, cache_ttl=None, cache_path=None):
         """
         Constructs an instance of the lookup command.
 
@@ -69,6 +89,9 @@ class CustomLookup(object):
         fieldnames -- A list of the field names that the command will output
         logger_name -- The logger name to append to the logger
         log_level -- The log level to use for the logger
+        thread_limit -- The number of lookups to run at once
+        cache_ttl -- The number of seconds to cache the results for (None disables the cache)
+        cache_path -- The path of the result cache (defaults to a file under $SPLUNK_HOME/var)
         """
 
         # Check and save the logger name
@@ -94,7 +117,19 @@ class CustomLookup(object):
         self.thread_limit = thread_limit
         self.threads = []
         self.lock = threading.RLock()
-        self.semaphore = threading.BoundedSemaphore(self.thread_limit)
+
+        # This tracks the lookups in progress so that rows with the same arguments only cause a
+        # single lookup. The rows waiting on each lookup are kept in pending (keyed by the
+        # arguments) until the lookup completes; the output isn't kept afterwards so that memory
+        # stays bounded on large inputs (rows that arrive later are served by the result cache).
+        self.pending = {}
+        self.lookup_count = 0
+
+        # The results are cached across invocations since every search runs the lookup in a new
+        # process
+        self.cache_ttl = cache_ttl
+        self.cache_path = cache_path
+        self._cache = None
 
     @property
     def logger(self):
@@ -125,12 +160,47 @@ class CustomLookup(object):
     def logger(self, logger):
         self._logger = logger
 
+    @property
+    def cache(self):
+        """
+        A property that returns the result cache (or None if caching is disabled).
+        """
+
+        if self.cache_ttl is None:
+            return None
+
+        with self.lock:
+            if self._cache is None:
+                self._cache = ResultCache(self.cache_path, logger=self.logger)
+
+        return self._cache
+
+    def get_cache_ttl(self, output):
+        """
+        Get the number of seconds that the output of a lookup can be cached for.
+        """
+
+        ttl = getattr(output, 'ttl', None)
+
+        if ttl is not None:
+            return ttl
+
+        return self.cache_ttl
+
     def do_lookup(self, *args, **kwargs):
         """
         This is the function that performs the lookup. It must be sub-classed.
         """
         raise Exception("do_lookup needs to be implemented")
 
+    def on_cache_hit(self, output, *args, **kwargs):
+        """
+        This is called with the arguments of the lookup when its output is loaded from the cache
+        instead of calling do_lookup(). Sub-classes can override this to repeat the side effects of
+        the lookup (such as indexing the result).
+        """
+        pass
+
     def extend_fieldnames(self, fieldnames):
         """
         Extends the list of fieldnames with those that the lookup will create.
@@ -196,37 +266,108 @@ class CustomLookup(object):
             else:
                 raise e
 
-    def execute_lookup(self, input_row, output_csv, fieldnames):
+    def get_lookup_arguments(self, input_row):
         """
-        Execute the lookup command on the given row and put the result in the output
+        Get the keyword arguments for the lookup call from the input row.
         """
 
-        # Try to acquire the semaphore which enforces the thread limit
-        with self.semaphore:
+        # This contains a list of the fields to perform an operation on (like "host")
+        args = sys.argv[1:]
+
+        # Make up the arguments for the lookup call
+        keyword_arguments = {}
+
+        for parameter_name in args:
+            keyword_arguments[parameter_name] = input_row.get(parameter_name, None)
 
-            # This contains a list of the fields to perform an operation on (like "host")
-            args = sys.argv[1:]
+        return keyword_arguments
+
+    def run_lookup(self, keyword_arguments):
+        """
+        Perform the lookup and return the output. None will be returned if the lookup failed so
+        that the rows are still written.
+        """
 
-            # Make up the arguments for the lookup call
-            keyword_arguments = {}
+        cache = self.cache
 
-            for parameter_name in args:
-                keyword_arguments[parameter_name] = input_row.get(parameter_name, None)
+        if cache is not None:
+            cache_key = json.dumps(keyword_arguments, sort_keys=True)
+            output = cache.get(self.logger_name, cache_key)
 
-            # Perform the lookup
+            if output is not None:
+                try:
+                    self.on_cache_hit(output, **keyword_arguments)
+                except Exception:
+                    self.logger.exception("Processing of the cached output failed, arguments=%r", keyword_arguments)
+
+                return output
+
+        try:
             output = self.do_lookup(**keyword_arguments)
+        except Exception:
+            self.logger.exception("Lookup failed, arguments=%r", keyword_arguments)
+            return None
+
+        # Failed lookups aren't cached so that they are tried again next time
+        if cache is not None and output:
+            cache.set(self.logger_name, cache_key, output, self.get_cache_ttl(output))
+
+        return output
+
+    def write_row(self, input_row, output, output_csv, fieldnames):
+        """
+        Put the output in the row and write it out.
+        """
+
+        # Put the output in the result
+        if output:
+            self.add_result(input_row, output, fieldnames, False)
+
+        # Write out the result
+        with self.lock:
+            output_csv.writerow(input_row)
+
+    def execute_lookup(self, lookup_key, output_csv, fieldnames):
+        """
+        Execute the lookup for the given arguments and write out every row that is waiting on it.
+        """
+
+        output = self.run_lookup(dict(lookup_key))
 
-            # Put the output in the result
-            if output:
-                self.add_result(input_row, output, fieldnames, False)
+        with self.lock:
+            self.lookup_count += 1
+            input_rows = self.pending.pop(lookup_key)
 
-            # Write out the result
-            with self.lock:
-                output_csv.writerow(input_row)
+            for input_row in input_rows:
+                self.write_row(input_row, output, output_csv, fieldnames)
+
+    def submit_row(self, input_row, output_csv, fieldnames, work_queue=None):
+        """
+        Have the row wait on the lookup for its arguments (which will be started if it isn't
+        already running).
+        """
+
+        lookup_key = tuple(sorted(self.get_lookup_arguments(input_row).items()))
+
+        with self.lock:
+            if lookup_key in self.pending:
+                self.pending[lookup_key].append(input_row)
+                return
+
+            self.pending[lookup_key] = [input_row]
+
+        # Perform the lookup (outside of the lock since the queue may be full)
+        if work_queue is None:
+            self.execute_lookup(lookup_key, output_csv, fieldnames)
+        else:
+            work_queue.put(lookup_key)
 
     def execute(self):
         """
         Execute the lookup command based on the values from standard input and output.
+
+        The lookups are run by a fixed number of threads (see thread_limit) and rows with the same
+        arguments share a single lookup. Rows are written out as their lookups complete.
         """
 
         self.logger.info("Starting lookup execution")
@@ -249,23 +390,42 @@ class CustomLookup(object):
         w = csv.DictWriter(outfile, fieldnames=fieldnames)
         w.writeheader()
 
-        # Process each result
-        for result in r:
-  
-            if self.thread_limit <= 1:
-                self.execute_lookup(result, w, fieldnames)
-            else:
+        # Process each result in this thread if threading isn't requested
+        if self.thread_limit <= 1:
+            for result in r:
+                self.submit_row(result, w, fieldnames)
+
+        else:
+            # The queue is bounded so that a large input isn't read into memory ahead of the lookups
+            work_queue = Queue(maxsize=self.thread_limit * 2)
+
+            def worker():
+                while True:
+                    lookup_key = work_queue.get()
 
-                def do_lookup(result):
-                    self.execute_lookup(result, w, fieldnames)
+                    if lookup_key is None:
+                        return
 
-                # Start a thread
-                new_thread = threading.Thread(name='ping_lookup', target=do_lookup, args=[result])
+                    self.execute_lookup(lookup_key, w, fieldnames)
+
+            for _ in range(self.thread_limit):
+                new_thread = threading.Thread(name='lookup_worker', target=worker)
+                new_thread.daemon = True
                 self.threads.append(new_thread)
                 new_thread.start()
 
-        # Wait for the threads to complete before moving on
-        for thread in self.threads:
-            thread.join()
+            for result in r:
+                self.submit_row(result, w, fieldnames, work_queue)
+
+            # Wait for the threads to complete before moving on
+            for _ in self.threads:
+                work_queue.put(None)
+
+            for thread in self.threads:
+                thread.join()
 
-        self.logger.info("Lookup completed, runtime=%ss", round(time.time() - start_time, 2))
+        if self._cache is not None:
+            self._cache.close()
+            self.logger.info("Lookup completed, lookup_count=%i, cache_hits=%i, cache_misses=%i, runtime=%ss", self.lookup_count, self._cache.hits, self._cache.misses, round(time.time() - start_time, 2))
+        else:
+            self.logger.info("Lookup completed, lookup_count=%i, runtime=%ss", self.lookup_count, round(time.time() - start_time, 2))
@@ -7,14 +7,42 @@ from event_writer import StashNewWriter
 
 writer = StashNewWriter(index='summary', source_name='test_of_event_writer')
 writer.write_event({'message': 'here is an event'})
+
+Use the BufferedStashNewWriter in order to write many events to a single stash file:
+
+from event_writer import BufferedStashNewWriter
+
+with BufferedStashNewWriter(index='summary', source_name='test_of_event_writer') as writer:
+    for port in range(1, 1024):
+        writer.write_event({'port': port})
+
+Use the HECEventWriter in order to send the events to an HTTP Event Collector instead:
+
+from event_writer import HECEventWriter
+
+with HECEventWriter('https://localhost:8088', token, index='summary', source_name='test_of_event_writer') as writer:
+    writer.write_event({'message': 'here is an event'})
 """
 
 from datetime import datetime, timedelta, tzinfo
+import os
 import time
 import random
 import re
+import json
+import zlib
+import socket
+import threading
+from collections import OrderedDict
 from splunk.clilib.bundle_paths import make_splunkhome_path
 
+try:
+    from urlparse import urlparse
+    from Queue import Queue
+except ImportError:
+    from urllib.parse import urlparse
+    from queue import Queue
+
 try:
     basestring
 except:
@@ -42,6 +70,17 @@ class EventWriter(object):
     """
     The event writer class provides a mechanism for writing out events directly to Splunk.
     """
+
+    # These are the formats that events can be written in: key/value pairs (the default) or JSON
+    KV_FORMAT = "kv"
+    JSON_FORMAT = "json"
+    EVENT_FORMATS = [KV_FORMAT, JSON_FORMAT]
+
+    event_format = KV_FORMAT
+
+    # These are populated as events are written (see get_field_name() and get_event_time())
+    field_name_cache = None
+    event_time_cache = None
     # Below is a dictionary that maps special field names to the one that should be used in the
     # summary indexed event. Note: a value of None will prevent the field from being persisted.
     SPECIAL_FIELDS_MAP = {
@@ -102,81 +141,188 @@ class EventWriter(object):
         raise NotImplementedError("The write_events function must be implemented by sub-classes \
         of EventWriter")
 
-    def event_to_string(self, result, event_time=None, ignore_empty_fields=True):
+    def get_field_name(self, name):
         """
-        Produces a single line event that represents a single event (for the stash).
+        Get the name that the field should be persisted with or None if the field should be
+        excluded. The names are cached since the same fields are written over and over.
+
+        Arguments:
+        name -- field name to convert
+        """
+
+        if self.field_name_cache is None:
+            self.field_name_cache = {}
+
+        try:
+            return self.field_name_cache[name]
+        except KeyError:
+            pass
+
+        # Escape special fields that Splunk will overwrite
+        converted_name = self.convert_special_fields(name)
+
+        # Do not include fields whose name is empty or none since this indicates that the field
+        # should not be included at all. Underscore fields are meta fields that should not be
+        # included either.
+        if converted_name is None or len(converted_name) == 0 or converted_name.startswith("_"):
+            converted_name = None
+
+        self.field_name_cache[name] = converted_name
+
+        return converted_name
+
+    def get_event_time(self, event_time=None):
+        """
+        Get the timestamp string (e.g. 05/13/2011 14:35:00 UTC) and the epoch time of the event.
+        These are cached since consecutive events are usually written within the same second.
 
         Arguments:
-        result -- a Splunk search result
         event_time -- The time of the event (defaults to the current time)
-        ignore_empty_fields -- Do not include arguments whose value is empty
         """
 
         # Populate the event time if not provided
         if event_time is None:
             event_time = datetime.now(utc)
 
-        # Get the timestamp formatted correctly for Splunk (e.g. 05/13/2011 14:35:00)
-        date_str = event_time.strftime("%m/%d/%Y %H:%M:%S UTC")
+        second = event_time.replace(microsecond=0)
+        cached = self.event_time_cache
+
+        if cached is None or cached[0] != second:
+            # Get the timestamp formatted correctly for Splunk (e.g. 05/13/2011 14:35:00)
+            cached = (second, event_time.strftime("%m/%d/%Y %H:%M:%S UTC"),
+                      time.mktime(event_time.timetuple()))
+
+            self.event_time_cache = cached
+
+        return cached[1], cached[2]
+
+    def event_to_string(self, result, event_time=None, ignore_empty_fields=True):
+        """
+        Produces a single line event that represents a single event (for the stash).
+
+        Arguments:
+        result -- a Splunk search result
+        event_time -- The time of the event (defaults to the current time)
+        ignore_empty_fields -- Do not include arguments whose value is empty
+        """
+
+        date_str, epoch_time = self.get_event_time(event_time)
 
         # Start the event with the date
-        event = date_str
+        parts = [date_str]
 
         # Get the fields that should be included with every event
         basic_fields = self.get_basic_fields(result)
 
         # Set the time to the current time
-        basic_fields["_time"] = time.mktime(event_time.timetuple())
+        basic_fields["_time"] = epoch_time
 
         for key in basic_fields:
-            event = event + ", %s=\"%s\"" % (key, basic_fields[key])
+            parts.append(', %s="%s"' % (key, basic_fields[key]))
 
-        # Add the event fields
-        for key in result:
+        # Add the event fields; multiple values are written out as separate key/value pairs
+        field_names = self.field_name_cache or {}
+        append = parts.append
 
-            # Escape special fields that Splunk will overwrite
-            converted_key = self.convert_special_fields(key)
+        for key in result:
+            converted_key = field_names.get(key, False)
 
-            # Do not include fields whose name is empty or none since this indicates that the field
-            # should not be included at all
-            if converted_key is None or len(converted_key) == 0:
-                pass #Do nothing, this field will be excluded
+            if converted_key is False:
+                converted_key = self.get_field_name(key)
+                field_names = self.field_name_cache
 
-            # Make sure the field is not an underscore field (these are meta fields that should not
-            # be included)
-            elif converted_key.startswith("_"):
-                pass #Do nothing, this field will be excluded
+            if converted_key is None:
+                continue
 
-            # The field has a single value, write it out
-            elif not isinstance(result[key], list) or isinstance(result[key], basestring):
+            value = result[key]
+            values = value if isinstance(value, list) else (value,)
 
-                result_value = str(result[key])
+            for value in values:
+                value = str(value)
 
                 # If the field is blank then do not include it if we are supposed to exclude it
-                if len(result_value) <= 0 and ignore_empty_fields == True:
-                    pass # Ignore this field and continue to the next field value
-                else:
-                     #TODO: need to figure out if field names must be escaped
-                    event = event + ", %s=\"%s\"" % (converted_key, self.escape_value(result_value))
+                if ignore_empty_fields and not value:
+                    continue
 
-            # The field name has multiple values, write out multiple key/value pairs accordingly.
-            else:
-                values = result[key]
+                #TODO: need to figure out if field names must be escaped
+                if '\\' in value or '"' in value:
+                    value = self.escape_value(value)
 
-                # Add each value as a separate field
-                for value in values:
+                append(', %s="%s"' % (converted_key, value))
 
-                    value = str(value)
+        # Return the resulting event
+        return "".join(parts)
 
-                    # If the field is blank then do not include it if we are supposed to exclude it
-                    if len(value) <= 0 and ignore_empty_fields:
-                        pass # Ignore this field and continue to the next field value
-                    else:
-                        event = event + ", %s=\"%s\"" % (converted_key, self.escape_value(value))
+    def event_to_json(self, result, event_time=None, ignore_empty_fields=True):
+        """
+        Produces a single line JSON object that represents a single event. Fields with multiple
+        values are written as arrays.
+
+        Arguments:
+        result -- a Splunk search result
+        event_time -- The time of the event (defaults to the current time)
+        ignore_empty_fields -- Do not include arguments whose value is empty
+        """
+
+        return json.dumps(self.event_to_dict(result, event_time, ignore_empty_fields),
+                          separators=(',', ':'))
+
+    def event_to_dict(self, result, event_time=None, ignore_empty_fields=True):
+        """
+        Produces the dictionary that is written out as JSON for an event (see event_to_json()).
+
+        Arguments:
+        result -- a Splunk search result
+        event_time -- The time of the event (defaults to the current time)
+        ignore_empty_fields -- Do not include arguments whose value is empty
+        """
+
+        _, epoch_time = self.get_event_time(event_time)
+
+        # The time is first so that Splunk finds it when extracting the timestamp
+        event = OrderedDict()
+        event["_time"] = epoch_time
+        event.update(self.get_basic_fields(result))
+
+        for key in result:
+            converted_key = self.get_field_name(key)
+
+            if converted_key is None:
+                continue
+
+            value = result[key]
+
+            # If the field is blank then do not include it if we are supposed to exclude it
+            if isinstance(value, list):
+                value = [str(entry) for entry in value]
+
+                if ignore_empty_fields:
+                    value = [entry for entry in value if entry]
+
+                if value:
+                    event[converted_key] = value
+            else:
+                value = str(value)
+
+                if value or not ignore_empty_fields:
+                    event[converted_key] = value
 
-        # Return the resulting event
         return event
 
+    def format_event(self, result, event_time=None):
+        """
+        Produces the string for the event in the format of the writer (see event_format).
+
+        Arguments:
+        result -- a Splunk search result
+        event_time -- The time of the event (defaults to the current time)
+        """
+
+        if self.event_format == self.JSON_FORMAT:
+            return self.event_to_json(result, event_time)
+        else:
+            return self.event_to_string(result, event_time)
+
     def flush(self):
         """
         Some event writers may need to cache the events and send them in one burst (as opposed to
@@ -238,7 +384,8 @@ class StashNewWriter(EventWriter):
     ==##~~##~~  1E8N3D4E6V5E7N2T9 ~~##~~##==
     """
 
-    def __init__(self, index, source_name, file_extension=".stash_new", sourcetype=None, host=None):
+    def __init__(self, index, source_name, file_extension=".stash_new", sourcetype=None, host=None,
+                 event_format=EventWriter.KV_FORMAT):
         """
         Constructor for the stash writer,=.
 
@@ -248,6 +395,7 @@ class StashNewWriter(EventWriter):
         file_extension -- the extension of the stash file (usually .stash_new)
         sourcetype -- the sourcetype to use for the event
         host -- the host to assign the event to
+        event_format -- the format to write the events in (kv or json)
         """
         self.index = index
         self.source_name = source_name
@@ -255,6 +403,11 @@ class StashNewWriter(EventWriter):
         self.sourcetype = sourcetype
         self.host = host
 
+        if event_format not in self.EVENT_FORMATS:
+            raise ValueError("The event format must be one of: %s" % ", ".join(self.EVENT_FORMATS))
+
+        self.event_format = event_format
+
     def make_fields_list(self, fields_dict):
         """
         Make a string with the list of fields in KV format.
@@ -310,6 +463,15 @@ class StashNewWriter(EventWriter):
 
         return stash_file
 
+    def get_temporary_directory(self):
+        """
+        Get the directory that stash files are written to before they are moved into the spool
+        directory. This is next to the spool directory (so that the files can be renamed into it)
+        but isn't monitored by Splunk.
+        """
+
+        return make_splunkhome_path(["var", "spool", "network_tools"])
+
     def write_events(self, array_of_events, is_raw_string=False):
         """
         Writes the provided events (as dictionaries) to a stash file and returns the name of the
@@ -320,36 +482,497 @@ class StashNewWriter(EventWriter):
         is_raw_string -- indicates if the events should be written as raw strings
         """
 
-        # Open the stash file
-        stash_file = self.get_file_name()
-        stash_file_h = open(stash_file, 'a')
+        if is_raw_string:
+            event_strings = array_of_events
+        else:
+            event_strings = [self.format_event(event) for event in array_of_events]
+
+        return self.write_stash_file(event_strings)
+
+    def write_stash_file(self, event_strings):
+        """
+        Writes the provided events (already converted to strings) to a new stash file and returns
+        the name of the file written.
 
-        # Write the header
-        stash_file_h.write(self.get_header())
+        Arguments:
+        event_strings -- a list of the events as strings
+        """
 
-        # Write the line_breaker
-        stash_file_h.write(self.LINE_BREAKER)
-        stash_file_h.write("\n")
+        # Assemble the file contents so that the file is written in a single call
+        content = [self.get_header()]
 
-        if self.sourcetype is not None:
-            stash_file_h.write('sourcetype=\"' + self.sourcetype + '\"')
+        # Each event is preceded by the line-breaker and the sourcetype since props.conf breaks
+        # the events on the line-breaker and extracts the sourcetype from each event
+        for event in event_strings:
+            content.append(self.LINE_BREAKER)
+            content.append("\n")
 
-        # Write out the events
-        for event in array_of_events:
+            if self.sourcetype is not None:
+                content.append('sourcetype=\"' + self.sourcetype + '\"')
 
-            if is_raw_string:
-                stash_file_h.write(event)
-            else:
-                stash_file_h.write(self.event_to_string(event))
+            content.append(event)
+            content.append("\n")
 
-            stash_file_h.write("\n")
+        # Write the stash file outside of the spool directory and then move it into place so that
+        # Splunk never picks up a partially written file
+        stash_file = self.get_file_name()
+        temporary_directory = self.get_temporary_directory()
+
+        if not os.path.isdir(temporary_directory):
+            try:
+                os.makedirs(temporary_directory)
+            except OSError:
+                # Another process may have created it at the same time
+                if not os.path.isdir(temporary_directory):
+                    raise
+
+        temporary_file = os.path.join(temporary_directory, os.path.basename(stash_file))
 
-        # Close the file
-        stash_file_h.close()
+        with open(temporary_file, 'w') as stash_file_h:
+            stash_file_h.write("".join(content))
+
+        os.rename(temporary_file, stash_file)
 
         # Return the file name.
         return stash_file
 
+class BufferedStashNewWriter(StashNewWriter):
+    """
+    A stash writer that accumulates events and writes them to a single stash file once enough have
+    been buffered (by count, by size or by age) or when flush() is called. This avoids creating a
+    tiny stash file for every event when many events are written (such as for port scans).
+
+    This writer can be shared between threads. Make sure to call flush() (or use the writer as a
+    context manager) once done so that the remaining events are written.
+    """
+
+    DEFAULT_MAX_EVENTS = 1000
+    DEFAULT_MAX_BYTES = 1024 * 1024
+    DEFAULT_MAX_DELAY = 5
+
+    def __init__(self, index, source_name, file_extension=".stash_new", sourcetype=None, host=None,
+                 event_format=EventWriter.KV_FORMAT, max_events=DEFAULT_MAX_EVENTS,
+                 max_bytes=DEFAULT_MAX_BYTES, max_delay=DEFAULT_MAX_DELAY):
+        """
+        Constructor for the buffered stash writer.
+
+        Arguments:
+        index -- the index to send the events to
+        source_name -- the search that is being used to generate the results
+        file_extension -- the extension of the stash file (usually .stash_new)
+        sourcetype -- the sourcetype to use for the event
+        host -- the host to assign the event to
+        event_format -- the format to write the events in (kv or json)
+        max_events -- the number of buffered events that causes the buffer to be written
+        max_bytes -- the size of the buffered events that causes the buffer to be written
+        max_delay -- the number of seconds after which buffered events will be written once
+                     another event is written
+        """
+
+        StashNewWriter.__init__(self, index, source_name, file_extension, sourcetype, host,
+                                event_format)
+
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+
+        self.lock = threading.RLock()
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.first_buffered_at = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def write_events(self, array_of_events, is_raw_string=False):
+        """
+        Adds the provided events (as dictionaries) to the buffer. The name of the stash file will be
+        returned if the buffer was written; otherwise, None will be returned.
+
+        Arguments:
+        array_of_events -- an array of Splunk search results
+        is_raw_string -- indicates if the events should be written as raw strings
+        """
+
+        # Convert the events outside of the lock so that threads don't wait on each other
+        if is_raw_string:
+            event_strings = list(array_of_events)
+        else:
+            event_strings = [self.format_event(event) for event in array_of_events]
+
+        with self.lock:
+            if self.first_buffered_at is None:
+                self.first_buffered_at = time.time()
+
+            self.buffer.extend(event_strings)
+            self.buffered_bytes += sum([len(event) + 1 for event in event_strings])
+
+            if len(self.buffer) >= self.max_events or self.buffered_bytes >= self.max_bytes \
+               or time.time() - self.first_buffered_at >= self.max_delay:
+                return self.flush()
+
+        return None
+
+    def flush(self):
+        """
+        Writes the buffered events to a stash file and returns the name of the file written (or
+        None if no events were buffered).
+        """
+
+        with self.lock:
+            if not self.buffer:
+                return None
+
+            event_strings = self.buffer
+
+            self.buffer = []
+            self.buffered_bytes = 0
+            self.first_buffered_at = None
+
+            return self.write_stash_file(event_strings)
+
+def load_http_client():
+    """
+    Import the HTTP client. This is done on first use since only the HECEventWriter needs it and it
+    is slow to load (along with ssl).
+    """
+
+    try:
+        import httplib as http_client
+    except ImportError:
+        import http.client as http_client
+
+    return http_client
+
+class HECException(Exception):
+    """
+    Events could not be delivered to the HTTP Event Collector.
+    """
+
+class StopSender(object):
+    """
+    Placed on the queue to tell a sender thread that there is nothing left to send.
+    """
+
+class HECEventWriter(EventWriter):
+    """
+    The HEC writer class sends events to a Splunk HTTP Event Collector (HEC) endpoint.
+
+    Events are batched and posted (gzip compressed) by a small pool of sender threads that each
+    keep a persistent connection open. At most max_queued_batches batches wait to be sent; writing
+    blocks once the queue is full so that memory use stays bounded if the collector falls behind.
+    Failed posts are retried with exponential backoff.
+
+    Make sure to call flush() (or use the writer as a context manager) once done. flush() raises
+    a HECException if any events could not be delivered.
+    """
+
+    DEFAULT_MAX_EVENTS = 500
+    DEFAULT_MAX_BYTES = 1024 * 1024
+    DEFAULT_MAX_QUEUED_BATCHES = 10
+    DEFAULT_CONNECTION_COUNT = 2
+    DEFAULT_MAX_RETRIES = 3
+    DEFAULT_BACKOFF = 0.5
+    DEFAULT_TIMEOUT = 30
+
+    # This is the path of the collector endpoint that is used if the URL doesn't include one
+    ENDPOINT = "/services/collector/event"
+
+    # These are the HTTP status codes that indicate that the post can be tried again
+    RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, url, token, index=None, source_name=None, sourcetype=None, host=None,
+                 event_format=EventWriter.KV_FORMAT, verify_ssl=True, use_gzip=True,
+                 max_events=DEFAULT_MAX_EVENTS, max_bytes=DEFAULT_MAX_BYTES,
+                 max_queued_batches=DEFAULT_MAX_QUEUED_BATCHES,
+                 connection_count=DEFAULT_CONNECTION_COUNT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff=DEFAULT_BACKOFF, timeout=DEFAULT_TIMEOUT):
+        """
+        Constructor for the HEC writer.
+
+        Arguments:
+        url -- the URL of the collector (e.g. https://localhost:8088)
+        token -- the HEC token
+        index -- the index to send the events to (the token's default index is used if None)
+        source_name -- the source to assign the events to
+        sourcetype -- the sourcetype to use for the events
+        host -- the host to assign the events to
+        event_format -- the format to send the events in (kv or json)
+        verify_ssl -- indicates whether the collector's certificate ought to be verified
+        use_gzip -- indicates whether the requests ought to be gzip compressed
+        max_events -- the number of events to send in each request
+        max_bytes -- the size of the events (uncompressed) that causes a request to be sent
+        max_queued_batches -- the maximum number of batches waiting to be sent
+        connection_count -- the number of connections (and sender threads) to use
+        max_retries -- the number of times to retry a failed request
+        backoff -- the number of seconds to wait before the first retry (doubled for each retry)
+        timeout -- the number of seconds to wait on the collector
+        """
+
+        if event_format not in self.EVENT_FORMATS:
+            raise ValueError("The event format must be one of: %s" % ", ".join(self.EVENT_FORMATS))
+
+        parsed_url = urlparse(url)
+
+        if parsed_url.scheme not in ("http", "https") or not parsed_url.hostname:
+            raise ValueError("The HEC URL is invalid: %s" % url)
+
+        self.url = url
+        self.token = token
+        self.index = index
+        self.source_name = source_name
+        self.sourcetype = sourcetype
+        self.host = host
+        self.event_format = event_format
+        self.verify_ssl = verify_ssl
+        self.use_gzip = use_gzip
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.connection_count = max(1, connection_count)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.scheme = parsed_url.scheme
+        self.hostname = parsed_url.hostname
+        self.port = parsed_url.port
+
+        if parsed_url.path in ("", "/"):
+            self.path = self.ENDPOINT
+        else:
+            self.path = parsed_url.path
+
+        # This lock guards the batch being assembled
+        self.lock = threading.RLock()
+        self.buffer = []
+        self.buffered_bytes = 0
+
+        self.queue = Queue(maxsize=max(1, max_queued_batches))
+        self.senders = []
+
+        # This lock guards the delivery statistics that are updated by the sender threads
+        self.stats_lock = threading.Lock()
+        self.sent_count = 0
+        self.failed_count = 0
+        self.errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def make_payload(self, event, is_raw_string=False):
+        """
+        Make the JSON payload that HEC expects for the event, including the metadata.
+
+        Arguments:
+        event -- a Splunk search result
+        is_raw_string -- indicates if the event should be sent as a raw string
+        """
+
+        payload = OrderedDict()
+        payload['time'] = "%.3f" % time.time()
+
+        for name, value in (('host', self.host), ('source', self.source_name),
+                            ('sourcetype', self.sourcetype), ('index', self.index)):
+            if value is not None:
+                payload[name] = value
+
+        if is_raw_string:
+            payload['event'] = event
+        elif self.event_format == self.JSON_FORMAT:
+            payload['event'] = self.event_to_dict(event)
+
+            # The time is provided in the metadata
+            del payload['event']['_time']
+        else:
+            payload['event'] = self.event_to_string(event)
+
+        return json.dumps(payload, separators=(',', ':'))
+
+    def write_events(self, array_of_events, is_raw_string=False):
+        """
+        Adds the provided events (as dictionaries) to the batch being assembled. The batch is
+        queued to be sent once it is large enough.
+
+        Arguments:
+        array_of_events -- an array of Splunk search results
+        is_raw_string -- indicates if the events should be written as raw strings
+        """
+
+        payloads = [self.make_payload(event, is_raw_string) for event in array_of_events]
+
+        with self.lock:
+            self.buffer.extend(payloads)
+            self.buffered_bytes += sum([len(payload) + 1 for payload in payloads])
+
+            if len(self.buffer) >= self.max_events or self.buffered_bytes >= self.max_bytes:
+                self.queue_batch()
+
+    def queue_batch(self):
+        """
+        Queue the batch being assembled to be sent. This blocks if the queue is full.
+        """
+
+        with self.lock:
+            if not self.buffer:
+                return
+
+            batch = self.buffer
+            self.buffer = []
+            self.buffered_bytes = 0
+
+            # Start the senders when the first batch is ready
+            while len(self.senders) < self.connection_count:
+                sender = threading.Thread(name='hec_sender', target=self.send_batches)
+                sender.daemon = True
+                self.senders.append(sender)
+                sender.start()
+
+            self.queue.put(batch)
+
+    def flush(self):
+        """
+        Send all of the events written so far and wait until they have been delivered. A
+        HECException will be raised if any events could not be delivered.
+        """
+
+        self.queue_batch()
+        self.queue.join()
+
+        with self.stats_lock:
+            failed_count = self.failed_count
+            errors = self.errors
+
+            self.failed_count = 0
+            self.errors = []
+
+        if failed_count > 0:
+            raise HECException("%i events could not be sent to the HTTP Event Collector at %s: %s" % (failed_count, self.url, errors[-1]))
+
+    def close(self):
+        """
+        Send the remaining events and stop the sender threads.
+        """
+
+        try:
+            self.flush()
+        finally:
+            with self.lock:
+                for _ in self.senders:
+                    self.queue.put(StopSender())
+
+                for sender in self.senders:
+                    sender.join()
+
+                self.senders = []
+
+    def make_connection(self):
+        """
+        Make a connection to the collector.
+        """
+
+        http_client = load_http_client()
+
+        if self.scheme == "http":
+            return http_client.HTTPConnection(self.hostname, self.port, timeout=self.timeout)
+
+        import ssl
+
+        if self.verify_ssl:
+            context = ssl.create_default_context()
+        else:
+            context = ssl._create_unverified_context()
+
+        return http_client.HTTPSConnection(self.hostname, self.port, timeout=self.timeout, context=context)
+
+    def send_batches(self):
+        """
+        Send the queued batches until told to stop (this is run by each sender thread). Each
+        sender keeps its connection open between requests.
+        """
+
+        connection = self.make_connection()
+
+        try:
+            while True:
+                batch = self.queue.get()
+
+                try:
+                    if isinstance(batch, StopSender):
+                        return
+
+                    self.send_batch(connection, batch)
+
+                # Don't let an unexpected error stop the sender; flush() would wait forever
+                except Exception as exception:
+                    with self.stats_lock:
+                        self.failed_count += len(batch)
+                        self.errors.append(str(exception))
+
+                finally:
+                    self.queue.task_done()
+        finally:
+            connection.close()
+
+    def send_batch(self, connection, batch):
+        """
+        Post the batch to the collector, retrying with backoff if the request fails.
+        """
+
+        body = "\n".join(batch).encode('utf-8')
+
+        headers = {
+            'Authorization': 'Splunk ' + self.token,
+            'Content-Type': 'application/json'
+        }
+
+        if self.use_gzip:
+            # A window size of 31 produces the gzip format
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            body = compressor.compress(body) + compressor.flush()
+            headers['Content-Encoding'] = 'gzip'
+
+        attempt = 0
+
+        while True:
+            retry = True
+
+            try:
+                connection.request('POST', self.path, body, headers)
+                response = connection.getresponse()
+
+                # Read the entire response so that the connection can be reused
+                response_body = response.read()
+
+                if response.status == 200:
+                    with self.stats_lock:
+                        self.sent_count += len(batch)
+
+                    return
+
+                error = "status=%i, response=%r" % (response.status, response_body[:200])
+                retry = response.status in self.RETRY_STATUS_CODES
+
+            except (socket.error, load_http_client().HTTPException, OSError) as exception:
+                # Reset the connection; it will be re-opened on the next request
+                connection.close()
+                error = str(exception)
+
+            if not retry or attempt >= self.max_retries:
+                with self.stats_lock:
+                    self.failed_count += len(batch)
+                    self.errors.append(error)
+
+                return
+
+            time.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
 class CachedWriter(EventWriter):
     """
     Stores the events in an variable so that they can be programmatically returned (useful for
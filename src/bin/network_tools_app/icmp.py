@@ -0,0 +1,566 @@
+"""
+This module implements an ICMP echo engine that pings many hosts concurrently from a single socket.
+
+Pinging via this module avoids forking the system ping command for every destination. It uses
+Linux's unprivileged ICMP datagram sockets (SOCK_DGRAM/IPPROTO_ICMP) when they are permitted by
+net.ipv4.ping_group_range and falls back to a raw socket otherwise (which requires root or
+CAP_NET_RAW). Only IPv4 is supported.
+
+Here is a sample of using the engine to ping a couple of hosts:
+
+from network_tools_app.icmp import ICMPEchoEngine
+
+engine = ICMPEchoEngine(timeout=2)
+results = engine.ping_hosts(['127.0.0.1', 'textcritical.net'], count=3)
+"""
+
+import os
+import sys
+import math
+import time
+import errno
+import select
+import socket
+import struct
+import platform
+import itertools
+import collections
+from timeit import default_timer as timer
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+DEFAULT_TIMEOUT = 2
+DEFAULT_INTERVAL = 1
+DEFAULT_MAX_OUTSTANDING = 512
+DEFAULT_PAYLOAD_SIZE = 56
+
+# This is the socket option that has the kernel timestamp each packet as it arrives (Python doesn't
+# define it). The value is only known for the Linux architectures that use the generic socket
+# options.
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', None)
+
+if SO_TIMESTAMPNS is None and sys.platform.startswith('linux') and \
+   (platform.machine() in ('x86_64', 'i386', 'i686', 'aarch64') or platform.machine().startswith('arm')):
+    SO_TIMESTAMPNS = 35
+
+# This is the layout of the timestamp (a struct timespec)
+TIMESPEC = struct.Struct('@ll')
+
+# Raw sockets receive every ICMP packet sent to the host so each engine needs its own identifier in
+# order to tell its replies apart from those of the other engines in this process
+identifier_offsets = itertools.count()
+
+# This caches whether ICMP sockets can be opened by this process
+icmp_available = None
+
+class ICMPSocketUnavailable(Exception):
+    """
+    Represents the inability to create a socket for sending ICMP echo requests.
+    """
+
+class Probe(object):
+    """
+    Represents a single echo request that was sent to a host.
+    """
+
+    def __init__(self, target, sequence, sent_at, deadline):
+        self.target = target
+        self.sequence = sequence
+        self.sent_at = sent_at
+        self.deadline = deadline
+
+class Target(object):
+    """
+    Represents a host being pinged along with the responses received so far.
+    """
+
+    def __init__(self, host, address, count, first_send_at, interval):
+        self.host = host
+        self.address = address
+        self.count = count
+        self.interval = interval
+        self.next_send_at = first_send_at
+
+        self.sent = 0
+        self.completed = 0
+        self.response_times = []
+        self.output = []
+        self.index = None
+
+    def is_done(self):
+        return self.completed >= self.count
+
+def checksum(data):
+    """
+    Computes the RFC 1071 internet checksum of the given bytes.
+    """
+
+    if len(data) % 2:
+        data += b'\x00'
+
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+
+    return ~total & 0xffff
+
+def make_echo_request(identifier, sequence, payload):
+    """
+    Build an ICMP echo request packet.
+    """
+
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    packet_checksum = checksum(header + payload)
+
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, packet_checksum, identifier, sequence) + payload
+
+def parse_echo_reply(packet, includes_ip_header):
+    """
+    Parse an ICMP packet and return a tuple of the identifier and the sequence if it is an echo
+    reply. None will be returned if the packet is something else.
+
+    Arguments:
+    packet -- the packet data received from the socket
+    includes_ip_header -- indicates if the packet starts with an IP header (raw sockets)
+    """
+
+    if includes_ip_header:
+        if len(packet) < 20:
+            return None
+
+        header_length = (struct.unpack('!B', packet[0:1])[0] & 0x0f) * 4
+        packet = packet[header_length:]
+
+    if len(packet) < 8:
+        return None
+
+    icmp_type, _, _, identifier, sequence = struct.unpack('!BBHHH', packet[0:8])
+
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+
+    return identifier, sequence
+
+def open_icmp_socket():
+    """
+    Open a socket for sending ICMP echo requests. This returns a tuple of the socket and a boolean
+    that indicates whether the socket is a raw socket.
+    """
+
+    # Try the unprivileged datagram socket first
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+    except (socket.error, OSError, AttributeError):
+        pass
+
+    # Fall back to a raw socket
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+    except (socket.error, OSError) as exception:
+        raise ICMPSocketUnavailable("Unable to open an ICMP socket: %s" % str(exception))
+
+def enable_kernel_timestamps(sock):
+    """
+    Have the kernel record the time that each packet arrives (see receive_packet()). This returns
+    False if the kernel timestamps are not supported.
+    """
+
+    if SO_TIMESTAMPNS is None or not hasattr(sock, 'recvmsg'):
+        return False
+
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        return True
+    except (socket.error, OSError):
+        return False
+
+def receive_packet(sock, kernel_timestamps):
+    """
+    Read a packet from the socket and return a tuple of the packet, the source address and the time
+    that the packet arrived (per timer()).
+
+    Arguments:
+    sock -- the socket to read from
+    kernel_timestamps -- True if enable_kernel_timestamps() succeeded on the socket
+    """
+
+    if not kernel_timestamps:
+        packet, source = sock.recvfrom(65535)
+        return packet, source, timer()
+
+    packet, ancdata, _, source = sock.recvmsg(65535, socket.CMSG_SPACE(TIMESPEC.size))
+    received_at = timer()
+
+    # The kernel's timestamp is in wall-clock time so convert it by how long ago it was
+    for level, cmsg_type, data in ancdata:
+        if level == socket.SOL_SOCKET and cmsg_type == SO_TIMESTAMPNS and len(data) >= TIMESPEC.size:
+            seconds, nanoseconds = TIMESPEC.unpack(data[:TIMESPEC.size])
+            received_at -= max(0, time.time() - (seconds + nanoseconds / 1e9))
+
+    return packet, source, received_at
+
+def is_available():
+    """
+    Determine if ICMP sockets can be opened by this process.
+    """
+
+    global icmp_available
+
+    if icmp_available is None:
+        try:
+            sock, _ = open_icmp_socket()
+            sock.close()
+            icmp_available = True
+        except ICMPSocketUnavailable:
+            icmp_available = False
+
+    return icmp_available
+
+def calculate_statistics(host, sent, response_times):
+    """
+    Make a dictionary of the ping statistics in the same format as pingparser.parse().
+
+    Arguments:
+    host -- the host that was pinged
+    sent -- the number of echo requests sent
+    response_times -- a list of the round-trip times in milliseconds of the replies received
+    """
+
+    received = len(response_times)
+
+    if sent > 0:
+        packet_loss = 100.0 * (sent - received) / sent
+    else:
+        packet_loss = 0
+
+    result = collections.OrderedDict()
+    result['host'] = host
+    result['sent'] = str(sent)
+    result['received'] = str(received)
+    result['packet_loss'] = '%g' % round(packet_loss, 1)
+
+    if received > 0:
+        avg_ping = sum(response_times) / received
+
+        # The jitter is the mean deviation, computed the way that the Linux ping command does
+        mdev = math.sqrt(max(sum([rtt * rtt for rtt in response_times]) / received - avg_ping * avg_ping, 0))
+
+        result['min_ping'] = '%.3f' % min(response_times)
+        result['avg_ping'] = '%.3f' % avg_ping
+        result['max_ping'] = '%.3f' % max(response_times)
+        result['jitter'] = '%.3f' % mdev
+    else:
+        result['min_ping'] = result['avg_ping'] = result['max_ping'] = result['jitter'] = 'NA'
+
+    return result
+
+class ICMPEchoEngine(object):
+    """
+    Sends ICMP echo requests to a series of hosts and matches up the replies using the identifier
+    and sequence number of each request. Hundreds of requests can be outstanding at one time on a
+    single socket.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, interval=DEFAULT_INTERVAL,
+                 max_outstanding=DEFAULT_MAX_OUTSTANDING, payload_size=DEFAULT_PAYLOAD_SIZE,
+                 logger=None):
+        """
+        Constructs an ICMP echo engine.
+
+        Arguments:
+        timeout -- the number of seconds to wait for a reply to each request
+        interval -- the number of seconds between the requests sent to the same host
+        max_outstanding -- the maximum number of requests awaiting a reply at any one time
+        payload_size -- the number of bytes of data to send in each request
+        logger -- the logger to write debug messages to
+        """
+
+        self.timeout = timeout
+        self.interval = interval
+        self.max_outstanding = max(1, min(max_outstanding, 65535))
+        self.payload = (b'network_tools' * (payload_size // 13 + 1))[:payload_size]
+        self.logger = logger
+
+        self.sequence = 0
+
+    def next_sequence(self, outstanding):
+        """
+        Get the next sequence number that doesn't collide with an outstanding request.
+        """
+
+        while True:
+            self.sequence = (self.sequence + 1) & 0xffff
+
+            if self.sequence not in outstanding:
+                return self.sequence
+
+    def ping(self, host, count=1):
+        """
+        Ping a single host and return a tuple of the output, the return code and the parsed
+        output (just like network_tools_app.ping()).
+        """
+
+        return self.ping_hosts([host], count)[0]
+
+    def ping_hosts(self, hosts, count=1, callback=None):
+        """
+        Ping the list of hosts concurrently. A list of tuples consisting of the output, the return
+        code and the parsed result is returned in the same order as the hosts provided.
+
+        Arguments:
+        hosts -- a list of the hosts to ping
+        count -- the number of echo requests to send to each host
+        callback -- a function to call with the host, output, return code and result as each host
+                    completes
+        """
+
+        results = [None] * len(hosts)
+
+        for index, host, output, return_code, parsed in self._iter_ping(enumerate(hosts), count):
+            results[index] = (output, return_code, parsed)
+
+            if callback is not None:
+                callback(host, output, return_code, parsed)
+
+        return results
+
+    def iter_ping(self, hosts, count=1):
+        """
+        Ping the hosts concurrently and yield a tuple of the host, the output, the return code and
+        the parsed result as each host completes.
+
+        The hosts are consumed incrementally (only as many as can have requests outstanding at once)
+        so that memory use stays flat regardless of the number of hosts.
+
+        Arguments:
+        hosts -- an iterable of the hosts to ping (this may be a generator)
+        count -- the number of echo requests to send to each host
+        """
+
+        for _, host, output, return_code, parsed in self._iter_ping(((None, host) for host in hosts), count):
+            yield host, output, return_code, parsed
+
+    def _resolve(self, host):
+        """
+        Resolve the host to an IPv4 address (returns None if it cannot be resolved).
+        """
+
+        try:
+            return socket.gethostbyname(host)
+        except (socket.error, UnicodeError):
+            return None
+
+    def _finish(self, target):
+        """
+        Make the output, the return code and the parsed result for a target that has completed.
+        """
+
+        parsed = calculate_statistics(target.host, target.sent, target.response_times)
+
+        target.output.append("")
+        target.output.append("--- %s ping statistics ---" % target.host)
+        target.output.append("%s packets transmitted, %s received, %s%% packet loss" % (parsed['sent'], parsed['received'], parsed['packet_loss']))
+
+        if target.response_times:
+            target.output.append("rtt min/avg/max/mdev = %s/%s/%s/%s ms" % (parsed['min_ping'], parsed['avg_ping'], parsed['max_ping'], parsed['jitter']))
+            return_code = 0
+        else:
+            return_code = 1
+
+        return "\n".join(target.output), return_code, parsed
+
+    def _iter_ping(self, indexed_hosts, count):
+        """
+        Ping the hosts and yield a tuple of the index, host, output, return code and parsed result
+        as each host completes.
+
+        Arguments:
+        indexed_hosts -- an iterable of tuples of an index and a host
+        count -- the number of echo requests to send to each host
+        """
+
+        sock, is_raw = open_icmp_socket()
+
+        try:
+            for completed in self._run(sock, is_raw, iter(indexed_hosts), count):
+                yield completed
+        finally:
+            sock.close()
+
+    def _run(self, sock, is_raw, indexed_hosts, count):
+        sock.setblocking(False)
+
+        # The kernel assigns the identifier on datagram sockets; it is the socket's port
+        if is_raw:
+            identifier = (os.getpid() + next(identifier_offsets)) & 0xffff
+        else:
+            sock.bind(('', 0))
+            identifier = sock.getsockname()[1]
+
+        # These are the targets that are being pinged, keyed by a unique number
+        targets = {}
+        target_number = 0
+        hosts_exhausted = False
+        host_count = 0
+
+        # This is the list of target numbers that have requests left to send
+        pending = collections.deque()
+
+        # This maps the sequence numbers of the requests awaiting a reply to the probe. Since every
+        # request gets the same timeout, the oldest request is always the first one to expire.
+        outstanding = collections.OrderedDict()
+
+        completed = []
+
+        # The replies are timestamped by the kernel when possible so that the time the consumer
+        # spends on the results that are yielded isn't included in the response times
+        kernel_timestamps = enable_kernel_timestamps(sock)
+
+        def read_replies():
+            while True:
+                try:
+                    packet, source, received_at = receive_packet(sock, kernel_timestamps)
+                except (socket.error, OSError) as exception:
+                    if exception.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        break
+                    raise
+
+                reply = parse_echo_reply(packet, is_raw)
+
+                if reply is None or reply[0] != identifier or reply[1] not in outstanding:
+                    continue
+
+                probe = outstanding[reply[1]]
+                target = targets[probe.target]
+
+                # Make sure that the reply came from the host we sent the request to
+                if source[0] != target.address:
+                    continue
+
+                del outstanding[reply[1]]
+
+                rtt = 1000 * max(0, received_at - probe.sent_at)
+                target.response_times.append(rtt)
+                target.output.append("%i bytes from %s: icmp_seq=%i time=%.3f ms" % (len(self.payload) + 8, target.address, probe.sequence, rtt))
+                target.completed += 1
+
+                if target.is_done():
+                    completed.append(probe.target)
+
+        while True:
+
+            # Start pinging more hosts if there is room for more outstanding requests
+            while not hosts_exhausted and len(targets) < self.max_outstanding:
+                try:
+                    index, host = next(indexed_hosts)
+                except StopIteration:
+                    hosts_exhausted = True
+                    break
+
+                host_count += 1
+                address = self._resolve(host)
+
+                if address is None:
+                    output = "ping: %s: Name or service not known" % host
+                    yield index, host, output, 2, {'message': 'output could not be parsed', 'output': output}
+                    continue
+
+                target = Target(host, address, count, timer(), self.interval)
+                target.index = index
+                target.output.append("PING %s (%s) %i(%i) bytes of data." % (host, address, len(self.payload), len(self.payload) + 28))
+
+                target_number += 1
+                targets[target_number] = target
+                pending.append(target_number)
+
+            if hosts_exhausted and not targets:
+                break
+
+            now = timer()
+
+            # Send the requests that are due, up to the outstanding limit
+            deferred = collections.deque()
+
+            while pending and len(outstanding) < self.max_outstanding:
+                number = pending.popleft()
+                target = targets[number]
+
+                if target.next_send_at > now:
+                    deferred.append(number)
+                    continue
+
+                sequence = self.next_sequence(outstanding)
+
+                try:
+                    sock.sendto(make_echo_request(identifier, sequence, self.payload), (target.address, 0))
+                except (socket.error, OSError) as exception:
+                    if exception.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                        # The socket buffer is full; try again once some replies are read
+                        pending.appendleft(number)
+                        break
+
+                    target.output.append("From %s icmp_seq=%i %s" % (target.address, target.sent + 1, os.strerror(exception.errno) if exception.errno else str(exception)))
+                    target.sent += 1
+                    target.completed += 1
+                else:
+                    sent_at = timer()
+                    target.sent += 1
+                    outstanding[sequence] = Probe(number, target.sent, sent_at, sent_at + self.timeout)
+
+                if target.sent < target.count:
+                    target.next_send_at = now + target.interval
+                    deferred.append(number)
+                elif target.is_done():
+                    completed.append(number)
+
+            pending.extendleft(reversed(deferred))
+
+            # Figure out how long we can wait for a reply
+            wake_at = None
+
+            if outstanding:
+                wake_at = next(iter(outstanding.values())).deadline
+
+            if pending and len(outstanding) < self.max_outstanding:
+                next_send_at = min([targets[number].next_send_at for number in pending])
+
+                if wake_at is None or next_send_at < wake_at:
+                    wake_at = next_send_at
+
+            if completed:
+                wait = 0
+            else:
+                wait = 0 if wake_at is None else max(0, wake_at - timer())
+
+            readable, _, _ = select.select([sock], [], [], wait)
+
+            # Process the replies
+            if readable:
+                read_replies()
+
+            # Expire the requests that didn't get a reply in time
+            now = timer()
+
+            while outstanding and next(iter(outstanding.values())).deadline <= now:
+                _, probe = outstanding.popitem(last=False)
+                target = targets[probe.target]
+                target.completed += 1
+
+                if target.is_done():
+                    completed.append(probe.target)
+
+            # Hand back the hosts that are done
+            while completed:
+                target = targets.pop(completed.pop(0))
+                output, return_code, parsed = self._finish(target)
+
+                yield target.index, target.host, output, return_code, parsed
+
+                # Without the kernel's timestamps, read the replies that arrived while the consumer
+                # was busy right away rather than after the rest of the hosts are handed back
+                if not kernel_timestamps:
+                    read_replies()
+
+        if self.logger:
+            self.logger.debug("ICMP echo engine completed, host_count=%i, raw_socket=%r", host_count, is_raw)
@@ -39,6 +39,7 @@ from .exceptions import (IPDefinedError, ASNLookupError, BlacklistError,
 from .whois import RIR_WHOIS
 from .asn import ASN_ORIGIN_WHOIS
 from .utils import ipv4_is_defined, ipv6_is_defined
+from ..whois_governor import governor as whois_governor, CircuitOpenError
 
 if sys.version_info >= (3, 3):  # pragma: no cover
     from ipaddress import (ip_address,
@@ -581,34 +582,42 @@ class Net:
             if server is None:
                 server = RIR_WHOIS[asn_registry]['server']
 
-            # Create the connection for the whois query.
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.settimeout(self.timeout)
-            log.debug('WHOIS query for {0} at {1}:{2}'.format(
-                self.address_str, server, port))
-            conn.connect((server, port))
+            # Wait for the server's limiter (this fails immediately if the
+            # server has been failing).
+            with whois_governor.query(server) as governed_query:
 
-            # Prep the query.
-            query = self.address_str + '\r\n'
-            if asn_registry == 'arin':
+                # Create the connection for the whois query.
+                conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                conn.settimeout(self.timeout)
+                log.debug('WHOIS query for {0} at {1}:{2}'.format(
+                    self.address_str, server, port))
+                conn.connect((server, port))
 
-                query = 'n + {0}'.format(query)
+                # Prep the query.
+                query = self.address_str + '\r\n'
+                if asn_registry == 'arin':
 
-            # Query the whois server, and store the results.
-            conn.send(query.encode())
+                    query = 'n + {0}'.format(query)
 
-            response = ''
-            while True:
+                # Query the whois server, and store the results.
+                conn.send(query.encode())
 
-                d = conn.recv(4096).decode('ascii', 'ignore')
+                response = ''
+                while True:
 
-                response += d
+                    d = conn.recv(4096).decode('ascii', 'ignore')
 
-                if not d:
+                    response += d
 
-                    break
+                    if not d:
 
-            conn.close()
+                        break
+
+                conn.close()
+
+                # Count rate limiting against the server's circuit.
+                governed_query.failed = ('Query rate limit exceeded' in
+                                         response)
 
             if 'Query rate limit exceeded' in response:  # pragma: no cover
 
@@ -663,6 +672,14 @@ class Net:
 
             raise
 
+        except CircuitOpenError as e:
+
+            log.debug('WHOIS query not sent: {0}'.format(e))
+            raise WhoisLookupError(
+                'WHOIS lookup failed for {0}. {1}.'.format(
+                    self.address_str, e)
+            )
+
         except:  # pragma: no cover
 
             raise WhoisLookupError(
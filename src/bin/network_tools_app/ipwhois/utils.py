@@ -33,6 +33,8 @@ import random
 from collections import namedtuple
 import logging
 
+from ..compiled_data import load_compiled
+
 if sys.version_info >= (3, 3):  # pragma: no cover
     from ipaddress import (ip_address,
                            ip_network,
@@ -175,10 +177,11 @@ def calculate_cidr(start_address, end_address):
     return [i.__str__() for i in collapse_addresses(tmp_addrs)]
 
 
-def get_countries(is_legacy_xml=False):
+def read_countries(is_legacy_xml=False):
     """
-    The function to generate a dictionary containing ISO_3166-1 country codes
-    to names.
+    The function to parse the ISO_3166-1 country code file into a dictionary
+    of country codes to names. Use get_countries() instead since it only does
+    this once.
 
     Args:
         is_legacy_xml (:obj:`bool`): Whether to use the older country code
@@ -192,23 +195,13 @@ def get_countries(is_legacy_xml=False):
     # Initialize the countries dictionary.
     countries = {}
 
-    # Set the data directory based on if the script is a frozen executable.
-    if sys.platform == 'win32' and getattr(sys, 'frozen', False):
-
-        data_dir = path.dirname(sys.executable)  # pragma: no cover
-
-    else:
-
-        data_dir = path.dirname(__file__)
-
     if is_legacy_xml:
 
         log.debug('Opening country code legacy XML: {0}'.format(
-                str(data_dir) + '/data/iso_3166-1_list_en.xml'))
+                get_countries_path(True)))
 
         # Create the country codes file object.
-        f = io.open(str(data_dir) + '/data/iso_3166-1_list_en.xml', 'r',
-                    encoding='ISO-8859-1')
+        f = io.open(get_countries_path(True), 'r', encoding='ISO-8859-1')
 
         # Read the file.
         data = f.read()
@@ -239,11 +232,10 @@ def get_countries(is_legacy_xml=False):
     else:
 
         log.debug('Opening country code CSV: {0}'.format(
-                str(data_dir) + '/data/iso_3166-1_list_en.xml'))
+                get_countries_path(False)))
 
         # Create the country codes file object.
-        f = io.open(str(data_dir) + '/data/iso_3166-1.csv', 'r',
-                    encoding='utf-8')
+        f = io.open(get_countries_path(False), 'r', encoding='utf-8')
 
         # Create csv reader object.
         csv_reader = csv.reader(f, delimiter=',', quotechar='"')
@@ -261,6 +253,70 @@ def get_countries(is_legacy_xml=False):
     return countries
 
 
+def get_countries_path(is_legacy_xml=False):
+    """
+    The function to get the path of the ISO_3166-1 country code file.
+
+    Args:
+        is_legacy_xml (:obj:`bool`): Whether to use the older country code
+            list (iso_3166-1_list_en.xml).
+
+    Returns:
+        str: The path of the file.
+    """
+
+    # Set the data directory based on if the script is a frozen executable.
+    if sys.platform == 'win32' and getattr(sys, 'frozen', False):
+
+        data_dir = path.dirname(sys.executable)  # pragma: no cover
+
+    else:
+
+        data_dir = path.dirname(__file__)
+
+    if is_legacy_xml:
+
+        return str(data_dir) + '/data/iso_3166-1_list_en.xml'
+
+    else:
+
+        return str(data_dir) + '/data/iso_3166-1.csv'
+
+
+# The country code dictionaries that were already loaded (keyed by
+# is_legacy_xml).
+COUNTRIES = {}
+
+
+def get_countries(is_legacy_xml=False):
+    """
+    The function to generate a dictionary containing ISO_3166-1 country codes
+    to names. The file is only parsed once per process and the result is
+    loaded from a precompiled copy when the file hasn't changed.
+
+    Args:
+        is_legacy_xml (:obj:`bool`): Whether to use the older country code
+            list (iso_3166-1_list_en.xml).
+
+    Returns:
+        dict: A mapping of country codes as the keys to the country names as
+            the values.
+    """
+
+    is_legacy_xml = bool(is_legacy_xml)
+
+    if is_legacy_xml not in COUNTRIES:
+
+        COUNTRIES[is_legacy_xml] = load_compiled(
+            'ipwhois_countries_xml' if is_legacy_xml else 'ipwhois_countries',
+            [get_countries_path(is_legacy_xml)],
+            lambda: read_countries(is_legacy_xml)
+        )
+
+    # Return a copy so that callers can't change the shared dictionary.
+    return dict(COUNTRIES[is_legacy_xml])
+
+
 def ipv4_is_defined(address):
     """
     The function for checking if an IPv4 address is defined (does not need to
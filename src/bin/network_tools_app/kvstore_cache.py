@@ -0,0 +1,225 @@
+"""
+This module provides a cache of results that is stored in a KV store collection so that it is
+shared by every search head in a cluster (and thus, every member doesn't have to repeat the same
+lookups).
+
+Reads are done in batches (one request for many keys) and writes are done in the background so
+that the cache doesn't slow down the command using it.
+
+Here is a sample of using the cache:
+
+from network_tools_app.kvstore_cache import KVStoreCache
+
+cache = KVStoreCache('whois_cache', session_key, ttl=86400)
+results = cache.get_many(['textcritical.net', '8.8.8.8'])
+
+if 'textcritical.net' not in results:
+    cache.set('textcritical.net', whois('textcritical.net'))
+
+cache.close()
+"""
+
+import json
+import time
+import threading
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+import splunk.rest as rest
+
+# This is the number of seconds that entries are valid for by default
+DEFAULT_TTL = 24 * 3600
+
+# This is the number of keys included in each read and the number of entries included in each write
+DEFAULT_BATCH_SIZE = 50
+
+# This is the number of entries that can be waiting to be written before new ones are dropped
+DEFAULT_MAX_QUEUED = 1000
+
+class KVStoreCache(object):
+    """
+    A cache of JSON serializable results stored in a KV store collection. The entries are stored
+    with the key as the _key of the record, the result (serialized as JSON) in the "result" field
+    and the time that the entry expires in the "expires" field.
+    """
+
+    def __init__(self, collection, session_key, ttl=DEFAULT_TTL, app='network_tools',
+                 owner='nobody', server_uri=None, batch_size=DEFAULT_BATCH_SIZE,
+                 max_queued=DEFAULT_MAX_QUEUED, logger=None):
+        """
+        Constructs the cache.
+
+        Arguments:
+        collection -- the name of the KV store collection
+        session_key -- the session key to use when connecting to the REST API
+        ttl -- the number of seconds that the entries are valid for
+        app -- the app that the collection is defined in
+        owner -- the owner of the collection
+        server_uri -- the URI of splunkd (the local instance will be used if None)
+        batch_size -- the number of keys to read and entries to write per request
+        max_queued -- the number of entries that can be waiting to be written
+        logger -- the logger to write errors to
+        """
+
+        self.uri = '%s/servicesNS/%s/%s/storage/collections/data/%s' % (server_uri or '', owner, app, collection)
+        self.session_key = session_key
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.logger = logger
+
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+
+        # The entries are written by a background thread that is started on the first write
+        self.queue = Queue(maxsize=max_queued)
+        self.writer_thread = None
+        self.lock = threading.Lock()
+
+    def log_error(self, message, *args):
+        if self.logger is not None:
+            self.logger.warn(message, *args)
+
+    def get_many(self, keys):
+        """
+        Get a dictionary of the unexpired results for the given keys. Keys that have no entry won't
+        be included in the dictionary. Failures to query the KV store are logged and treated as
+        misses.
+
+        Arguments:
+        keys -- the keys to get the results for
+        """
+
+        keys = list(set(keys))
+        results = {}
+        now = time.time()
+
+        for offset in range(0, len(keys), self.batch_size):
+            batch = keys[offset:offset + self.batch_size]
+
+            query = {
+                '$or': [{'_key': key} for key in batch],
+                'expires': {'$gt': now}
+            }
+
+            getargs = {
+                'output_mode': 'json',
+                'query': json.dumps(query),
+                'fields': '_key,result'
+            }
+
+            try:
+                _, content = rest.simpleRequest(self.uri, sessionKey=self.session_key,
+                                                getargs=getargs, raiseAllErrors=True)
+                entries = json.loads(content)
+            except Exception as exception:
+                self.log_error("Unable to read from the KV store cache, uri=%s, error=%s", self.uri, exception)
+                continue
+
+            for entry in entries:
+                try:
+                    results[entry['_key']] = json.loads(entry['result'])
+                except (KeyError, TypeError, ValueError):
+                    pass
+
+        self.hits += len(results)
+        self.misses += len(keys) - len(results)
+
+        return results
+
+    def get(self, key):
+        """
+        Get the unexpired result for the given key or None if there isn't one.
+        """
+
+        return self.get_many([key]).get(key, None)
+
+    def set(self, key, result):
+        """
+        Queue the result to be written to the KV store. This doesn't wait for the write to occur;
+        the result will be dropped if too many writes are waiting.
+
+        Arguments:
+        key -- the key to store the result under
+        result -- the result (values that JSON cannot represent are stored as strings)
+        """
+
+        document = {
+            '_key': key,
+            'expires': time.time() + self.ttl,
+            'result': json.dumps(result, default=str)
+        }
+
+        with self.lock:
+            if self.writer_thread is None:
+                self.writer_thread = threading.Thread(name='kvstore_cache_writer', target=self.write_entries)
+                self.writer_thread.daemon = True
+                self.writer_thread.start()
+
+        try:
+            self.queue.put_nowait(document)
+        except Full:
+            self.dropped += 1
+
+    def save_batch(self, documents):
+        """
+        Write the documents to the KV store in a single request.
+        """
+
+        try:
+            rest.simpleRequest(self.uri + '/batch_save', sessionKey=self.session_key,
+                               method='POST', jsonargs=json.dumps(documents), raiseAllErrors=True)
+        except Exception as exception:
+            self.log_error("Unable to write to the KV store cache, uri=%s, count=%i, error=%s", self.uri, len(documents), exception)
+
+    def write_entries(self):
+        """
+        Write the queued entries in batches until close() is called.
+        """
+
+        stopped = False
+
+        while not stopped:
+            document = self.queue.get()
+
+            if document is None:
+                return
+
+            documents = [document]
+
+            # Include the other entries that are waiting in the same request
+            while len(documents) < self.batch_size:
+                try:
+                    document = self.queue.get_nowait()
+                except Empty:
+                    break
+
+                if document is None:
+                    stopped = True
+                    break
+
+                documents.append(document)
+
+            self.save_batch(documents)
+
+    def close(self, timeout=30):
+        """
+        Wait for the queued entries to be written.
+
+        Arguments:
+        timeout -- the maximum number of seconds to wait for the writes to complete
+        """
+
+        with self.lock:
+            writer_thread = self.writer_thread
+            self.writer_thread = None
+
+        if writer_thread is not None:
+            self.queue.put(None)
+            writer_thread.join(timeout)
+
+        if self.logger is not None:
+            self.logger.debug("KV store cache closed, hits=%i, misses=%i, dropped=%i", self.hits, self.misses, self.dropped)
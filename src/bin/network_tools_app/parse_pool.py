@@ -0,0 +1,160 @@
+"""
+This module provides a pool of worker processes for parsing whois responses.
+
+Parsing a whois response is CPU-bound (it runs hundreds of regular expressions in pure Python) so
+lookups that are run on threads can't parse more than one response at a time due to the GIL. The
+pool lets the threads continue to perform the network I/O while the parsing is handed off to other
+processes. The workers only parse; the queries for the NIC handles that a response refers to are
+sent from the calling thread so that they go through the whois governor of this process (see
+whois_governor) like every other query.
+
+Here is a sample of using the pool:
+
+from network_tools_app.parse_pool import ParsePool
+from network_tools_app.pythonwhois.net import get_whois_raw
+
+with ParsePool(4) as parse_pool:
+    raw_data, server_list = get_whois_raw('textcritical.net', with_server_list=True)
+    result = parse_pool.parse_domain_whois(raw_data, server_list[-1])
+"""
+
+import threading
+import multiprocessing
+
+from network_tools_app.pythonwhois import parse, shared
+
+# These are the contacts of a parsed response
+CONTACT_TYPES = ("registrant", "tech", "admin", "billing")
+
+def parse_responses(raw_data):
+    """
+    Parse the raw responses of a domain whois lookup without querying the NIC handles that the
+    contacts refer to (this is what runs in the worker processes).
+
+    Arguments:
+    raw_data -- the list of responses from each whois server that was queried
+    """
+
+    return parse.parse_raw_whois(raw_data, normalized=[], never_query_handles=True)
+
+def resolve_handles(result, handle_server=""):
+    """
+    Look up the contacts that the responses only referred to by NIC handle. This does what
+    pythonwhois does when parsing with never_query_handles=False but it must be called in the
+    process that sends the whois queries.
+
+    Arguments:
+    result -- the result from parse_responses()
+    handle_server -- the server to look up the contact handles on
+    """
+
+    contacts = result.get("contacts") or {}
+    resolved = False
+
+    for contact_type in CONTACT_TYPES:
+        contact = contacts.get(contact_type)
+
+        # The contact only has the handle if its definition wasn't in the responses
+        if contact is None or list(contact.keys()) != ["handle"]:
+            continue
+
+        try:
+            contact.update(parse.fetch_nic_contact(contact["handle"], handle_server))
+        except shared.WhoisException:
+            continue # No data found
+
+        parse.postprocess_contact(contact)
+        resolved = True
+
+    # Remove the e-mail addresses that are now listed for the contacts (like parse_raw_whois() does)
+    if resolved and "emails" in result:
+        known_emails = [contact.get("email") for contact in contacts.values() if contact is not None]
+        result["emails"] = [email for email in result["emails"] if email not in known_emails]
+
+        if len(result["emails"]) == 0:
+            del result["emails"]
+
+    return result
+
+def parse_domain_whois(raw_data, handle_server=""):
+    """
+    Parse the raw responses of a domain whois lookup. This is the same parsing that
+    pythonwhois.get_whois() performs.
+
+    Arguments:
+    raw_data -- the list of responses from each whois server that was queried
+    handle_server -- the server to look up the contact handles on
+    """
+
+    return resolve_handles(parse_responses(raw_data), handle_server)
+
+class ParsePool(object):
+    """
+    A pool of processes that parse whois responses. Many threads can use the pool at once but call
+    start() before starting them: forking while other threads hold locks (such as the logging
+    locks) can leave the worker processes deadlocked.
+    """
+
+    def __init__(self, processes=None):
+        """
+        Constructs the pool.
+
+        Arguments:
+        processes -- the number of worker processes (defaults to the number of CPUs)
+        """
+
+        self.processes = processes or multiprocessing.cpu_count()
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the worker processes (if they aren't already running).
+        """
+
+        self.get_pool()
+
+    def get_pool(self):
+        """
+        Get the pool of processes, starting it if necessary.
+        """
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.processes)
+
+            return self.pool
+
+    def parse_domain_whois(self, raw_data, handle_server=""):
+        """
+        Parse the raw responses of a domain whois lookup in a worker process. This blocks the calling
+        thread (but not other threads) until the result is ready. The NIC handles are looked up on
+        the calling thread.
+
+        Arguments:
+        raw_data -- the list of responses from each whois server that was queried
+        handle_server -- the server to look up the contact handles on
+        """
+
+        result = self.get_pool().apply(parse_responses, (raw_data,))
+        return resolve_handles(result, handle_server)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+
+        with self.lock:
+            pool = self.pool
+            self.pool = None
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
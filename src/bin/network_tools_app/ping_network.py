@@ -6,36 +6,55 @@ import re
 import sys
 import zipimport
 
-from . import ping, tcp_ping
+from . import iter_ping_hosts, iter_tcp_ping_hosts, tcp_ping
+from .tcp_engine import DEFAULT_TIMEOUT as DEFAULT_TCP_TIMEOUT, DEFAULT_INTERVAL as DEFAULT_TCP_INTERVAL
 
-# This will import the ipaddress library from the modular input library
-# Note that the normal import from a zip file didn't work for me on all platforms (Windows and
-# Linux) since it wouldn't import sub-modules (like modular_input.contrib). Thus, I had to rely on
-# the zipimport method instead. See https://lukemurphey.net/issues/2173
-path_to_mod_input_lib = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../modular_input.zip')
-importer = zipimport.zipimporter(path_to_mod_input_lib)
-modular_input = importer.load_module('modular_input')
-ipaddress = modular_input.contrib.ipaddress
+# This is the ipaddress library from the modular input library (see load_ipaddress())
+ipaddress = None
+
+def load_ipaddress():
+    """
+    Import the ipaddress library from the modular input library. This is done on first use since
+    modules in a zip file are compiled every time they are imported (which is slow) and most uses of
+    the search command don't need to parse networks.
+    """
+
+    global ipaddress
+
+    if ipaddress is None:
+        # Note that the normal import from a zip file didn't work for me on all platforms (Windows
+        # and Linux) since it wouldn't import sub-modules (like modular_input.contrib). Thus, I had
+        # to rely on the zipimport method instead. See https://lukemurphey.net/issues/2173
+        path_to_mod_input_lib = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../modular_input.zip')
+        importer = zipimport.zipimporter(path_to_mod_input_lib)
+        modular_input = importer.load_module('modular_input')
+        ipaddress = modular_input.contrib.ipaddress
+
+    return ipaddress
 
 DOMAIN_NAME_RE = re.compile('^((?!-))(xn--)?[a-z0-9][a-z0-9-_]{0,61}[a-z0-9]{0,1}\.(xn--)?([a-z0-9\-]{1,61}|[a-z0-9-]{1,30}\.[a-z]{2,})$')
 
+# This is the limit for the functions that return a list of all of the results
 ADDRESS_SCAN_LIMIT = 1024
 
+# This is the limit for the generator functions that yield the results as they complete
+STREAMING_ADDRESS_SCAN_LIMIT = 65536
+
+# These are the fields that the ping results may include
+RESULT_FIELDS = ['dest', 'dest_network', 'sent', 'received', 'packet_loss', 'min_ping', 'avg_ping',
+                 'max_ping', 'jitter', 'return_code', 'output', 'message']
+
 if sys.version_info.major >= 3:
     unicode = str
 
 class NetworkDestinationTooHigh(Exception):
     """The number of hosts to scan is excessively high."""
 
-def ping_all(dest, count=1, index=None, sourcetype="ping", source="ping_search_command", logger=None, callback=None):
+def parse_network(dest, address_limit, logger=None):
     """
-    Pings the host using the native ping command on the platform and returns a tuple consisting of:
-
-     1) the output string
-     2) the return code (0 is the expected return code)
-     3) parsed output from the ping command
+    Parse the destination as a network. None will be returned if the destination is not an IP
+    address or network (in which case it ought to be treated as a domain name).
     """
-    results = []
 
     # Convert the entry to unicode since this is what the ipaddress library expects
     # This is only needed for Python 2
@@ -45,54 +64,93 @@ def ping_all(dest, count=1, index=None, sourcetype="ping", source="ping_search_c
     # Try to treat this as an IP address by default
     try:
         # Parse the ipaddress if necessary
-        dest_network = ipaddress.ip_network(dest, strict=False)
+        dest_network = load_ipaddress().ip_network(dest, strict=False)
+    except ValueError:
+        return None
+
+    if logger:
+        logger.debug("Resolved destination to addresses; dest=%s, address_count=%i", dest, dest_network.num_addresses)
+
+    if dest_network.num_addresses > address_limit:
+        raise NetworkDestinationTooHigh("The number of addresses to ping must be less than %i but the count requested was %s" % (address_limit, dest_network.num_addresses))
+
+    return dest_network
+
+def ping_all(dest, count=1, index=None, sourcetype="ping", source="ping_search_command", logger=None, callback=None, thread_limit=1, budget=None):
+    """
+    Pings the host or all of the hosts in the network and returns a list of the parsed results.
 
-        if logger:
-            logger.debug("Resolved destination to addresses; dest=%s, address_count=%i", dest, dest_network.num_addresses)
+    The callback will be called with each result as it completes. When the native ping command
+    needs to be used, up to thread_limit hosts will be pinged at once (limited further by the
+    budget semaphore if one is provided).
 
-        if dest_network.num_addresses == 1:
-            _, return_code, result = ping(str(dest_network.network_address), count, index=index, logger=logger)
+    Use iter_ping_all() for large networks since it doesn't hold all of the results in memory.
+    """
+    results = []
+
+    for result in iter_ping_all(dest, count, index, sourcetype, source, logger, thread_limit, budget, ADDRESS_SCAN_LIMIT):
+        if callback:
+            callback(result)
+
+        results.append(result)
+
+    return results
+
+def iter_ping_all(dest, count=1, index=None, sourcetype="ping", source="ping_search_command", logger=None, thread_limit=1, budget=None, address_limit=STREAMING_ADDRESS_SCAN_LIMIT):
+    """
+    Pings the host or all of the hosts in the network and yields the parsed results as they
+    complete. The addresses are generated incrementally so that memory use stays flat regardless of
+    the size of the network.
+    """
+
+    dest_network = parse_network(dest, address_limit, logger)
+
+    # Treat this as a domain if it isn't an IP address or network
+    if dest_network is None or dest_network.num_addresses == 1:
+
+        if dest_network is None:
+            hosts = [str(dest)]
+        else:
+            hosts = [str(dest_network.network_address)]
 
+        for _, _, return_code, result in iter_ping_hosts(hosts, count, index=index, sourcetype=sourcetype, source=source, logger=logger):
             result['return_code'] = return_code
 
             # Make sure that the destination is present
             if 'dest' not in result:
                 result['dest'] = str(dest)
 
-            if callback:
-                callback(result)
+            yield result
 
-            results.append(result)
-        elif dest_network.num_addresses > ADDRESS_SCAN_LIMIT:
-            raise Exception("The number of addresses to ping must be less than %i but the count requested was %s" % (ADDRESS_SCAN_LIMIT, dest_network.num_addresses))
-        else:
-            for next_dest in dest_network.hosts():
-                if logger:
-                    logger.debug("Scanning host=%s", str(next_dest))
-                _, return_code, result = ping(str(next_dest), count, index=index, logger=logger)
-                result['return_code'] = return_code
+    else:
+        # Ping all of the hosts at once (the ICMP echo engine multiplexes the requests)
+        hosts = (str(next_dest) for next_dest in dest_network.hosts())
+
+        for next_dest, _, return_code, result in iter_ping_hosts(hosts, count, index=index, logger=logger, thread_limit=thread_limit, budget=budget):
+            result['return_code'] = return_code
 
-                # Make sure that the destination is present
-                if 'dest' not in result:
-                    result['dest'] = str(next_dest)
+            # Make sure that the destination is present
+            if 'dest' not in result:
+                result['dest'] = next_dest
 
-                # Add the network to the output
-                result['dest_network'] = str(dest)
+            # Add the network to the output
+            result['dest_network'] = str(dest)
 
-                if callback:
-                    callback(result)
+            yield result
 
-                results.append(result)
-    except ValueError:
-        # Otherwise, treat this as a domain if it appears to be a domain name
-        _, return_code, result = ping(str(dest), count, sourcetype=sourcetype, source=source, index=index, logger=logger)
+def tcp_ping_all(dest, port, count=1, index=None, sourcetype="ping", source="ping_search_command", logger=None, callback=None, timeout=DEFAULT_TCP_TIMEOUT, interval=DEFAULT_TCP_INTERVAL):
+    """
+    Pings the host or all of the hosts in the network using TCP and returns a list of the results.
 
-        result['return_code'] = return_code
+    The hosts are pinged concurrently and the callback will be called with each result as it
+    completes. The timeout is the number of seconds to wait for each probe and the interval is the
+    number of seconds between the probes sent to the same host.
 
-        # Make sure that the destination is present
-        if 'dest' not in result:
-            result['dest'] = str(dest)
+    Use iter_tcp_ping_all() for large networks since it doesn't hold all of the results in memory.
+    """
+    results = []
 
+    for result in iter_tcp_ping_all(dest, port, count, index, sourcetype, source, logger, timeout, interval, ADDRESS_SCAN_LIMIT):
         if callback:
             callback(result)
 
@@ -100,53 +158,28 @@ def ping_all(dest, count=1, index=None, sourcetype="ping", source="ping_search_c
 
     return results
 
-def tcp_ping_all(dest, port, count=1, index=None, sourcetype="ping", source="ping_search_command", logger=None, callback=None):
+def iter_tcp_ping_all(dest, port, count=1, index=None, sourcetype="ping", source="ping_search_command", logger=None, timeout=DEFAULT_TCP_TIMEOUT, interval=DEFAULT_TCP_INTERVAL, address_limit=STREAMING_ADDRESS_SCAN_LIMIT):
     """
-    Pings the host using the native ping command on the platform and returns a tuple consisting of:
-
-     1) the output string
-     2) the return code (0 is the expected return code)
-     3) parsed output from the ping command
+    Pings the host or all of the hosts in the network using TCP and yields the results as they
+    complete. The addresses are generated incrementally so that memory use stays flat regardless of
+    the size of the network.
     """
-    results = []
 
-    # Convert the entry to unicode since this is what the ipaddress library expects
-    # This is only needed for Python 2
-    if not isinstance(dest, unicode):
-        dest = unicode(dest)
+    dest_network = parse_network(dest, address_limit, logger)
 
-    # Try to treat this as an IP address by default
-    try:
-        # Parse the ipaddress if necessary
-        dest_network = ipaddress.ip_network(dest, strict=False)
-
-        if dest_network.num_addresses == 1:
-            result = tcp_ping(str(dest_network.network_address), port, count, index=index, logger=logger)
-
-            if callback:
-                callback(result)
-
-            results.append(result)
-        elif dest_network.num_addresses > ADDRESS_SCAN_LIMIT:
-            raise Exception("The number of addresses to ping must be less than %i but the count requested was %s" % (ADDRESS_SCAN_LIMIT, dest_network.num_addresses))
-        else:
-            for next_dest in dest_network.hosts():
-                result = tcp_ping(str(next_dest), port, count, index=index, logger=logger)
-
-                if callback:
-                    callback(result)
-
-                # Add the network to the output
-                result['dest_network'] = str(dest)
-
-                results.append(result)
-    except ValueError:
+    if dest_network is None:
         # Otherwise, treat this as a domain if it appears to be a domain name
-        result = tcp_ping(str(dest), port, count, sourcetype=sourcetype, source=source, index=index, logger=logger)
+        yield tcp_ping(str(dest), port, count, sourcetype=sourcetype, source=source, index=index, logger=logger, timeout=timeout, interval=interval)
 
-        if callback:
-            callback(result)
+    elif dest_network.num_addresses == 1:
+        yield tcp_ping(str(dest_network.network_address), port, count, index=index, logger=logger, timeout=timeout, interval=interval)
 
-        results.append(result)
+    else:
+        # Ping all of the hosts at once (the TCP ping engine multiplexes the connections)
+        hosts = (str(next_dest) for next_dest in dest_network.hosts())
+
+        for result in iter_tcp_ping_hosts(hosts, port, count, index=index, logger=logger, timeout=timeout, interval=interval):
+            # Add the network to the output
+            result['dest_network'] = str(dest)
 
-    return results
\ No newline at end of file
+            yield result
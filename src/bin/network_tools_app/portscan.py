@@ -1,115 +1,615 @@
+"""
+This module performs TCP connect port scans.
+
+The connections are made with non-blocking sockets that are driven by the selectors module (or
+select() on Python 2, see tcp_engine) so that thousands of connection attempts can be in flight at
+once from a single thread.
+
+The time to wait on each connection adapts to the round-trip time of the host being scanned (in
+the same way that TCP calculates its retransmission timeout). Ports that accept or refuse a
+connection provide round-trip samples, so ports that are filtered by a firewall (those that never
+respond) only need to be waited on for a little longer than the host takes to respond.
+"""
+
 import socket
 import sys
-import threading
-
-try:
-    from Queue import Queue, Empty
-except:
-    from queue import Queue, Empty
+import errno
+import heapq
+import itertools
+import collections
+from timeit import default_timer as timer
 
 from collections import OrderedDict
 from . import parseintset
+from . import icmp
+from .tcp_engine import get_connection_limit, make_selector, EVENT_WRITE
+
+if sys.version_info >= (3, 3):  # pragma: no cover
+    from ipaddress import ip_network
+else:
+    from .ipaddr import ip_network
 
-DEFAULT_THREAD_LIMIT = 200
+DEFAULT_MAX_CONCURRENT = 1024
+DEFAULT_MIN_TIMEOUT = 0.1
+DEFAULT_INITIAL_TIMEOUT = 1
+DEFAULT_RETRIES = 1
 CLOSED_STATUS = 'closed'
 OPEN_STATUS = 'open'
+FILTERED_STATUS = 'filtered'
+UP_STATUS = 'up'
+DOWN_STATUS = 'down'
+
+# These are the methods of determining which hosts are up before scanning them
+ICMP_DISCOVERY = 'icmp'
+TCP_DISCOVERY = 'tcp'
+DISCOVERY_METHODS = [ICMP_DISCOVERY, TCP_DISCOVERY]
+
+# These are the ports that are checked when determining if a host is up using TCP (a host that
+# refuses the connection is up just as much as one that accepts it)
+DEFAULT_DISCOVERY_PORTS = [22, 80, 443, 3389]
+
+# These are the connection errors that indicate that something is dropping or rejecting the
+# connection attempts (as opposed to the host refusing them because the port is closed)
+FILTERED_ERRORS = frozenset([
+    errno.ETIMEDOUT,
+    errno.EHOSTUNREACH,
+    errno.ENETUNREACH,
+    errno.EACCES,
+])
+
+# This is the maximum number of hosts that can be scanned at once
+ADDRESS_SCAN_LIMIT = 65536
 
 if sys.version_info.major >= 3:
     unicode = str
 
-class Scanner(threading.Thread):
-    def __init__(self, input_queue, output_queue, timeout=5):
-        threading.Thread.__init__(self)
+class TooManyHostsException(Exception):
+    """
+    The number of hosts to scan is excessively high.
+    """
+
+def parse_hosts(dest, address_limit=ADDRESS_SCAN_LIMIT):
+    """
+    Get the list of hosts to scan from the destination. The destination may be a host name, an IP
+    address, a CIDR block, a comma separated list of these or a list of these.
+
+    Arguments:
+    dest -- the destination to get the hosts from
+    address_limit -- the maximum number of hosts allowed
+    """
+
+    if isinstance(dest, (str, unicode)):
+        dests = dest.split(',')
+    else:
+        dests = dest
+
+    hosts = []
+
+    for entry in dests:
+        entry = unicode(entry).strip()
+
+        if len(entry) == 0:
+            continue
+
+        try:
+            network = ip_network(entry, strict=False)
+        except ValueError:
+            # This isn't an IP address or network so treat it as a host name
+            network = None
+
+        if network is None:
+            new_hosts = 1
+        else:
+            new_hosts = network.num_addresses
+
+        if len(hosts) + new_hosts > address_limit:
+            raise TooManyHostsException("The number of hosts to scan must be no more than %i" % address_limit)
+
+        if network is None:
+            hosts.append(entry)
+        elif network.num_addresses == 1:
+            hosts.append(str(network.network_address))
+        else:
+            hosts.extend([str(host) for host in network.hosts()])
+
+    return hosts
+
+def parse_ports(ports):
+    """
+    Get a sorted list of the ports to scan (from a list or a string such as "22,80,8000-8100").
+    """
+
+    if isinstance(ports, (str, unicode)):
+        return sorted(parseintset.parseIntSet(ports))
+    else:
+        return sorted(ports)
+
+def interleave(hosts, ports):
+    """
+    Generate the host and port pairs to scan such that consecutive pairs go to different hosts.
+    This way, no single host is hammered with connections.
+    """
+
+    for port in ports:
+        for host in hosts:
+            yield host, port
+
+def get_status(error_code):
+    """
+    Get the status of a port from the result of a connection attempt.
+    """
+
+    if error_code == 0:
+        return OPEN_STATUS
+    elif error_code in FILTERED_ERRORS:
+        return FILTERED_STATUS
+    else:
+        return CLOSED_STATUS
+
+class RTTEstimator(object):
+    """
+    Estimates the round-trip time to a host from the time it takes for connection attempts to be
+    accepted or refused. The timeout is calculated like TCP's retransmission timeout (RFC 6298).
+    """
+
+    def __init__(self, min_timeout=DEFAULT_MIN_TIMEOUT, max_timeout=5, initial_timeout=DEFAULT_INITIAL_TIMEOUT):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.initial_timeout = initial_timeout
+        self.smoothed_rtt = None
+        self.rtt_variance = None
+
+    def add_sample(self, rtt):
+        """
+        Update the estimate with the number of seconds that a connection attempt took.
+        """
 
-        # These are the scan queues
-        self.input_queue = input_queue
-        self.output_queue = output_queue
+        if self.smoothed_rtt is None:
+            self.smoothed_rtt = rtt
+            self.rtt_variance = rtt / 2.0
+        else:
+            self.rtt_variance = (0.75 * self.rtt_variance) + (0.25 * abs(self.smoothed_rtt - rtt))
+            self.smoothed_rtt = (0.875 * self.smoothed_rtt) + (0.125 * rtt)
 
-        self.keep_running = True
+    def has_samples(self):
+        return self.smoothed_rtt is not None
+
+    def get_timeout(self):
+        """
+        Get the number of seconds to wait for a connection attempt.
+        """
+
+        if self.smoothed_rtt is None:
+            return min(self.max_timeout, self.initial_timeout)
+
+        timeout = self.smoothed_rtt + (4 * self.rtt_variance)
+
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+class Connection(object):
+    """
+    Represents a connection attempt in flight.
+    """
+
+    def __init__(self, host, port, sock, started_at, timeout, attempt):
+        self.host = host
+        self.port = port
+        self.sock = sock
+        self.started_at = started_at
         self.timeout = timeout
+        self.deadline = started_at + timeout
+        self.attempt = attempt
+        self.finished = False
+
+class PortScanner(object):
+    """
+    Determines which ports are open by attempting TCP connections to them.
+    """
 
-    def run(self):
-        # This loop will exit when the input_queue generates an exception because all of the threads
-        # are complete
-        while self.keep_running:
+    def __init__(self, timeout=5, max_concurrent=DEFAULT_MAX_CONCURRENT,
+                 min_timeout=DEFAULT_MIN_TIMEOUT, retries=DEFAULT_RETRIES):
+        """
+        Constructs a port scanner.
 
+        Arguments:
+        timeout -- the maximum number of seconds to wait for each connection to complete
+        max_concurrent -- the maximum number of connections in flight at once
+        min_timeout -- the minimum number of seconds to wait for each connection to complete
+        retries -- the number of times to retry a port whose connection attempt timed out
+        """
+
+        self.timeout = timeout
+        self.min_timeout = min(min_timeout, timeout)
+        self.retries = retries
+        self.max_concurrent = get_connection_limit(max_concurrent)
+
+        # This caches the resolved addresses of the hosts
+        self.addresses = {}
+
+        # These are the round-trip time estimates for each host and for the scan as a whole (the
+        # latter is used for hosts that haven't responded yet when it is more conservative than the
+        # initial timeout)
+        self.estimators = {}
+        self.global_estimator = RTTEstimator(self.min_timeout, self.timeout)
+
+    def resolve(self, host):
+        """
+        Resolve the host to an address. None will be returned if it could not be resolved.
+        """
+
+        if host not in self.addresses:
             try:
-                host, port = self.input_queue.get(timeout=5)
-            except Empty:
+                family, socktype, proto, _, address = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)[0]
+                self.addresses[host] = (family, socktype, proto, address[0])
+            except (socket.error, UnicodeError):
+                self.addresses[host] = None
+
+        return self.addresses[host]
+
+    def get_timeout(self, host):
+        """
+        Get the number of seconds to wait for a connection to the given host.
+        """
+
+        estimator = self.estimators.get(host)
+
+        if estimator is not None and estimator.has_samples():
+            return estimator.get_timeout()
+
+        # Don't let fast hosts shorten the timeout of the hosts that haven't responded yet since
+        # these may be much slower (their ports would be wrongly reported as filtered)
+        initial_timeout = min(self.timeout, self.global_estimator.initial_timeout)
+
+        return max(initial_timeout, self.global_estimator.get_timeout())
+
+    def add_rtt_sample(self, host, rtt):
+        """
+        Record the time that it took for the host to respond to a connection attempt.
+        """
+
+        if host not in self.estimators:
+            self.estimators[host] = RTTEstimator(self.min_timeout, self.timeout)
+
+        self.estimators[host].add_sample(rtt)
+        self.global_estimator.add_sample(rtt)
+
+    def connect(self, selector, host, port, attempt=0, timeout=None):
+        """
+        Start a connection to the given host and port. If the connection attempt failed
+        immediately, the status of the port will be returned instead of a connection.
+        """
+
+        address = self.resolve(host)
+
+        if address is None:
+            return CLOSED_STATUS
+
+        family, socktype, proto, ip_address = address
+
+        try:
+            sock = socket.socket(family, socktype, proto)
+        except (socket.error, OSError):
+            return CLOSED_STATUS
+
+        sock.setblocking(False)
+        started_at = timer()
+
+        if family == socket.AF_INET6:
+            result = sock.connect_ex((ip_address, port, 0, 0))
+        else:
+            result = sock.connect_ex((ip_address, port))
+
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            sock.close()
+            return get_status(result)
+
+        if timeout is None:
+            timeout = self.get_timeout(host)
+
+        connection = Connection(host, port, sock, started_at, timeout, attempt)
+        selector.register(sock, EVENT_WRITE, connection)
+
+        return connection
+
+    def iter_scan(self, host_ports):
+        """
+        Scan the given host and port pairs and yield a tuple of the host, the port and the status as
+        each scan completes. The pairs are consumed incrementally and every socket is closed when
+        the iteration stops (even if it is stopped early).
+
+        Arguments:
+        host_ports -- an iterable of tuples of a host and a port
+        """
+
+        selector = make_selector()
+
+        try:
+            for completed in self._run(selector, iter(host_ports)):
+                yield completed
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+
+            selector.close()
+
+    def _finish(self, selector, connection):
+        connection.finished = True
+        selector.unregister(connection.sock)
+        connection.sock.close()
+
+    def _run(self, selector, host_ports):
+        pairs_exhausted = False
+
+        # These are the ports whose connection attempts timed out and that will be tried again
+        retries = collections.deque()
+
+        # This is a heap of the deadlines of the connections in flight. The timeouts differ between
+        # hosts so the connections don't expire in the order they were started. Connections that
+        # finished before their deadline are left on the heap and skipped once they reach the top.
+        deadlines = []
+        sequence = itertools.count()
+        in_flight = 0
+
+        while True:
+            completed = []
+
+            # Start more connections if there is room for them (retries go first)
+            while in_flight < self.max_concurrent and (retries or not pairs_exhausted):
+                if retries:
+                    host, port, attempt, timeout = retries.popleft()
+                else:
+                    try:
+                        host, port = next(host_ports)
+                    except StopIteration:
+                        pairs_exhausted = True
+                        break
+
+                    attempt, timeout = 0, None
+
+                connection = self.connect(selector, host, port, attempt, timeout)
+
+                if isinstance(connection, Connection):
+                    heapq.heappush(deadlines, (connection.deadline, next(sequence), connection))
+                    in_flight += 1
+                else:
+                    completed.append((host, port, connection))
+
+            for result in completed:
+                yield result
+
+            if in_flight == 0:
+                if pairs_exhausted and not retries:
+                    break
+
+                del deadlines[:]
                 continue
 
-            # Make the socket for performing the scan
-            sock_instance = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock_instance.settimeout(self.timeout)
+            # Discard the connections that already finished so that the next deadline is accurate
+            while deadlines[0][2].finished:
+                heapq.heappop(deadlines)
+
+            wait = max(0, deadlines[0][0] - timer())
+
+            # The time is taken once the connections complete since the consumer may take a while
+            # to process each result that is yielded below (which would inflate the RTT samples)
+            events = selector.select(wait)
+            now = timer()
+
+            # Process the connections that completed
+            for key, _ in events:
+                connection = key.data
+                error_code = connection.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+                in_flight -= 1
+                self._finish(selector, connection)
+
+                status = get_status(error_code)
+
+                # Both accepted and refused connections tell us how long the host takes to respond
+                if status != FILTERED_STATUS:
+                    self.add_rtt_sample(connection.host, now - connection.started_at)
+
+                yield connection.host, connection.port, status
+
+            # Expire the connections that didn't complete in time (as of when select() returned so
+            # that connections that completed since then aren't counted as filtered)
+            while deadlines and deadlines[0][0] <= now:
+                _, _, connection = heapq.heappop(deadlines)
+
+                if connection.finished:
+                    continue
+
+                in_flight -= 1
+                self._finish(selector, connection)
+
+                # Try again with a longer timeout in case the response was merely slow
+                if connection.attempt < self.retries:
+                    timeout = min(self.timeout, self.get_timeout(connection.host) * (2 ** (connection.attempt + 1)))
+                    retries.append((connection.host, connection.port, connection.attempt + 1, timeout))
+                else:
+                    yield connection.host, connection.port, FILTERED_STATUS
+
+def discover_hosts(hosts, method=TCP_DISCOVERY, discovery_ports=None, max_concurrent=DEFAULT_MAX_CONCURRENT,
+                   timeout=5, min_timeout=DEFAULT_MIN_TIMEOUT):
+    """
+    Determine which of the hosts are up and yield a tuple of the host, the status (up or down) and
+    the method used as each host is determined. ICMP discovery will fall back to TCP discovery if
+    the ICMP echo engine isn't available.
+
+    Arguments:
+    hosts -- the list of hosts to check
+    method -- the method to use to check the hosts (icmp or tcp)
+    discovery_ports -- the ports to connect to when using TCP (see DEFAULT_DISCOVERY_PORTS)
+    max_concurrent -- the maximum number of connections or pings in flight at once
+    timeout -- the maximum number of seconds to wait for a response
+    min_timeout -- the minimum number of seconds to wait for a connection to complete
+    """
+
+    if method not in DISCOVERY_METHODS:
+        raise ValueError("The discovery method must be one of: %s" % ", ".join(DISCOVERY_METHODS))
+
+    if method == ICMP_DISCOVERY:
+        ipv4_hosts = [host for host in hosts if ':' not in host]
+
+        # Use TCP for the hosts that the ICMP echo engine can't handle (IPv6)
+        if sys.platform != 'win32' and icmp.is_available() and ipv4_hosts:
+            engine = icmp.ICMPEchoEngine(timeout=timeout, max_outstanding=max_concurrent)
 
             try:
-                # Connect to the host via TCP
-                sock_instance.connect((host, port))
-            except socket.error:
-                # Note that it is in the closed state
-                self.output_queue.put((host, port, CLOSED_STATUS))
-            else:
-                # Note that it is in the open state
-                self.output_queue.put((host, port, OPEN_STATUS))
-                sock_instance.close()
-
-            self.input_queue.task_done()
-            self.output_queue.task_done()
-
-    def stop_running(self):
-        self.keep_running = False
-
-def port_scan(host, ports, thread_count=DEFAULT_THREAD_LIMIT, callback=None, timeout=5):
-    # Parse the ports if necessary
-    if isinstance(ports, (str, unicode)):
-        parsed_ports = parseintset.parseIntSet(ports)
-    else:
-        parsed_ports = ports
+                for host, _, return_code, _ in engine.iter_ping(ipv4_hosts, 1):
+                    yield host, UP_STATUS if return_code == 0 else DOWN_STATUS, ICMP_DISCOVERY
 
-    # Setup the queues
-    to_scan = Queue()
-    scanned = Queue()
+                hosts = [host for host in hosts if ':' in host]
+            except icmp.ICMPSocketUnavailable:
+                pass
 
-    # Prepare the scanners
-    # These scanners will monitor the input queue for new things to scan, scan them, and them put
-    # them in the output queue
-    scanners = [Scanner(to_scan, scanned, timeout) for i in range(min(thread_count,len(ports)))]
-    for scanner in scanners:
-        scanner.start()
+    if not hosts:
+        return
 
-    # Create the list of host ports to scan
-    host_ports = [(host, port) for port in parsed_ports]
-    for host_port in host_ports:
-        to_scan.put(host_port)
+    if discovery_ports is None:
+        discovery_ports = DEFAULT_DISCOVERY_PORTS
 
-    # This will store the list of successfully executed host/port combiations
-    results = {}
+    # Don't retry; a host is up as soon as any of the ports respond
+    scanner = PortScanner(timeout, max_concurrent, min_timeout, retries=0)
 
-    # This will contain the resulting data
-    data = []
+    # Hosts that cannot be resolved are down
+    for host in hosts:
+        if scanner.resolve(host) is None:
+            yield host, DOWN_STATUS, TCP_DISCOVERY
+
+    hosts = [host for host in hosts if scanner.resolve(host) is not None]
+    remaining = dict([(host, len(discovery_ports)) for host in hosts])
+
+    for host, _, status in scanner.iter_scan(interleave(hosts, parse_ports(discovery_ports))):
+        if host not in remaining:
+            continue
+
+        remaining[host] -= 1
+
+        # Both accepting and refusing a connection show that the host is up
+        if status != FILTERED_STATUS:
+            del remaining[host]
+            yield host, UP_STATUS, TCP_DISCOVERY
+
+        elif remaining[host] == 0:
+            del remaining[host]
+            yield host, DOWN_STATUS, TCP_DISCOVERY
+
+def make_discovery_result(host, status, method):
+    """
+    Make the dictionary describing whether a host is up.
+    """
+
+    return OrderedDict([
+        ('dest', host),
+        ('status', status),
+        ('discovery_method', method)
+    ])
+
+def get_live_hosts(hosts, discovery, discovery_ports=None, discovery_callback=None,
+                   max_concurrent=DEFAULT_MAX_CONCURRENT, timeout=5, min_timeout=DEFAULT_MIN_TIMEOUT):
+    """
+    Get the hosts that are up (in the order they were provided) using the given discovery method.
+    All of the hosts will be returned if the discovery method is None.
+    """
+
+    if discovery is None:
+        return hosts
+
+    live_hosts = set()
+
+    for host, status, method in discover_hosts(hosts, discovery, discovery_ports, max_concurrent,
+                                               timeout, min_timeout):
+        if status == UP_STATUS:
+            live_hosts.add(host)
+
+        if discovery_callback is not None:
+            discovery_callback(host, status, method)
 
-    for host, port in host_ports:
-        while (host, port) not in results:
-            # Get the queued thread: this will block if necessary
-            scanned_host, scanned_port, scan_status = scanned.get()
+    return [host for host in hosts if host in live_hosts]
 
-            # Log that that we performed the scan
-            results[(scanned_host, scanned_port)] = scan_status
+def iter_port_scan(dest, ports, max_concurrent=DEFAULT_MAX_CONCURRENT, timeout=5,
+                   min_timeout=DEFAULT_MIN_TIMEOUT, retries=DEFAULT_RETRIES, discovery=None,
+                   discovery_ports=None):
+    """
+    Scan the ports on the hosts and yield a dictionary describing the status of each port as
+    each scan completes.
 
-            # Append the data
-            data.append(OrderedDict({
-                'dest' : scanned_host,
-                'port' : 'TCP\\' + str(scanned_port),
-                'status': scan_status
-            }))
+    Arguments:
+    dest -- the hosts to scan (a host, a CIDR block or a list of these; see parse_hosts())
+    ports -- the ports to scan (either a list or a string such as "22,80,8000-8100")
+    max_concurrent -- the maximum number of connections in flight at once (across all hosts)
+    timeout -- the maximum number of seconds to wait for each connection to complete
+    min_timeout -- the minimum number of seconds to wait for each connection to complete
+    retries -- the number of times to retry a port whose connection attempt timed out
+    discovery -- the method to use to skip the hosts that are down (icmp, tcp or None to scan all)
+    discovery_ports -- the ports to check when discovering hosts using TCP
+    """
+
+    hosts = get_live_hosts(parse_hosts(dest), discovery, discovery_ports, None, max_concurrent,
+                           timeout, min_timeout)
+    scanner = PortScanner(timeout, max_concurrent, min_timeout, retries)
+
+    for host, port, status in scanner.iter_scan(interleave(hosts, parse_ports(ports))):
+        yield make_result(host, port, status)
+
+def make_result(host, port, status):
+    """
+    Make the dictionary describing the status of a port.
+    """
+
+    return OrderedDict({
+        'dest' : host,
+        'port' : 'TCP\\' + str(port),
+        'status': status
+    })
+
+def port_scan(host, ports, max_concurrent=DEFAULT_MAX_CONCURRENT, callback=None, timeout=5,
+              min_timeout=DEFAULT_MIN_TIMEOUT, retries=DEFAULT_RETRIES, discovery=None,
+              discovery_ports=None, discovery_callback=None, thread_count=None):
+    """
+    Scan the ports on the hosts and return a list of dictionaries describing the status of each
+    port (ordered by host and then by port). Hosts that were found to be down by the discovery
+    phase are not included.
+
+    Arguments:
+    host -- the hosts to scan (a host, a CIDR block or a list of these; see parse_hosts())
+    ports -- the ports to scan (either a list or a string such as "22,80,8000-8100")
+    max_concurrent -- the maximum number of connections in flight at once (across all hosts)
+    callback -- a function to call with the host, port and status as each scan completes
+    timeout -- the maximum number of seconds to wait for each connection to complete
+    min_timeout -- the minimum number of seconds to wait for each connection to complete
+    retries -- the number of times to retry a port whose connection attempt timed out
+    discovery -- the method to use to skip the hosts that are down (icmp, tcp or None to scan all)
+    discovery_ports -- the ports to check when discovering hosts using TCP
+    discovery_callback -- a function to call with the host, status and method as each host is discovered
+    thread_count -- the former name of max_concurrent (kept for the existing callers)
+    """
+
+    if thread_count is not None:
+        max_concurrent = thread_count
+
+    hosts = get_live_hosts(parse_hosts(host), discovery, discovery_ports, discovery_callback,
+                           max_concurrent, timeout, min_timeout)
+    parsed_ports = parse_ports(ports)
+
+    # This will store the status of each host/port combination
+    results = {}
+
+    scanner = PortScanner(timeout, max_concurrent, min_timeout, retries)
+
+    for scanned_host, scanned_port, scan_status in scanner.iter_scan(interleave(hosts, parsed_ports)):
+        results[(scanned_host, scanned_port)] = scan_status
 
         # Run the callback if one is present
         if callback is not None:
             callback(scanned_host, scanned_port, scan_status)
 
-    # Stop the threads
-    for scanner in scanners:
-        scanner.stop_running()
+    # This will contain the resulting data
+    data = []
 
-    return data
+    for scanned_host in hosts:
+        for port in parsed_ports:
+            data.append(make_result(scanned_host, port, results[(scanned_host, port)]))
 
+    return data
@@ -1,19 +1,77 @@
-import socket, re, sys
+import socket, re, sys, time
 from codecs import encode, decode
 from . import shared
+from ..whois_governor import governor, CircuitOpenError
+
+# Sometimes IANA simply won't give us the right root WHOIS server
+exceptions = {
+	".ac.uk": "whois.ja.net",
+	".ps": "whois.pnina.ps",
+	".buzz": "whois.nic.buzz",
+	".moe": "whois.nic.moe",
+	# The following is a bit hacky, but IANA won't return the right answer for example.com because it's a direct registration.
+	"example.com": "whois.verisign-grs.com"
+}
+
+# The root WHOIS server of each TLD rarely changes so the referrals from IANA are cached (in memory
+# and in the lookup cache on disk so that other processes can use them) for this many seconds.
+# Otherwise, every lookup would cost an extra request to IANA (which rate limits bulk lookups).
+ROOT_SERVER_TTL = 30 * 24 * 3600
+
+# This is the name that the referrals are stored under in the lookup cache
+ROOT_SERVER_CACHE_LOOKUP = "whois_root_server"
+
+# This maps the TLDs to the time that the referral expires and the root WHOIS server
+root_server_cache = {}
+
+# This is the cache on disk (see get_referral_cache()); it is False if it couldn't be opened
+referral_cache = None
+
+def get_referral_cache():
+	global referral_cache
+
+	if referral_cache is None:
+		try:
+			from ..result_cache import ResultCache
+			referral_cache = ResultCache()
+		except Exception:
+			# The referrals will only be cached in memory
+			referral_cache = False
+
+	return referral_cache or None
+
+def get_tld(domain):
+	return domain.rstrip(".").rsplit(".", 1)[-1].lower()
+
+def get_cached_root_server(tld):
+	cached = root_server_cache.get(tld)
+
+	if cached is not None and cached[0] > time.time():
+		return cached[1]
+
+	cache = get_referral_cache()
+
+	if cache is not None:
+		cached = cache.get(ROOT_SERVER_CACHE_LOOKUP, tld)
+
+		if cached is not None:
+			root_server_cache[tld] = (cached["expires"], cached["server"])
+			return cached["server"]
+
+	return None
+
+def cache_root_server(tld, server):
+	expires = time.time() + ROOT_SERVER_TTL
+	root_server_cache[tld] = (expires, server)
+
+	cache = get_referral_cache()
+
+	if cache is not None:
+		cache.set(ROOT_SERVER_CACHE_LOOKUP, tld, {"server": server, "expires": expires}, ROOT_SERVER_TTL)
 
 def get_whois_raw(domain, server="", previous=None, rfc3490=True, never_cut=False, with_server_list=False, server_list=None):
 	previous = previous or []
 	server_list = server_list or []
-	# Sometimes IANA simply won't give us the right root WHOIS server
-	exceptions = {
-		".ac.uk": "whois.ja.net",
-		".ps": "whois.pnina.ps",
-		".buzz": "whois.nic.buzz",
-		".moe": "whois.nic.moe",
-		# The following is a bit hacky, but IANA won't return the right answer for example.com because it's a direct registration.
-		"example.com": "whois.verisign-grs.com"
-	}
 	
 	if rfc3490:
 		if sys.version_info < (3, 0):
@@ -74,17 +132,32 @@ def get_whois_raw(domain, server="", previous=None, rfc3490=True, never_cut=Fals
 	
 def get_root_server(domain):
 	if domain is not None and '.' in domain:
+		# IANA only knows the TLDs so the referral for a domain is the same as for its TLD
+		tld = get_tld(domain)
+		target_server = get_cached_root_server(tld)
+		if target_server is not None:
+			return target_server
 		data = whois_request(domain, "whois.iana.org")
 		for line in [x.strip() for x in data.splitlines()]:
 			match = re.match("refer:\s*([^\s]+)", line)
 			if match is None:
 				continue
+			cache_root_server(tld, match.group(1))
 			return match.group(1)
 		raise shared.WhoisException("No root WHOIS server found for domain %s" % domain)
 	else:
 		raise shared.WhoisException("Invalid domain supplied")
 	
 def whois_request(domain, server, port=43):
+	# Every query goes through the server's limiter so that fanned out lookups don't get us blocked
+	# (and so that a server that keeps failing isn't waited on until it recovers)
+	try:
+		with governor.query(server):
+			return send_whois_request(domain, server, port)
+	except CircuitOpenError as exc:
+		raise shared.WhoisException(str(exc))
+
+def send_whois_request(domain, server, port=43):
 	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 	# Timeout in seconds
 	sock.settimeout(5)
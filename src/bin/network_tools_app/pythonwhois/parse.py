@@ -1,16 +1,24 @@
 from __future__ import print_function
-import re, sys, datetime, csv, pkgutil
+import re, sys, os, datetime, csv
+try:
+	import re._parser as sre_parse
+except ImportError:
+	import sre_parse
 from . import net, shared
+from ..compiled_data import load_compiled
 
 try: 
 	from io import StringIO
 except ImportError:
 	from cStringIO import StringIO
 
+# The reference datasets are stored alongside this module
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_FILES = ["airports.dat", "countries.dat", "countries3.dat", "states_au.dat", "states_us.dat", "states_ca.dat"]
+
 def pkgdata(name):
-	return open(name, 'rb').read()
-	
-	data = pkgutil.get_data("pythonwhois", name)
+	data = open(os.path.join(DATA_DIR, name), 'rb').read()
+
 	if sys.version_info < (3, 0):
 		return data
 	else:
@@ -27,28 +35,43 @@ def read_dataset(filename, destination, abbrev_key, name_key, is_dict=False):
 			destination[line[abbrev_key]] = line[name_key]
 	except IOError as e:
 		pass
-	
-airports = {}
-countries = {}
-states_au = {}
-states_us = {}
-states_ca = {}
-	
-try:
-	reader = csv.reader(pkgdata("airports.dat").splitlines())
 
-	for line in reader:
-		airports[line[4]] = line[2]
-		airports[line[5]] = line[2]
-except IOError as e:
-	# The distributor likely removed airports.dat for licensing reasons. We'll just leave an empty dict.
-	pass
+def read_datasets():
+	airports = {}
+	countries = {}
+	states_au = {}
+	states_us = {}
+	states_ca = {}
 
-read_dataset("countries.dat", countries, "iso", "name", is_dict=True)
-read_dataset("countries3.dat", countries, "iso3", "name", is_dict=True)
-read_dataset("states_au.dat", states_au, 0, 1)
-read_dataset("states_us.dat", states_us, "abbreviation", "name", is_dict=True)
-read_dataset("states_ca.dat", states_ca, "abbreviation", "name", is_dict=True)
+	try:
+		reader = csv.reader(pkgdata("airports.dat").splitlines())
+
+		for line in reader:
+			airports[line[4]] = line[2]
+			airports[line[5]] = line[2]
+	except IOError as e:
+		# The distributor likely removed airports.dat for licensing reasons. We'll just leave an empty dict.
+		pass
+
+	read_dataset("countries.dat", countries, "iso", "name", is_dict=True)
+	read_dataset("countries3.dat", countries, "iso3", "name", is_dict=True)
+	read_dataset("states_au.dat", states_au, 0, 1)
+	read_dataset("states_us.dat", states_us, "abbreviation", "name", is_dict=True)
+	read_dataset("states_ca.dat", states_ca, "abbreviation", "name", is_dict=True)
+
+	return {"airports": airports, "countries": countries, "states_au": states_au, "states_us": states_us, "states_ca": states_ca}
+
+datasets = None
+
+def get_datasets():
+	# The datasets are loaded on first use (from a precompiled copy when possible) since parsing
+	# them is slow and many imports of this module never normalize contacts
+	global datasets
+
+	if datasets is None:
+		datasets = load_compiled("pythonwhois_datasets", [os.path.join(DATA_DIR, filename) for filename in DATASET_FILES], read_datasets)
+
+	return datasets
 
 def precompile_regexes(source, flags=0):
 	return [re.compile(regex, flags) for regex in source]
@@ -422,6 +445,213 @@ nic_contact_references["tech"] = precompile_regexes(nic_contact_references["tech
 nic_contact_references["admin"] = precompile_regexes(nic_contact_references["admin"])
 nic_contact_references["billing"] = precompile_regexes(nic_contact_references["billing"])
 
+def add_literal_runs(items, runs, to_char):
+	for op, value in items:
+		if op == sre_parse.LITERAL:
+			runs[-1] += to_char(value)
+		# The contents of a group are matched in place (unless the group changes the flags)
+		elif op == sre_parse.SUBPATTERN and (len(value) == 2 or not (value[1] or value[2])):
+			add_literal_runs(value[-1], runs, to_char)
+		else:
+			runs.append("")
+
+def required_literals(regex):
+	# Get the runs of characters that every match of the compiled regex must contain (longest first).
+	# Text that doesn't contain all of them can be skipped without running the regex.
+	if isinstance(regex.pattern, str):
+		to_char = chr
+	else:
+		to_char = unichr
+
+	runs = [""]
+	add_literal_runs(sre_parse.parse(regex.pattern, regex.flags), runs, to_char)
+
+	if regex.flags & re.IGNORECASE:
+		runs = [run.lower() for run in runs]
+
+	literals = []
+
+	for run in sorted(runs, key=len, reverse=True):
+		if run != "" and run not in literals:
+			literals.append(run)
+
+	return literals
+
+def required_literal(regex):
+	# Get the longest run of characters that every match of the compiled regex must contain (or None
+	# if there isn't one)
+	literals = required_literals(regex)
+
+	if len(literals) == 0:
+		return None
+	else:
+		return literals[0]
+
+def is_ascii(text):
+	try:
+		text.encode("ascii")
+	except UnicodeError:
+		return False
+
+	return True
+
+class RuleEngine(object):
+	"""
+	Matches the lines of whois responses against a set of rules (a dictionary of field names to
+	lists of compiled regexes that capture the value in the "val" group).
+
+	Running every regex against every line is slow since most lines can only match a few of them.
+	Thus, the regexes are indexed by the literal text that they require (usually the label of the
+	field, such as "creation date:") and each line is only matched against the regexes whose text it
+	contains. The output is the same as running every regex against every line.
+	"""
+
+	# This is the number of lines whose candidate regexes are remembered (many lines, such as the
+	# disclaimers, are the same in every response from a server)
+	CANDIDATE_CACHE_SIZE = 10000
+
+	def __init__(self, rules):
+		self.rule_keys = list(rules.keys())
+
+		# Each entry is sortable by the order that the original loop ran the regexes in
+		self.entries = []
+		self.index = {}
+		self.unindexed = []
+
+		for rule_index, rule_key in enumerate(self.rule_keys):
+			for position, regex in enumerate(rules[rule_key]):
+				entry = (rule_index, position, rule_key, regex)
+				self.entries.append(entry)
+
+				literal = required_literal(regex)
+
+				# Regexes that are case sensitive can't be matched against the lowered lines
+				if literal is None or not (regex.flags & re.IGNORECASE):
+					self.unindexed.append(entry)
+				else:
+					self.index.setdefault(literal, []).append(entry)
+
+		self.index_items = list(self.index.items())
+		self.candidate_cache = {}
+
+	def get_candidates(self, lowered_line):
+		candidates = self.candidate_cache.get(lowered_line)
+
+		if candidates is None:
+			candidates = list(self.unindexed)
+
+			for literal, entries in self.index_items:
+				if literal in lowered_line:
+					candidates.extend(entries)
+
+			candidates.sort()
+
+			if len(self.candidate_cache) >= self.CANDIDATE_CACHE_SIZE:
+				self.candidate_cache.clear()
+
+			self.candidate_cache[lowered_line] = candidates
+
+		return candidates
+
+	def match(self, segment, found):
+		# Get a list of the field names and values (in the order of the rules) for the fields that
+		# aren't already in found
+		lines = segment.splitlines()
+
+		# The lines are only filtered when they are ASCII since lower() doesn't fold all characters the
+		# same way that re.IGNORECASE does
+		if is_ascii(segment):
+			lowered_lines = segment.lower().splitlines()
+		else:
+			lowered_lines = None
+
+		matches = {}
+
+		for number, line in enumerate(lines):
+			if lowered_lines is None:
+				candidates = self.entries
+			else:
+				candidates = self.get_candidates(lowered_lines[number])
+
+			for rule_index, position, rule_key, regex in candidates:
+				if rule_key in found:
+					continue
+
+				result = regex.search(line)
+
+				if result is not None:
+					val = result.group("val").strip()
+					if val != "":
+						try:
+							matches[rule_key].append(val)
+						except KeyError as e:
+							matches[rule_key] = [val]
+
+		return [(rule_key, matches[rule_key]) for rule_key in self.rule_keys if rule_key in matches]
+
+data_rule_engine = RuleEngine(grammar["_data"])
+
+class PrefilteredRegexes(object):
+	"""
+	A list of regexes that are searched for in whole segments in order (such as the contact
+	regexes). Many of the regexes are expensive to run so the regexes that require literal text (see
+	required_literals()) that doesn't appear in the segment are skipped without running them.
+	"""
+
+	def __init__(self, regexes):
+		self.regexes = regexes
+		self.entries = [(regex, required_literals(regex), bool(regex.flags & re.IGNORECASE)) for regex in regexes]
+
+	def candidates(self, segment):
+		# Get the regexes (in order) that could match the segment
+		lowered_segment = None
+		present = {}
+
+		# lower() only folds characters like re.IGNORECASE does for ASCII text so case-insensitive
+		# regexes aren't filtered on other text
+		segment_is_ascii = is_ascii(segment)
+
+		for regex, literals, ignore_case in self.entries:
+			if ignore_case:
+				if not segment_is_ascii:
+					literals = []
+				elif lowered_segment is None:
+					lowered_segment = segment.lower()
+
+			skip = False
+
+			for literal in literals:
+				key = (literal, ignore_case)
+
+				if key not in present:
+					present[key] = literal in (lowered_segment if ignore_case else segment)
+
+				if not present[key]:
+					skip = True
+					break
+
+			if not skip:
+				yield regex
+
+	def search(self, segment):
+		# Get the match of the first regex that matches the segment (or None if none of them do)
+		for regex in self.candidates(segment):
+			match = regex.search(segment)
+
+			if match is not None:
+				return match
+
+		return None
+
+registrant_regexes = PrefilteredRegexes(registrant_regexes)
+tech_contact_regexes = PrefilteredRegexes(tech_contact_regexes)
+admin_contact_regexes = PrefilteredRegexes(admin_contact_regexes)
+billing_contact_regexes = PrefilteredRegexes(billing_contact_regexes)
+nic_contact_regexes = PrefilteredRegexes(nic_contact_regexes)
+
+for category in nic_contact_references:
+	nic_contact_references[category] = PrefilteredRegexes(nic_contact_references[category])
+
 if sys.version_info < (3, 0):
 	def is_string(data):
 		"""Test for string with support for python 2."""
@@ -439,19 +669,9 @@ def parse_raw_whois(raw_data, normalized=None, never_query_handles=True, handle_
 	raw_data = [segment.replace("\r", "") for segment in raw_data] # Carriage returns are the devil
 
 	for segment in raw_data:
-		for rule_key, rule_regexes in grammar['_data'].items():
-			if (rule_key in data) == False:
-				for line in segment.splitlines():
-					for regex in rule_regexes:
-						result = re.search(regex, line)
-
-						if result is not None:
-							val = result.group("val").strip()
-							if val != "":
-								try:
-									data[rule_key].append(val)
-								except KeyError as e:
-									data[rule_key] = [val]
+		# Fields found in an earlier segment aren't looked for in the later ones
+		for rule_key, values in data_rule_engine.match(segment, data):
+			data[rule_key] = values
 
 		# Whois.com is a bit special... Fabulous.com also seems to use this format. As do some others.
 		match = re.search("^\s?Name\s?[Ss]ervers:?\s*\n((?:\s*.+\n)+?\s?)\n", segment, re.MULTILINE)
@@ -637,6 +857,10 @@ def normalize_data(data, normalized):
 			else:
 				data[key] = [normalize_name(item, abbreviation_threshold=threshold, length_threshold=1, ignore_nic=ignore_nic) for item in data[key]]
 
+	reference = get_datasets()
+	airports, countries = reference["airports"], reference["countries"]
+	states_au, states_us, states_ca = reference["states_au"], reference["states_us"], reference["states_ca"]
+
 	for contact_type, contact in data['contacts'].items():
 		if contact is not None:
 			if 'country' in contact and contact['country'] in countries:
@@ -742,68 +966,136 @@ def normalize_name(value, abbreviation_threshold=4, length_threshold=8, lowercas
 		normalized_lines.append(line)
 	return "\n".join(normalized_lines)
 
-def parse_dates(dates):
-	global grammar
-	parsed_dates = []
+class DateMatch(object):
+	"""
+	The groups of a date format that matched a date string (like the match object of the regex).
+	"""
+
+	def __init__(self, date, spans):
+		self.date = date
+		self.spans = spans
+
+	def group(self, name):
+		# Like a match object, unknown groups raise an IndexError and unmatched groups are None
+		try:
+			start, end = self.spans[name]
+		except KeyError:
+			raise IndexError("no such group")
+
+		if start < 0:
+			return None
+
+		return self.date[start:end]
+
+# This maps the ASCII digits to "9" (see get_date_shape())
+DIGIT_TRANSLATION = dict((ord(digit), u"9") for digit in "0123456789")
+
+if sys.version_info < (3, 0):
+	import string
+	DIGIT_BYTES_TRANSLATION = string.maketrans("0123456789", "9999999999")
+
+def get_date_shape(date):
+	# Get the date string with every digit replaced by 9. The date formats only match digits with
+	# [0-9] so every string with the same shape matches the same format with the same group spans.
+	if sys.version_info < (3, 0) and isinstance(date, str):
+		return date.translate(DIGIT_BYTES_TRANSLATION)
+	else:
+		return date.translate(DIGIT_TRANSLATION)
+
+# This is the number of date shapes whose matching format is remembered
+DATE_SHAPE_CACHE_SIZE = 10000
+
+# This maps the shapes of the date strings to the spans of the groups of the first format that
+# matched (or None if no format matched). Each WHOIS server formats its dates the same way so the
+# formats only need to be tried for the first date from each server.
+date_shape_cache = {}
+
+def match_date_format(date):
+	# Get the groups of the first date format that matches the date string (or None if none do)
+	shape = get_date_shape(date)
+
+	try:
+		spans = date_shape_cache[shape]
+	except KeyError:
+		spans = None
 
-	for date in dates:
 		for rule in grammar['_dateformats']:
-			result = re.match(rule, date)
+			result = rule.match(shape)
 
 			if result is not None:
-				try:
-					# These are always numeric. If they fail, there is no valid date present.
-					year = int(result.group("year"))
-					day = int(result.group("day"))
+				spans = dict((name, result.span(name)) for name in rule.groupindex)
+				break
 
-					# Detect and correct shorthand year notation
-					if year < 60:
-						year += 2000
-					elif year < 100:
-						year += 1900
+		if len(date_shape_cache) >= DATE_SHAPE_CACHE_SIZE:
+			date_shape_cache.clear()
 
-					# This will require some more guesswork - some WHOIS servers present the name of the month
-					try:
-						month = int(result.group("month"))
-					except ValueError as e:
-						# Apparently not a number. Look up the corresponding number.
-						try:
-							month = grammar['_months'][result.group("month").lower()]
-						except KeyError as e:
-							# Unknown month name, default to 0
-							month = 0
+		date_shape_cache[shape] = spans
 
-					try:
-						hour = int(result.group("hour"))
-					except IndexError as e:
-						hour = 0
-					except TypeError as e:
-						hour = 0
+	if spans is None:
+		return None
 
-					try:
-						minute = int(result.group("minute"))
-					except IndexError as e:
-						minute = 0
-					except TypeError as e:
-						minute = 0
+	return DateMatch(date, spans)
 
-					try:
-						second = int(result.group("second"))
-					except IndexError as e:
-						second = 0
-					except TypeError as e:
-						second = 0
+def parse_dates(dates):
+	global grammar
+	parsed_dates = []
 
-					break
+	for date in dates:
+		result = match_date_format(date)
+
+		if result is not None:
+			try:
+				# These are always numeric. If they fail, there is no valid date present.
+				year = int(result.group("year"))
+				day = int(result.group("day"))
+
+				# Detect and correct shorthand year notation
+				if year < 60:
+					year += 2000
+				elif year < 100:
+					year += 1900
+
+				# This will require some more guesswork - some WHOIS servers present the name of the month
+				try:
+					month = int(result.group("month"))
 				except ValueError as e:
-					# Something went horribly wrong, maybe there is no valid date present?
-					year = 0
-					month = 0
-					day = 0
+					# Apparently not a number. Look up the corresponding number.
+					try:
+						month = grammar['_months'][result.group("month").lower()]
+					except KeyError as e:
+						# Unknown month name, default to 0
+						month = 0
+
+				try:
+					hour = int(result.group("hour"))
+				except IndexError as e:
+					hour = 0
+				except TypeError as e:
 					hour = 0
+
+				try:
+					minute = int(result.group("minute"))
+				except IndexError as e:
+					minute = 0
+				except TypeError as e:
 					minute = 0
+
+				try:
+					second = int(result.group("second"))
+				except IndexError as e:
+					second = 0
+				except TypeError as e:
 					second = 0
-					print(e.message) # FIXME: This should have proper logging of some sort...?
+
+			except ValueError as e:
+				# Something went horribly wrong, maybe there is no valid date present?
+				year = 0
+				month = 0
+				day = 0
+				hour = 0
+				minute = 0
+				second = 0
+				print(e.message) # FIXME: This should have proper logging of some sort...?
 		try:
 			if year > 0:
 				try:
@@ -846,32 +1138,24 @@ def parse_registrants(data, never_query_handles=True, handle_server=""):
 	admin_contact = None
 
 	for segment in data:
-		for regex in registrant_regexes:
-			match = re.search(regex, segment)
-			if match is not None:
-				registrant = match.groupdict()
-				break
+		match = registrant_regexes.search(segment)
+		if match is not None:
+			registrant = match.groupdict()
 
 	for segment in data:
-		for regex in tech_contact_regexes:
-			match = re.search(regex, segment)
-			if match is not None:
-				tech_contact = match.groupdict()
-				break
+		match = tech_contact_regexes.search(segment)
+		if match is not None:
+			tech_contact = match.groupdict()
 
 	for segment in data:
-		for regex in admin_contact_regexes:
-			match = re.search(regex, segment)
-			if match is not None:
-				admin_contact = match.groupdict()
-				break
+		match = admin_contact_regexes.search(segment)
+		if match is not None:
+			admin_contact = match.groupdict()
 
 	for segment in data:
-		for regex in billing_contact_regexes:
-			match = re.search(regex, segment)
-			if match is not None:
-				billing_contact = match.groupdict()
-				break
+		match = billing_contact_regexes.search(segment)
+		if match is not None:
+			billing_contact = match.groupdict()
 
 	# Find NIC handle contact definitions
 	handle_contacts = parse_nic_contact(data)
@@ -879,9 +1163,15 @@ def parse_registrants(data, never_query_handles=True, handle_server=""):
 	# Find NIC handle references and process them
 	missing_handle_contacts = []
 	for category in nic_contact_references:
-		for regex in nic_contact_references[category]:
-			for segment in data:
-				match = re.search(regex, segment)
+		references = nic_contact_references[category]
+		candidates = [set(references.candidates(segment)) for segment in data]
+
+		for regex in references.regexes:
+			for segment, segment_candidates in zip(data, candidates):
+				if regex not in segment_candidates:
+					continue
+
+				match = regex.search(segment)
 				if match is not None:
 					data_reference = match.groupdict()
 					if data_reference["handle"] == "-" or re.match("https?:\/\/", data_reference["handle"]) is not None:
@@ -917,65 +1207,7 @@ def parse_registrants(data, never_query_handles=True, handle_server=""):
 	# Post-processing
 	for obj in (registrant, tech_contact, billing_contact, admin_contact):
 		if obj is not None:
-			for key in list(obj.keys()):
-				if obj[key] is None or obj[key].strip() == "": # Just chomp all surrounding whitespace
-					del obj[key]
-				else:
-					obj[key] = obj[key].strip()
-			if "phone_ext" in obj:
-				if "phone" in obj:
-					obj["phone"] += " ext. %s" % obj["phone_ext"]
-					del obj["phone_ext"]
-			if "street1" in obj:
-				street_items = []
-				i = 1
-				while True:
-					try:
-						street_items.append(obj["street%d" % i])
-						del obj["street%d" % i]
-					except KeyError as e:
-						break
-					i += 1
-				obj["street"] = "\n".join(street_items)
-			if "organization1" in obj: # This is to deal with eg. HKDNR, who allow organization names in multiple languages.
-				organization_items = []
-				i = 1
-				while True:
-					try:
-						if obj["organization%d" % i].strip() != "":
-							organization_items.append(obj["organization%d" % i])
-							del obj["organization%d" % i]
-					except KeyError as e:
-						break
-					i += 1
-				obj["organization"] = "\n".join(organization_items)
-			if 'changedate' in obj:
-				obj['changedate'] = parse_dates([obj['changedate']])[0]
-			if 'creationdate' in obj:
-				obj['creationdate'] = parse_dates([obj['creationdate']])[0]
-			if 'street' in obj and "\n" in obj["street"] and 'postalcode' not in obj:
-				# Deal with certain mad WHOIS servers that don't properly delimit address data... (yes, AFNIC, looking at you)
-				lines = [x.strip() for x in obj["street"].splitlines()]
-				if " " in lines[-1]:
-					postal_code, city = lines[-1].split(" ", 1)
-					if "." not in lines[-1] and re.match("[0-9]", postal_code) and len(postal_code) >= 3:
-						obj["postalcode"] = postal_code
-						obj["city"] = city
-						obj["street"] = "\n".join(lines[:-1])
-			if 'firstname' in obj or 'lastname' in obj:
-				elements = []
-				if 'firstname' in obj:
-					elements.append(obj["firstname"])
-				if 'lastname' in obj:
-					elements.append(obj["lastname"])
-				obj["name"] = " ".join(elements)
-			if 'country' in obj and 'city' in obj and (re.match("^R\.?O\.?C\.?$", obj["country"], re.IGNORECASE) or obj["country"].lower() == "republic of china") and obj["city"].lower() == "taiwan":
-				# There's an edge case where some registrants append ", Republic of China" after "Taiwan", and this is mis-parsed
-				# as Taiwan being the city. This is meant to correct that.
-				obj["country"] = "%s, %s" % (obj["city"], obj["country"])
-				lines = [x.strip() for x in obj["street"].splitlines()]
-				obj["city"] = lines[-1]
-				obj["street"] = "\n".join(lines[:-1])
+			postprocess_contact(obj)
 
 	return {
 		"registrant": registrant,
@@ -984,6 +1216,69 @@ def parse_registrants(data, never_query_handles=True, handle_server=""):
 		"billing": billing_contact,
 	}
 
+def postprocess_contact(obj):
+	# Clean up the fields of a contact (this is also used on the contacts of NIC handles that are looked up
+	# separately)
+	for key in list(obj.keys()):
+		if obj[key] is None or obj[key].strip() == "": # Just chomp all surrounding whitespace
+			del obj[key]
+		else:
+			obj[key] = obj[key].strip()
+	if "phone_ext" in obj:
+		if "phone" in obj:
+			obj["phone"] += " ext. %s" % obj["phone_ext"]
+			del obj["phone_ext"]
+	if "street1" in obj:
+		street_items = []
+		i = 1
+		while True:
+			try:
+				street_items.append(obj["street%d" % i])
+				del obj["street%d" % i]
+			except KeyError as e:
+				break
+			i += 1
+		obj["street"] = "\n".join(street_items)
+	if "organization1" in obj: # This is to deal with eg. HKDNR, who allow organization names in multiple languages.
+		organization_items = []
+		i = 1
+		while True:
+			try:
+				if obj["organization%d" % i].strip() != "":
+					organization_items.append(obj["organization%d" % i])
+					del obj["organization%d" % i]
+			except KeyError as e:
+				break
+			i += 1
+		obj["organization"] = "\n".join(organization_items)
+	if 'changedate' in obj:
+		obj['changedate'] = parse_dates([obj['changedate']])[0]
+	if 'creationdate' in obj:
+		obj['creationdate'] = parse_dates([obj['creationdate']])[0]
+	if 'street' in obj and "\n" in obj["street"] and 'postalcode' not in obj:
+		# Deal with certain mad WHOIS servers that don't properly delimit address data... (yes, AFNIC, looking at you)
+		lines = [x.strip() for x in obj["street"].splitlines()]
+		if " " in lines[-1]:
+			postal_code, city = lines[-1].split(" ", 1)
+			if "." not in lines[-1] and re.match("[0-9]", postal_code) and len(postal_code) >= 3:
+				obj["postalcode"] = postal_code
+				obj["city"] = city
+				obj["street"] = "\n".join(lines[:-1])
+	if 'firstname' in obj or 'lastname' in obj:
+		elements = []
+		if 'firstname' in obj:
+			elements.append(obj["firstname"])
+		if 'lastname' in obj:
+			elements.append(obj["lastname"])
+		obj["name"] = " ".join(elements)
+	if 'country' in obj and 'city' in obj and (re.match("^R\.?O\.?C\.?$", obj["country"], re.IGNORECASE) or obj["country"].lower() == "republic of china") and obj["city"].lower() == "taiwan":
+		# There's an edge case where some registrants append ", Republic of China" after "Taiwan", and this is mis-parsed
+		# as Taiwan being the city. This is meant to correct that.
+		obj["country"] = "%s, %s" % (obj["city"], obj["country"])
+		lines = [x.strip() for x in obj["street"].splitlines()]
+		obj["city"] = lines[-1]
+		obj["street"] = "\n".join(lines[:-1])
+
 def fetch_nic_contact(handle, lookup_server):
 	response = net.get_whois_raw(handle, lookup_server)
 	response = [segment.replace("\r", "") for segment in response] # Carriage returns are the devil
@@ -996,9 +1291,14 @@ def fetch_nic_contact(handle, lookup_server):
 	
 def parse_nic_contact(data):
 	handle_contacts = []
-	for regex in nic_contact_regexes:
-		for segment in data:
-			matches = re.finditer(regex, segment)
+	candidates = [set(nic_contact_regexes.candidates(segment)) for segment in data]
+
+	for regex in nic_contact_regexes.regexes:
+		for segment, segment_candidates in zip(data, candidates):
+			if regex not in segment_candidates:
+				continue
+
+			matches = regex.finditer(segment)
 			for match in matches:
 				handle_contacts.append(match.groupdict())
 				
@@ -0,0 +1,228 @@
+"""
+This module provides a persistent cache of lookup results so that lookups don't have to be
+repeated every time a search runs (each lookup invocation is a new process).
+
+The cache is stored in a SQLite database under $SPLUNK_HOME/var in WAL mode so that lookups running
+in separate processes can read it while another process writes to it. Every entry has its own
+time-to-live and the least recently used entries are evicted once the cache exceeds its size limit.
+
+Here is a sample of using the cache:
+
+from network_tools_app.result_cache import ResultCache
+
+cache = ResultCache()
+result = cache.get('whois', 'textcritical.net')
+
+if result is None:
+    result = whois('textcritical.net')
+    cache.set('whois', 'textcritical.net', result, ttl=6 * 3600)
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from splunk.clilib.bundle_paths import make_splunkhome_path
+
+# This is the maximum size of the cached results (in bytes) before entries are evicted
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# This is the number of writes between checks of whether entries need to be evicted
+EVICTION_INTERVAL = 500
+
+def get_default_path():
+    """
+    Get the path of the cache database.
+    """
+
+    return make_splunkhome_path(['var', 'lib', 'splunk', 'network_tools', 'lookup_cache.sqlite'])
+
+class ResultCache(object):
+    """
+    A persistent cache of results with a time-to-live for each entry. This can be shared between
+    threads.
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES, logger=None):
+        """
+        Constructs the cache (creating the database if necessary).
+
+        Arguments:
+        path -- the path of the database (defaults to a file under $SPLUNK_HOME/var)
+        max_bytes -- the maximum size of the cached results before entries are evicted
+        logger -- the logger to write errors to
+        """
+
+        if path is None:
+            path = get_default_path()
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.logger = logger
+
+        self.hits = 0
+        self.misses = 0
+        self.writes_since_eviction = 0
+
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        """
+        Open the database if it isn't open yet.
+        """
+
+        if self.connection is not None:
+            return self.connection
+
+        directory = os.path.dirname(self.path)
+
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process may have created it at the same time
+                if not os.path.isdir(directory):
+                    raise
+
+        connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False,
+                                     isolation_level=None)
+
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+
+        connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                                lookup TEXT NOT NULL,
+                                key TEXT NOT NULL,
+                                value TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                expires REAL NOT NULL,
+                                accessed REAL NOT NULL,
+                                PRIMARY KEY (lookup, key))""")
+
+        connection.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+        self.connection = connection
+
+        return connection
+
+    def log_error(self, message, *args):
+        if self.logger is not None:
+            self.logger.warn(message, *args)
+
+    def get(self, lookup, key):
+        """
+        Get the cached result or None if there isn't an unexpired result.
+
+        Arguments:
+        lookup -- the name of the type of lookup (e.g. "whois")
+        key -- the string that identifies the arguments of the lookup
+        """
+
+        now = time.time()
+
+        with self.lock:
+            try:
+                connection = self.connect()
+
+                row = connection.execute("SELECT value FROM results WHERE lookup = ? AND key = ? AND expires > ?",
+                                         (lookup, key, now)).fetchone()
+
+                if row is not None:
+                    connection.execute("UPDATE results SET accessed = ? WHERE lookup = ? AND key = ?",
+                                       (now, lookup, key))
+
+            except sqlite3.Error as exception:
+                # A cache that can't be used shouldn't stop the lookup from working
+                self.log_error("Unable to read from the lookup cache, path=%s, error=%s", self.path, exception)
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def set(self, lookup, key, value, ttl):
+        """
+        Cache the result.
+
+        Arguments:
+        lookup -- the name of the type of lookup (e.g. "whois")
+        key -- the string that identifies the arguments of the lookup
+        value -- the result (values that JSON cannot represent are stored as strings)
+        ttl -- the number of seconds that the result is valid for
+        """
+
+        if ttl is None or ttl <= 0:
+            return
+
+        now = time.time()
+        serialized = json.dumps(value, default=str)
+
+        with self.lock:
+            try:
+                connection = self.connect()
+
+                connection.execute("INSERT OR REPLACE INTO results (lookup, key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                                   (lookup, key, serialized, len(serialized), now + ttl, now))
+
+                self.writes_since_eviction += 1
+
+                if self.writes_since_eviction >= EVICTION_INTERVAL:
+                    self.evict()
+
+            except sqlite3.Error as exception:
+                self.log_error("Unable to write to the lookup cache, path=%s, error=%s", self.path, exception)
+
+    def evict(self):
+        """
+        Remove the expired entries and then the least recently used entries until the cache is
+        within its size limit. This must be called with the lock held.
+        """
+
+        connection = self.connect()
+        self.writes_since_eviction = 0
+
+        connection.execute("DELETE FROM results WHERE expires <= ?", (time.time(),))
+
+        total_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+        if total_bytes <= self.max_bytes:
+            return
+
+        # Find the access time before which entries need to be removed to get under the limit
+        excess = total_bytes - self.max_bytes
+        removed = 0
+        cutoff = None
+
+        for size, accessed in connection.execute("SELECT size, accessed FROM results ORDER BY accessed"):
+            removed += size
+            cutoff = accessed
+
+            if removed >= excess:
+                break
+
+        if cutoff is not None:
+            connection.execute("DELETE FROM results WHERE accessed <= ?", (cutoff,))
+
+    def close(self):
+        """
+        Evict any entries that need to be evicted and close the database.
+        """
+
+        with self.lock:
+            if self.connection is None:
+                return
+
+            try:
+                self.evict()
+            except sqlite3.Error as exception:
+                self.log_error("Unable to evict entries from the lookup cache, path=%s, error=%s", self.path, exception)
+
+            self.connection.close()
+            self.connection = None
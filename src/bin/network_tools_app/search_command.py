@@ -35,20 +35,205 @@ if __name__ == '__main__':
         sys.exit(0)
     except Exception as e:
         print e
+
+
+
+Commands can use Splunk's chunked protocol (version 2) instead so that large sets of results are
+processed in chunks with bounded memory (and the output of each chunk is sent as soon as it is
+ready). To do so, set chunked to True on the class and declare the command with "chunked = true" in
+commands.conf. handle_results() will then be called once for each chunk of results (or once with no
+results if is_generating() returns True).
+
+Resources that ought to last for the whole run of the command (such as worker processes or
+connections) should be created in setup() and released in teardown() rather than in
+handle_results() since these are only called once, even when there are many chunks.
 """
 
 import splunk.Intersplunk
 import sys
+import re
+import csv
+import json
+import collections
 import logging
 from logging import handlers
 
+# Python 2+3 compatible in-memory text stream
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
 
+from network_tools_app.worker_pool import map_concurrently
+from network_tools_app import set_default_session_key
+
+# This matches each value of a multi-value field as encoded in a "__mv_" field (dollar signs within
+# the values are doubled)
+MULTIVALUE_RE = re.compile(r'\$((?:[^$]|\$\$)*)\$')
+
+class ChunkedProtocol(object):
+    """
+    Reads and writes the chunks of Splunk's chunked custom search command protocol (version 2).
+    Each chunk consists of a header line ("chunked 1.0,<metadata length>,<body length>") followed
+    by the metadata (a JSON object) and the body (results as CSV).
+    """
+
+    HEADER_PREFIX = b'chunked 1.0,'
+
+    def __init__(self, input_stream=None, output_stream=None):
+        """
+        Constructs the protocol handler.
+
+        Arguments:
+        input_stream -- The binary stream to read chunks from (defaults to standard input)
+        output_stream -- The binary stream to write chunks to (defaults to standard output)
+        """
+
+        self.input_stream = input_stream or getattr(sys.stdin, 'buffer', sys.stdin)
+        self.output_stream = output_stream or getattr(sys.stdout, 'buffer', sys.stdout)
+
+    def read_chunk(self):
+        """
+        Read a chunk and return a tuple of the metadata and body. None will be returned once the
+        input has ended.
+        """
+
+        header = self.input_stream.readline()
+
+        # Skip blank lines between chunks
+        while header and header.strip() == b'':
+            header = self.input_stream.readline()
+
+        if not header:
+            return None
+
+        if not header.startswith(self.HEADER_PREFIX):
+            raise ValueError("Invalid chunk header: %r" % header)
+
+        metadata_length, body_length = [int(value) for value in header[len(self.HEADER_PREFIX):].strip().split(b',')]
+
+        metadata = self.input_stream.read(metadata_length)
+        body = self.input_stream.read(body_length)
+
+        if metadata_length > 0:
+            metadata = json.loads(metadata.decode('utf-8'))
+        else:
+            metadata = {}
+
+        return metadata, body.decode('utf-8')
+
+    def write_chunk(self, metadata, body=''):
+        """
+        Write a chunk.
+
+        Arguments:
+        metadata -- A dictionary of the metadata
+        body -- The body of the chunk (usually results encoded with encode_results())
+        """
+
+        metadata = json.dumps(metadata).encode('utf-8')
+        body = body.encode('utf-8')
+
+        self.output_stream.write(b'chunked 1.0,%d,%d\n' % (len(metadata), len(body)))
+        self.output_stream.write(metadata)
+        self.output_stream.write(body)
+        self.output_stream.flush()
+
+    @classmethod
+    def decode_multivalue(cls, value):
+        """
+        Convert the value of a "__mv_" field (such as "$a$;$b$") into a list of the values.
+        """
+
+        return [match.replace('$$', '$') for match in MULTIVALUE_RE.findall(value)]
+
+    @classmethod
+    def decode_results(cls, body):
+        """
+        Convert the body of a chunk into a list of results. The values of multi-value fields
+        (described by the fields starting with "__mv_") are provided as lists so that
+        encode_results() writes them back out as multi-value fields.
+        """
+
+        if not body:
+            return []
+
+        results = []
+
+        for row in csv.DictReader(StringIO(body)):
+            result = dict([(field, value) for field, value in row.items() if not field.startswith('__mv_')])
+
+            for field, value in row.items():
+                if not field.startswith('__mv_') or not value:
+                    continue
+
+                # Fields with a single value are kept as strings
+                values = cls.decode_multivalue(value)
+
+                if len(values) > 1:
+                    result[field[len('__mv_'):]] = values
+
+            results.append(result)
+
+        return results
+
+    @classmethod
+    def encode_results(cls, results):
+        """
+        Convert a list of results into the body of a chunk. Lists are written as multi-value
+        fields.
+        """
+
+        if not results:
+            return ''
+
+        fieldnames = []
+        known_fields = set()
+        rows = []
+
+        for result in results:
+            row = {}
+
+            for field, value in result.items():
+                if field not in known_fields:
+                    known_fields.add(field)
+                    fieldnames.append(field)
+
+                if isinstance(value, (list, tuple)):
+                    row[field] = "\n".join([str(v) for v in value])
+                    row['__mv_' + field] = ';'.join(['$' + str(v).replace('$', '$$') + '$' for v in value])
+                else:
+                    row[field] = value
+
+            rows.append(row)
+
+        # Include the multi-value columns for the fields that had a list
+        for row in rows:
+            for field in row:
+                if field.startswith('__mv_') and field not in known_fields:
+                    known_fields.add(field)
+                    fieldnames.append(field)
+
+        output = StringIO()
+        writer = csv.DictWriter(output, fieldnames=fieldnames, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+        return output.getvalue()
+
 class SearchCommand(object):
     """
     A base class for implementing a search command.
     """
 
+    # Indicates whether the command uses the chunked protocol (this must match commands.conf)
+    chunked = False
+
+    # This is the number of results that a generating command will output per chunk
+    chunk_size = 10000
+
     # List of valid parameters
     PARAM_RUN_IN_PREVIEW = "run_in_preview"
     PARAM_DEBUG = "debug"
@@ -79,6 +264,11 @@ class SearchCommand(object):
         self.log_level = log_level
         # self.logger.info("args" + str(args))
 
+        # This is the protocol handler and the output of the current chunk when the chunked
+        # protocol is used
+        self.protocol = None
+        self.chunk_output = None
+
     @property
     def logger(self):
         """
@@ -134,20 +324,26 @@ class SearchCommand(object):
         return name, value
 
     @classmethod
-    def get_arguments(cls):
+    def get_arguments(cls, arguments=None):
         """
         Get the arguments as args and kwargs so that they can be processed into a constructor call
         to a search command.
+
+        Arguments:
+        arguments -- The list of arguments (defaults to those from the command-line)
         """
 
         kwargs = {}
         args = []
 
+        if arguments is None:
+            arguments = sys.argv[1:]
+
         # Iterate through the arguments and initialize the corresponding argument
-        if len(sys.argv) > 1:
+        if len(arguments) > 0:
 
             # Iterate through each argument
-            for argument in sys.argv[1:]:
+            for argument in arguments:
 
                 # Parse the argument
                 name, value = cls.parse_argument(argument)
@@ -164,12 +360,15 @@ class SearchCommand(object):
         return args, kwargs
 
     @classmethod
-    def make_instance(cls):
+    def make_instance(cls, arguments=None):
         """
         Produce an instance of the search command with arguments from the command-line.
+
+        Arguments:
+        arguments -- The list of arguments (defaults to those from the command-line)
         """
 
-        args, kwargs = cls.get_arguments()
+        args, kwargs = cls.get_arguments(arguments)
         return cls(*args, **kwargs)
 
     @classmethod
@@ -178,6 +377,10 @@ class SearchCommand(object):
         Initialize an instance and run it.
         """
 
+        if cls.chunked:
+            cls.execute_chunked()
+            return
+
         try:
 
             instance = cls.make_instance()
@@ -225,13 +428,234 @@ class SearchCommand(object):
             else:
                 settings = None
 
+            # Let the functions that write events read the secrets they need (the HEC token)
+            set_default_session_key(session_key)
+
             # Execute the search command
-            self.handle_results(results, session_key, in_preview)
+            self.setup(session_key)
+
+            try:
+                self.handle_results(results, session_key, in_preview)
+            finally:
+                self.teardown()
 
         except Exception as exception:
             splunk.Intersplunk.parseError(str(exception))
             self.logger.exception("Search command threw an exception")
 
+    @classmethod
+    def execute_chunked(cls, protocol=None):
+        """
+        Initialize an instance from the getinfo chunk and run it using the chunked protocol.
+
+        Arguments:
+        protocol -- The ChunkedProtocol to communicate with Splunk over (defaults to one using
+                    standard input and output)
+        """
+
+        if protocol is None:
+            protocol = ChunkedProtocol()
+
+        chunk = protocol.read_chunk()
+
+        if chunk is None:
+            return
+
+        metadata, _ = chunk
+
+        # The arguments are provided in the getinfo chunk instead of on the command-line
+        try:
+            instance = cls.make_instance(metadata.get('searchinfo', {}).get('args', []))
+        except Exception as exception:
+            protocol.write_chunk({'finished': True, 'inspector': {'messages': [['ERROR', str(exception)]]}})
+            return
+
+        instance.run_chunked(protocol, metadata)
+
+    def is_generating(self):
+        """
+        Indicates whether the command generates results instead of processing the results provided
+        to it. This is only used with the chunked protocol.
+        """
+
+        return False
+
+    def get_info(self):
+        """
+        Get the metadata that describes the command to Splunk when using the chunked protocol.
+        """
+
+        # The command is run on the search head (as opposed to the indexers) since the commands
+        # write their results to the search head's indexes
+        return {
+            'type': 'stateful',
+            'generating': self.is_generating()
+        }
+
+    def run_chunked(self, protocol, getinfo):
+        """
+        Run the search command using the chunked protocol. Each chunk of results is passed to
+        handle_results() and the output is sent back to Splunk before the next chunk is read.
+
+        Arguments:
+        protocol -- The ChunkedProtocol to communicate with Splunk over
+        getinfo -- The metadata of the getinfo chunk
+        """
+
+        self.protocol = protocol
+
+        session_key = getinfo.get('searchinfo', {}).get('session_key', None)
+        in_preview = getinfo.get('preview', False) in [True, 1, '1']
+
+        # Let the functions that write events read the secrets they need (the HEC token)
+        set_default_session_key(session_key)
+        generating = self.is_generating()
+
+        protocol.write_chunk(self.get_info())
+
+        # Don't do anything if the command isn't supposed to run in this mode (see run())
+        skip = (self.run_only_in_preview and not in_preview) or (not self.run_in_preview and in_preview)
+
+        if not skip:
+            try:
+                self.setup(session_key)
+            except Exception as exception:
+                self.logger.exception("Search command threw an exception")
+                protocol.write_chunk({'finished': True, 'inspector': {'messages': [['ERROR', str(exception)]]}})
+                return
+
+        try:
+            self.process_chunks(protocol, session_key, in_preview, generating, skip)
+        finally:
+            if not skip:
+                self.teardown()
+
+    def process_chunks(self, protocol, session_key, in_preview, generating, skip):
+        """
+        Read each chunk of results, pass it to handle_results() and send the output back.
+        """
+
+        while True:
+            chunk = protocol.read_chunk()
+
+            if chunk is None:
+                break
+
+            metadata, body = chunk
+            results = ChunkedProtocol.decode_results(body)
+            finished = metadata.get('finished', False) or generating
+
+            self.chunk_output = []
+
+            try:
+                if not skip and (generating or len(results) > 0):
+                    self.handle_results(results, session_key, in_preview)
+            except Exception as exception:
+                self.logger.exception("Search command threw an exception")
+                protocol.write_chunk({'finished': True, 'inspector': {'messages': [['ERROR', str(exception)]]}})
+                return
+
+            protocol.write_chunk({'finished': finished}, ChunkedProtocol.encode_results(self.chunk_output))
+            self.chunk_output = None
+
+            if finished:
+                break
+
+    @classmethod
+    def parse_enrichment_arguments(cls, concurrency=None, lookup_timeout=None):
+        """
+        Validate the arguments that control enrich_results() and return them as a tuple of the
+        number of lookups to run at once and the number of seconds to wait for each lookup (either
+        may be None if not provided).
+
+        Arguments:
+        concurrency -- The maximum number of lookups to run at once
+        lookup_timeout -- The number of seconds to wait for each lookup
+        """
+
+        if concurrency is not None:
+            try:
+                concurrency = int(concurrency)
+            except ValueError:
+                raise ValueError('The concurrency parameter must be an integer')
+
+            if concurrency < 1:
+                raise ValueError('The concurrency parameter must be a positive integer (greater than zero)')
+
+        if lookup_timeout is not None:
+            try:
+                lookup_timeout = float(lookup_timeout)
+            except ValueError:
+                raise ValueError('The lookup_timeout parameter must be a number')
+
+            if lookup_timeout <= 0:
+                raise ValueError('The lookup_timeout parameter must be a positive number (greater than zero)')
+
+        return concurrency, lookup_timeout
+
+    def enrich_results(self, results, field, function, thread_limit, timeout=None, outputs=None):
+        """
+        Call the function with each distinct value of the field (using up to thread_limit threads)
+        and merge the dictionary it returns into each result with that value. The results are
+        modified in place and keep their original order. Values whose lookup failed are logged and
+        left out.
+
+        Arguments:
+        results -- The results from Splunk
+        field -- The field containing the values to look up
+        function -- The function that performs the lookup for a value
+        thread_limit -- The maximum number of lookups to run at once
+        timeout -- The number of seconds to wait for each lookup (None to wait indefinitely)
+        outputs -- A dictionary of the outputs already known for some values (such as from a cache)
+        """
+
+        if outputs is None:
+            outputs = {}
+
+        # Look up each value once no matter how many results it appears in
+        values = []
+        seen = set()
+
+        for result in results:
+            value = self.get_lookup_value(result, field)
+
+            if value and value not in outputs and value not in seen:
+                seen.add(value)
+                values.append(value)
+
+        lookup_outputs, errors = map_concurrently(function, values, thread_limit, timeout,
+                                                  thread_name=self.logger_name + '_worker')
+
+        outputs.update(lookup_outputs)
+
+        for value, exception in errors.items():
+            self.logger.warn("Lookup failed, value=%s, error=%s", value, exception)
+
+        # Merge the outputs back into the results
+        for result in results:
+            output = outputs.get(self.get_lookup_value(result, field), None)
+
+            if output is not None:
+                result.update(output)
+
+        self.logger.info("Enriched results, result_count=%i, lookup_count=%i, failure_count=%i", len(results), len(values), len(errors))
+
+        return results
+
+    @classmethod
+    def get_lookup_value(cls, result, field):
+        """
+        Get the value of the field to look up. None will be returned if the field has multiple
+        values since there isn't a single result to add for them.
+        """
+
+        value = result.get(field, None)
+
+        if isinstance(value, (list, tuple)):
+            return None
+
+        return value
+
     def output_results(self, results):
         """
         Output results to Splunk.
@@ -240,8 +664,81 @@ class SearchCommand(object):
         results -- An array of dictionaries of fields/values to send to Splunk.
         """
 
+        # Include the results in the output of the current chunk if using the chunked protocol
+        if self.chunk_output is not None:
+            self.chunk_output.extend(results)
+            return
+
         splunk.Intersplunk.outputResults(results)
 
+    def flush_chunk(self):
+        """
+        Send the results output so far by a generating command as a chunk (when using the chunked
+        protocol) so that they don't need to be held in memory until the command completes.
+        """
+
+        if not self.chunk_output or not self.is_generating():
+            return
+
+        self.protocol.write_chunk({'finished': False}, ChunkedProtocol.encode_results(self.chunk_output))
+        self.chunk_output = []
+
+        # Splunk sends another chunk when it is ready for more output
+        if self.protocol.read_chunk() is None:
+            raise IOError("The input ended before the command completed")
+
+    def output_streaming_results(self, results, fieldnames):
+        """
+        Output results to Splunk as they are generated so that they don't all need to be held in
+        memory at once.
+
+        Arguments:
+        results -- An iterable of dictionaries of fields/values to send to Splunk.
+        fieldnames -- The list of fields that the results may include.
+        """
+
+        # Send the results in chunks if using the chunked protocol
+        if self.chunk_output is not None:
+            for result in results:
+                self.chunk_output.append(collections.OrderedDict([(field, result[field]) for field in fieldnames if field in result]))
+
+                if len(self.chunk_output) >= self.chunk_size:
+                    self.flush_chunk()
+
+            return
+
+        writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames, extrasaction='ignore',
+                                lineterminator='\n')
+        writer.writeheader()
+
+        for result in results:
+
+            # Multi-valued fields are delimited with newlines, just like Intersplunk does
+            for field, value in result.items():
+                if isinstance(value, (list, tuple)):
+                    result[field] = "\n".join([str(v) for v in value])
+
+            writer.writerow(result)
+
+        sys.stdout.flush()
+
+    def setup(self, session_key):
+        """
+        Create the resources that the command uses for the whole run. This is called once before
+        handle_results() and before any threads are started. Override this if necessary.
+
+        Arguments:
+        session_key -- The session key to use for connecting to Splunk
+        """
+        pass
+
+    def teardown(self):
+        """
+        Release the resources created by setup(). This is called once the command is done (even
+        if it failed). Override this if necessary.
+        """
+        pass
+
     def handle_results(self, results, session_key, in_preview):
         """
         This function needs to be overridden.
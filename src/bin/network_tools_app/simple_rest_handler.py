@@ -172,6 +172,26 @@ class IntegerFieldValidator(StandardFieldValidator):
         else:
             return super(IntegerFieldValidator, self).to_string(name, value)
 
+class ChoiceFieldValidator(StandardFieldValidator):
+    """
+    Validates fields that must be one of a list of choices.
+    """
+
+    def __init__(self, choices):
+        self.choices = choices
+
+    def to_python(self, name, value):
+
+        if value is None:
+            return None
+
+        value = str(value).strip()
+
+        if value not in self.choices:
+            raise admin.ArgValidationException("The value of '%s' for the '%s' parameter is not valid, it must be one of: %s" % (value, name, ", ".join(self.choices)))
+
+        return value
+
 class FieldSetValidator():
     """
     This base class is for validating sets of fields.
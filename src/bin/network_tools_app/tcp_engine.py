@@ -0,0 +1,475 @@
+"""
+This module implements a TCP ping engine that measures connection latency to many hosts
+concurrently from a single thread.
+
+Each probe is a non-blocking connect() that is driven by the selectors module (epoll, kqueue, etc.).
+Thousands of connects can be in flight at once without a thread per connection. Python 2 doesn't
+have the selectors module so a minimal selector based on select() is used there instead.
+
+Here is a sample of using the engine to ping a couple of hosts:
+
+from network_tools_app.tcp_engine import TCPPingEngine
+
+engine = TCPPingEngine(timeout=1)
+for host, result in engine.iter_ping(['10.0.0.1', 'textcritical.net'], port=80, count=3):
+    print(result)
+"""
+
+import os
+import time
+import errno
+import socket
+import select
+import collections
+from timeit import default_timer as timer
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_TIMEOUT = 1
+DEFAULT_INTERVAL = 0
+DEFAULT_MAX_CONCURRENT = 1024
+
+# This is the number of file descriptors left free for the rest of the process
+RESERVED_FILE_DESCRIPTORS = 64
+
+# select() can't wait on descriptors numbered above FD_SETSIZE (usually 1024) so the connections
+# are limited further when the selectors module isn't available
+SELECT_MAX_CONCURRENT = 512
+
+EVENT_READ = 1
+EVENT_WRITE = 2
+
+class SelectorKey(object):
+    """
+    Associates a registered socket with the events being waited on and its data (like
+    selectors.SelectorKey).
+    """
+
+    def __init__(self, fileobj, events, data):
+        self.fileobj = fileobj
+        self.events = events
+        self.data = data
+
+class SelectSelector(object):
+    """
+    A selector that waits on the sockets with select(). This implements the part of the interface of
+    selectors.DefaultSelector that the engines use.
+    """
+
+    def __init__(self):
+        self.keys = {}
+
+    def register(self, fileobj, events, data=None):
+        self.keys[fileobj] = SelectorKey(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self.keys.pop(fileobj)
+
+    def get_map(self):
+        return self.keys
+
+    def select(self, timeout=None):
+        readers = [key.fileobj for key in self.keys.values() if key.events & EVENT_READ]
+        writers = [key.fileobj for key in self.keys.values() if key.events & EVENT_WRITE]
+
+        if not readers and not writers:
+            time.sleep(timeout or 0)
+            return []
+
+        try:
+            readable, writable, errored = select.select(readers, writers, writers, timeout)
+        except (select.error, OSError) as exception:
+            if exception.args[0] == errno.EINTR:
+                return []
+            raise
+
+        events = {}
+
+        for fileobj in readable:
+            events[fileobj] = events.get(fileobj, 0) | EVENT_READ
+
+        # Windows reports failed connects as exceptional conditions rather than as writable
+        for fileobj in writable + errored:
+            events[fileobj] = events.get(fileobj, 0) | EVENT_WRITE
+
+        return [(self.keys[fileobj], mask) for fileobj, mask in events.items()]
+
+    def close(self):
+        self.keys = {}
+
+def make_selector():
+    """
+    Make the best selector available on this platform.
+    """
+
+    if selectors is None:
+        return SelectSelector()
+
+    return selectors.DefaultSelector()
+
+def get_connection_limit(max_concurrent):
+    """
+    Limit the number of concurrent connections to what the file descriptor limit allows.
+    """
+
+    if selectors is None:
+        max_concurrent = min(max_concurrent, SELECT_MAX_CONCURRENT)
+
+    if resource is None:
+        return max_concurrent
+
+    try:
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ValueError, OSError):
+        return max_concurrent
+
+    if soft_limit == resource.RLIM_INFINITY:
+        return max_concurrent
+
+    return max(1, min(max_concurrent, soft_limit - RESERVED_FILE_DESCRIPTORS))
+
+def make_result(host, output, sent, received, packet_loss, response_times):
+    """
+    Make the dictionary that summarizes a TCP ping.
+
+    Arguments:
+    host -- the host that was pinged
+    output -- a list of lines describing each probe
+    sent -- the number of probes sent
+    received -- the number of probes that successfully connected
+    packet_loss -- the number of probes that failed
+    response_times -- the duration in milliseconds of every probe
+    """
+
+    # Calculate the jitter
+    diff = 0
+    prev_response_time = None
+    for response_time in response_times:
+        if prev_response_time is not None:
+            diff += abs(prev_response_time - response_time)
+
+        prev_response_time = response_time
+
+    jitter = (diff * 1.0) / len(response_times)
+
+    # Calculate the min_ping, max_ping, avg_ping
+    min_ping = min(response_times)
+    max_ping = max(response_times)
+    avg_ping = sum(response_times) / len(response_times)
+
+    # Calculate the packet loss as a percent
+    if sent > 0:
+        packet_loss_percent = 100 * (packet_loss / sent)
+    else:
+        packet_loss_percent = 0
+
+    output.append("\n--- %s ping statistics ---" % host)
+    output.append("%i packets transmitted, %i packets received, %i%% packet loss" % (sent, received, packet_loss_percent))
+
+    # Make the summary dictionary
+    result = collections.OrderedDict()
+    result['dest'] = host
+    result['output'] = "\n".join(output)
+    result['sent'] = sent
+    result['received'] = received
+    result['packet_loss'] = int(round(packet_loss_percent, 0))
+    result['jitter'] = round(jitter, 2)
+    result['min_ping'] = round(min_ping, 2)
+    result['max_ping'] = round(max_ping, 2)
+    result['avg_ping'] = round(avg_ping, 2)
+
+    return result
+
+class Target(object):
+    """
+    Represents a host being pinged along with the outcome of the probes so far.
+    """
+
+    def __init__(self, host, port, count, first_send_at):
+        self.host = host
+        self.port = port
+        self.count = count
+        self.next_send_at = first_send_at
+        self.address = None
+
+        self.sent = 0
+        self.received = 0
+        self.packet_loss = 0
+        self.response_times = []
+        self.output = []
+
+    def is_done(self):
+        return self.sent >= self.count
+
+    def record(self, started_at, stopped_at, error=None):
+        """
+        Record the outcome of a probe.
+        """
+
+        total_runtime = float("%.2f" % (1000 * (stopped_at - started_at)))
+        self.response_times.append(total_runtime)
+
+        if error is None:
+            self.output.append("Connected to %s[%s]: tcp_seq=%s time=%.2f ms" % (self.host, self.port, self.sent, total_runtime))
+            self.received += 1
+        else:
+            self.output.append(error)
+            self.packet_loss += 1
+
+        self.sent += 1
+
+class Probe(object):
+    """
+    Represents a connection attempt in flight.
+    """
+
+    def __init__(self, target, sock, started_at, deadline):
+        self.target = target
+        self.sock = sock
+        self.started_at = started_at
+        self.deadline = deadline
+
+class TCPPingEngine(object):
+    """
+    Pings hosts by timing how long it takes to complete a TCP connection. The probes to each host
+    are performed one after another while many hosts are pinged concurrently.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, interval=DEFAULT_INTERVAL,
+                 max_concurrent=DEFAULT_MAX_CONCURRENT, logger=None):
+        """
+        Constructs a TCP ping engine.
+
+        Arguments:
+        timeout -- the number of seconds to wait for each connection to complete
+        interval -- the number of seconds to wait between the probes sent to the same host
+        max_concurrent -- the maximum number of connections in flight at once
+        logger -- the logger to write debug messages to
+        """
+
+        self.timeout = timeout
+        self.interval = interval
+        self.max_concurrent = get_connection_limit(max_concurrent)
+        self.logger = logger
+
+    def ping(self, host, port=80, count=1):
+        """
+        Ping a single host and return the result dictionary.
+        """
+
+        return list(self.iter_ping([host], port, count))[0][1]
+
+    def iter_ping(self, hosts, port=80, count=1):
+        """
+        Ping the hosts concurrently and yield a tuple of the host and the result dictionary as each
+        host completes. The hosts are consumed incrementally so that memory use stays flat
+        regardless of the number of hosts.
+
+        Arguments:
+        hosts -- an iterable of the hosts to ping (this may be a generator)
+        port -- the TCP port to connect to
+        count -- the number of probes to perform against each host
+        """
+
+        selector = make_selector()
+
+        try:
+            for completed in self._run(selector, iter(hosts), int(port), count):
+                yield completed
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+
+            selector.close()
+
+    def _resolve(self, target):
+        """
+        Resolve the address of the target. If it could not be resolved, every probe will be
+        recorded as a failure and None will be returned.
+        """
+
+        try:
+            family, socktype, proto, _, address = socket.getaddrinfo(target.host, target.port, 0, socket.SOCK_STREAM)[0]
+            return family, socktype, proto, address
+        except (socket.error, UnicodeError) as exception:
+            while not target.is_done():
+                now = timer()
+                target.record(now, now, "Error when connecting to %s[%s]: %r" % (target.host, target.port, str(exception)))
+
+            return None
+
+    def _connect(self, selector, target, now):
+        """
+        Start a connection to the target. None will be returned if the connection attempt failed
+        immediately.
+        """
+
+        family, socktype, proto, address = target.address
+
+        try:
+            sock = socket.socket(family, socktype, proto)
+        except (socket.error, OSError) as exception:
+            target.record(now, timer(), "Error when connecting to %s[%s]: %r" % (target.host, target.port, str(exception)))
+            return None
+
+        sock.setblocking(False)
+        result = sock.connect_ex(address)
+
+        if result in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            probe = Probe(target, sock, now, now + self.timeout)
+            selector.register(sock, EVENT_WRITE, probe)
+            return probe
+
+        sock.close()
+        target.record(now, timer(), "Error when connecting to %s[%s]: %r" % (target.host, target.port, os.strerror(result)))
+        return None
+
+    def _complete(self, selector, probe, error=None):
+        """
+        Stop tracking the probe and record its outcome.
+        """
+
+        stopped_at = timer()
+        selector.unregister(probe.sock)
+
+        if error is None:
+            try:
+                probe.sock.shutdown(socket.SHUT_RD)
+            except (socket.error, OSError):
+                pass
+
+        probe.sock.close()
+        probe.target.record(probe.started_at, stopped_at, error)
+        probe.target.next_send_at = stopped_at + self.interval
+
+    def _run(self, selector, hosts, port, count):
+        hosts_exhausted = False
+        host_count = 0
+
+        # These are the targets waiting for their next probe to be started
+        waiting = collections.deque()
+
+        # These are the probes in flight in the order they were started. Since every probe gets the
+        # same timeout, the oldest probe is always the first one to expire.
+        in_flight = collections.OrderedDict()
+
+        # This is the number of targets that have not completed
+        active = 0
+
+        completed = []
+
+        while True:
+
+            # Start pinging more hosts if there is room for more connections
+            while not hosts_exhausted and active < self.max_concurrent:
+                try:
+                    host = next(hosts)
+                except StopIteration:
+                    hosts_exhausted = True
+                    break
+
+                host_count += 1
+                target = Target(host, port, count, timer())
+                target.address = self._resolve(target)
+
+                if target.address is None:
+                    completed.append(target)
+                else:
+                    waiting.append(target)
+                    active += 1
+
+            if hosts_exhausted and active == 0 and not completed:
+                break
+
+            # Start the probes that are due
+            now = timer()
+            deferred = collections.deque()
+
+            while waiting and len(in_flight) < self.max_concurrent:
+                target = waiting.popleft()
+
+                if target.next_send_at > now:
+                    deferred.append(target)
+                    continue
+
+                probe = self._connect(selector, target, now)
+
+                if probe is not None:
+                    in_flight[id(probe)] = probe
+                elif target.is_done():
+                    completed.append(target)
+                    active -= 1
+                else:
+                    target.next_send_at = now + self.interval
+                    deferred.append(target)
+
+            waiting.extendleft(reversed(deferred))
+
+            # Figure out how long we can wait
+            wake_at = None
+
+            if in_flight:
+                wake_at = next(iter(in_flight.values())).deadline
+
+            if waiting and len(in_flight) < self.max_concurrent:
+                next_send_at = min([target.next_send_at for target in waiting])
+
+                if wake_at is None or next_send_at < wake_at:
+                    wake_at = next_send_at
+
+            if completed or wake_at is None:
+                wait = 0
+            else:
+                wait = max(0, wake_at - timer())
+
+            if in_flight:
+                events = selector.select(wait)
+            else:
+                events = []
+                time.sleep(wait)
+
+            # Process the connections that completed
+            for key, _ in events:
+                probe = key.data
+                error_code = probe.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                del in_flight[id(probe)]
+
+                if error_code == 0:
+                    self._complete(selector, probe)
+                else:
+                    self._complete(selector, probe, "Error when connecting to %s[%s]: %r" % (probe.target.host, probe.target.port, os.strerror(error_code)))
+
+                if probe.target.is_done():
+                    completed.append(probe.target)
+                    active -= 1
+                else:
+                    waiting.append(probe.target)
+
+            # Expire the probes that didn't connect in time
+            now = timer()
+
+            while in_flight and next(iter(in_flight.values())).deadline <= now:
+                _, probe = in_flight.popitem(last=False)
+                self._complete(selector, probe, "Connection timeout to %s[%s]" % (probe.target.host, probe.target.port))
+
+                if probe.target.is_done():
+                    completed.append(probe.target)
+                    active -= 1
+                else:
+                    waiting.append(probe.target)
+
+            # Hand back the hosts that are done
+            while completed:
+                target = completed.pop(0)
+                yield target.host, make_result(target.host, target.output, target.sent, target.received, target.packet_loss, target.response_times)
+
+        if self.logger:
+            self.logger.debug("TCP ping engine completed, host_count=%i", host_count)
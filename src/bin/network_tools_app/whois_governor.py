@@ -0,0 +1,383 @@
+"""
+This module limits the rate of the whois queries that are sent to each whois server (port 43).
+
+Whois servers (such as whois.verisign-grs.com and whois.ripe.net) refuse connections from clients
+that send too many queries. Once a server starts refusing us, every further query waits out the full
+socket timeout so a lookup that fans out to many hosts slows to a crawl and keeps the server angry.
+
+Each server gets its own limiter that:
+
+ 1. Allows a limited number of queries per second (a token bucket that allows short bursts)
+ 2. Allows a limited number of connections to be open at once
+ 3. Stops sending queries once a number of them fail in a row (the "circuit" opens). Queries fail
+    immediately with a CircuitOpenError until the cool-down expires; then, a single query is sent
+    to test the server and the circuit closes again if it succeeds.
+
+The limiters are shared by every thread in the process (the whois libraries use the module-level
+governor so that all of the lookups of a search count against the same limits).
+
+Here is a sample of limiting a query:
+
+from network_tools_app.whois_governor import governor
+
+with governor.query('whois.verisign-grs.com') as query:
+    response = send_whois_query('whois.verisign-grs.com', 'textcritical.net')
+
+    if 'rate limit exceeded' in response:
+        query.failed = True
+"""
+
+import time
+import threading
+
+# This is the number of queries per second that are sent to each server by default
+DEFAULT_QUERIES_PER_SECOND = 5
+
+# This is the number of connections that can be open to each server at once by default
+DEFAULT_MAX_CONNECTIONS = 5
+
+# This is the number of queries that must fail in a row before the circuit of a server opens
+DEFAULT_CIRCUIT_FAILURES = 5
+
+# This is the number of seconds that queries fail immediately once the circuit of a server opens
+DEFAULT_CIRCUIT_COOLDOWN = 60
+
+# These are the states of the circuit of a server
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half-open'
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a query isn't sent because the server has been failing.
+    """
+
+    def __init__(self, server, retry_after):
+        Exception.__init__(self, "Whois queries to %s are suspended for %i more seconds after repeated failures" % (server, retry_after))
+        self.server = server
+        self.retry_after = retry_after
+
+class Query(object):
+    """
+    A query that is being sent under a limiter. Set failed to True if the server refused to answer
+    the query even though no exception was raised (such as when it responded with a rate-limit
+    message).
+    """
+
+    def __init__(self):
+        self.failed = False
+
+class ServerLimiter(object):
+    """
+    Limits the queries that are sent to a single server. This can be shared between threads.
+    """
+
+    def __init__(self, server, queries_per_second=DEFAULT_QUERIES_PER_SECOND,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, circuit_failures=DEFAULT_CIRCUIT_FAILURES,
+                 circuit_cooldown=DEFAULT_CIRCUIT_COOLDOWN, logger=None):
+        """
+        Constructs the limiter.
+
+        Arguments:
+        server -- the name of the server
+        queries_per_second -- the number of queries per second to allow (0 for no limit)
+        max_connections -- the number of connections that can be open at once (0 for no limit)
+        circuit_failures -- the number of failures in a row that opens the circuit (0 to never open it)
+        circuit_cooldown -- the number of seconds that the circuit stays open
+        logger -- the logger to write the changes of the circuit to
+        """
+
+        self.server = server
+        self.logger = logger
+
+        self.condition = threading.Condition(threading.Lock())
+
+        self.configure(queries_per_second, max_connections, circuit_failures, circuit_cooldown)
+
+        # The bucket starts full so that the first burst of queries isn't delayed
+        self.tokens = float(self.burst)
+        self.last_refill = time.time()
+
+        self.connections = 0
+
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0
+
+        # These are the statistics that are logged by log_statistics()
+        self.queries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.delayed = 0
+        self.wait_time = 0.0
+        self.circuit_opens = 0
+        self.max_concurrent = 0
+
+    def configure(self, queries_per_second, max_connections, circuit_failures, circuit_cooldown):
+        """
+        Change the limits (the queries that are already waiting will use the new limits).
+        """
+
+        with self.condition:
+            self.queries_per_second = max(float(queries_per_second or 0), 0.0)
+            self.max_connections = max(int(max_connections or 0), 0)
+            self.circuit_failures = max(int(circuit_failures or 0), 0)
+            self.circuit_cooldown = max(float(circuit_cooldown or 0), 0.0)
+
+            # Allow a second's worth of queries to be sent at once
+            self.burst = max(self.queries_per_second, 1.0)
+
+            # Let the waiting threads pick up the new connection limit
+            self.condition.notify_all()
+
+    def log(self, message, *args):
+        if self.logger is not None:
+            self.logger.warn(message, *args)
+
+    def check_circuit(self, now):
+        """
+        Raise a CircuitOpenError if queries cannot be sent to the server. This must be called with
+        the lock held.
+        """
+
+        if self.state == CIRCUIT_CLOSED:
+            return
+
+        if self.state == CIRCUIT_OPEN and now >= self.open_until:
+            # Let a single query through to see if the server has recovered
+            self.state = CIRCUIT_HALF_OPEN
+            return
+
+        # The circuit is open or the query testing the server hasn't finished yet
+        self.rejected += 1
+        raise CircuitOpenError(self.server, max(self.open_until - now, 0))
+
+    def take_token(self, now):
+        """
+        Take a token from the bucket and get the number of seconds to wait until it is available.
+        The bucket goes negative when queries are waiting so that they are sent in the order that
+        they arrived. This must be called with the lock held.
+        """
+
+        if self.queries_per_second <= 0:
+            return 0
+
+        self.tokens = min(self.tokens + (now - self.last_refill) * self.queries_per_second, self.burst)
+        self.last_refill = now
+        self.tokens -= 1
+
+        if self.tokens >= 0:
+            return 0
+
+        return -self.tokens / self.queries_per_second
+
+    def acquire(self):
+        """
+        Wait until a query can be sent to the server. A CircuitOpenError will be raised if the
+        server has been failing. Make sure to call release() once the query is done.
+        """
+
+        with self.condition:
+            self.check_circuit(time.time())
+
+            started = time.time()
+
+            while self.max_connections > 0 and self.connections >= self.max_connections:
+                self.condition.wait(1)
+
+                # Don't keep waiting if the circuit opened in the meantime
+                if self.state == CIRCUIT_OPEN:
+                    self.check_circuit(time.time())
+
+            wait = self.take_token(time.time())
+
+            self.connections += 1
+            self.max_concurrent = max(self.max_concurrent, self.connections)
+
+        if wait > 0:
+            time.sleep(wait)
+
+        with self.condition:
+            waited = time.time() - started
+
+            if waited > 0.001:
+                self.delayed += 1
+                self.wait_time += waited
+
+            # The circuit may have opened while this query was waiting
+            try:
+                if self.state == CIRCUIT_OPEN:
+                    self.check_circuit(time.time())
+            except CircuitOpenError:
+                self.connections -= 1
+                self.condition.notify()
+                raise
+
+            self.queries += 1
+
+    def release(self, failed=False):
+        """
+        Record the outcome of a query and let the next one use the connection.
+
+        Arguments:
+        failed -- True if the server didn't answer the query
+        """
+
+        with self.condition:
+            self.connections -= 1
+            self.condition.notify()
+
+            if not failed:
+                self.consecutive_failures = 0
+
+                if self.state != CIRCUIT_CLOSED:
+                    self.state = CIRCUIT_CLOSED
+                    self.log("Whois circuit closed, server=%s", self.server)
+
+                return
+
+            self.failures += 1
+            self.consecutive_failures += 1
+
+            if self.state == CIRCUIT_HALF_OPEN or \
+               (self.state == CIRCUIT_CLOSED and self.circuit_failures > 0 and self.consecutive_failures >= self.circuit_failures):
+
+                self.state = CIRCUIT_OPEN
+                self.open_until = time.time() + self.circuit_cooldown
+                self.circuit_opens += 1
+
+                self.log("Whois circuit opened, server=%s, consecutive_failures=%i, cooldown=%i",
+                         self.server, self.consecutive_failures, self.circuit_cooldown)
+
+    def get_statistics(self):
+        """
+        Get a dictionary of the statistics of the limiter.
+        """
+
+        with self.condition:
+            return {
+                'server': self.server,
+                'queries': self.queries,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'delayed': self.delayed,
+                'wait_time': self.wait_time,
+                'circuit_opens': self.circuit_opens,
+                'max_concurrent': self.max_concurrent,
+                'circuit': self.state
+            }
+
+class QueryContext(object):
+    """
+    Holds a query to a server for the duration of a with statement. The query is counted as failed
+    if an exception is raised within the with statement or if the failed attribute is set.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.query = Query()
+
+    def __enter__(self):
+        self.limiter.acquire()
+        return self.query
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.limiter.release(failed=exc_type is not None or self.query.failed)
+
+class WhoisGovernor(object):
+    """
+    Keeps the limiter of each whois server. This can be shared between threads.
+    """
+
+    def __init__(self):
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+        self.queries_per_second = DEFAULT_QUERIES_PER_SECOND
+        self.max_connections = DEFAULT_MAX_CONNECTIONS
+        self.circuit_failures = DEFAULT_CIRCUIT_FAILURES
+        self.circuit_cooldown = DEFAULT_CIRCUIT_COOLDOWN
+        self.logger = None
+
+    def configure(self, queries_per_second=DEFAULT_QUERIES_PER_SECOND,
+                  max_connections=DEFAULT_MAX_CONNECTIONS, circuit_failures=DEFAULT_CIRCUIT_FAILURES,
+                  circuit_cooldown=DEFAULT_CIRCUIT_COOLDOWN, logger=None):
+        """
+        Set the limits of every server (including the servers that have already been queried).
+
+        Arguments:
+        queries_per_second -- the number of queries per second to allow (0 for no limit)
+        max_connections -- the number of connections that can be open at once (0 for no limit)
+        circuit_failures -- the number of failures in a row that opens the circuit (0 to never open it)
+        circuit_cooldown -- the number of seconds that the circuit stays open
+        logger -- the logger to write the changes of the circuits to
+        """
+
+        with self.lock:
+            self.queries_per_second = queries_per_second
+            self.max_connections = max_connections
+            self.circuit_failures = circuit_failures
+            self.circuit_cooldown = circuit_cooldown
+            self.logger = logger
+
+            limiters = list(self.limiters.values())
+
+        for limiter in limiters:
+            limiter.logger = logger
+            limiter.configure(queries_per_second, max_connections, circuit_failures, circuit_cooldown)
+
+    def get_limiter(self, server):
+        """
+        Get the limiter of the server, creating it if necessary.
+        """
+
+        server = (server or '').lower()
+
+        with self.lock:
+            limiter = self.limiters.get(server)
+
+            if limiter is None:
+                limiter = ServerLimiter(server, self.queries_per_second, self.max_connections,
+                                        self.circuit_failures, self.circuit_cooldown, self.logger)
+                self.limiters[server] = limiter
+
+            return limiter
+
+    def query(self, server):
+        """
+        Get a context manager that holds a query to the server (see QueryContext).
+        """
+
+        return QueryContext(self.get_limiter(server))
+
+    def get_statistics(self):
+        """
+        Get a list of the statistics of each server that has been queried.
+        """
+
+        with self.lock:
+            limiters = sorted(self.limiters.values(), key=lambda limiter: limiter.server)
+
+        return [limiter.get_statistics() for limiter in limiters]
+
+    def log_statistics(self, logger):
+        """
+        Log the statistics of each server that has been queried.
+        """
+
+        for statistics in self.get_statistics():
+            logger.info("Whois limiter statistics, server=%s, queries=%i, failures=%i, rejected=%i, delayed=%i, wait_time=%.2f, circuit_opens=%i, max_concurrent=%i, circuit=%s",
+                        statistics['server'], statistics['queries'], statistics['failures'],
+                        statistics['rejected'], statistics['delayed'], statistics['wait_time'],
+                        statistics['circuit_opens'], statistics['max_concurrent'], statistics['circuit'])
+
+    def reset(self):
+        """
+        Forget the limiters (and thus the state of the circuits and the statistics).
+        """
+
+        with self.lock:
+            self.limiters.clear()
+
+# This is the governor shared by the whois libraries
+governor = WhoisGovernor()
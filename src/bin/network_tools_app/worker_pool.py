@@ -0,0 +1,291 @@
+"""
+This module provides a bounded pool of worker threads for running network operations concurrently.
+
+Here is a sample of pinging a few hosts with no more than 10 pings running at once:
+
+from network_tools_app import tcp_ping
+from network_tools_app.worker_pool import iterate_concurrently
+
+for host, result in iterate_concurrently(lambda host: tcp_ping(host, 80), ['10.0.0.1', '10.0.0.2'], 10):
+    print(result)
+"""
+
+import time
+import threading
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+DEFAULT_THREAD_LIMIT = 20
+
+class LookupTimeout(Exception):
+    """
+    Indicates that an item didn't complete within the allowed time (see map_concurrently()).
+    """
+
+    def __init__(self, item, timeout):
+        super(LookupTimeout, self).__init__("The operation on %r did not complete within %s seconds" % (item, timeout))
+        self.item = item
+        self.timeout = timeout
+
+class StopWorker(object):
+    """
+    Placed on the queue to tell a worker that there is nothing left to do.
+    """
+
+class FeederDone(object):
+    """
+    Placed on the output queue once all of the items have been handed to the workers.
+    """
+
+    def __init__(self, worker_count):
+        self.worker_count = worker_count
+
+class WorkerFailed(object):
+    """
+    Placed on the output queue when the function raised an exception.
+    """
+
+    def __init__(self, exception):
+        self.exception = exception
+
+def iterate_concurrently(function, items, thread_limit=DEFAULT_THREAD_LIMIT, budget=None,
+                         thread_name='network_tools_worker'):
+    """
+    Call the function once for each item using no more than thread_limit threads and yield a
+    tuple of the item and the value returned by the function as each item completes.
+
+    The items are consumed incrementally and only a small number of items and results are queued at
+    any one time so that memory use stays flat regardless of the number of items. If the function
+    raises an exception, no further items will be started and the exception will be re-raised.
+
+    Arguments:
+    function -- the function to call with each item
+    items -- the items to process (this may be a generator)
+    thread_limit -- the maximum number of threads to use
+    budget -- a semaphore shared with other pools in order to cap the total operations running
+    thread_name -- the name to assign to the worker threads
+    """
+
+    if thread_limit is None or thread_limit < 1:
+        thread_limit = DEFAULT_THREAD_LIMIT
+
+    def process(item):
+        if budget is not None:
+            with budget:
+                return function(item)
+        else:
+            return function(item)
+
+    # Run the items in this thread if concurrency isn't needed
+    if thread_limit == 1:
+        for item in items:
+            yield item, process(item)
+
+        return
+
+    # Keep the queues short so that a large generator of items isn't loaded into memory at once
+    work_queue = Queue(maxsize=thread_limit * 2)
+    output_queue = Queue(maxsize=thread_limit * 2)
+    stopping = threading.Event()
+
+    def worker():
+        while True:
+            item = work_queue.get()
+
+            if isinstance(item, StopWorker):
+                output_queue.put(item)
+                return
+
+            # Skip the remaining items if we are stopping
+            if stopping.is_set():
+                continue
+
+            try:
+                output_queue.put((item, process(item)))
+            except Exception as exception:
+                stopping.set()
+                output_queue.put(WorkerFailed(exception))
+
+    workers = []
+
+    def feed():
+        try:
+            for item in items:
+                if stopping.is_set():
+                    break
+
+                # Start another worker if the existing ones may all be busy
+                if len(workers) < thread_limit:
+                    new_thread = threading.Thread(name=thread_name, target=worker)
+                    new_thread.daemon = True
+                    workers.append(new_thread)
+                    new_thread.start()
+
+                work_queue.put(item)
+
+        except Exception as exception:
+            stopping.set()
+            output_queue.put(WorkerFailed(exception))
+
+        for _ in workers:
+            work_queue.put(StopWorker())
+
+        output_queue.put(FeederDone(len(workers)))
+
+    feeder = threading.Thread(name=thread_name + '_feeder', target=feed)
+    feeder.daemon = True
+    feeder.start()
+
+    error = None
+
+    try:
+        # Wait until the feeder is done and every worker has stopped
+        stopped = 0
+        worker_count = None
+
+        while worker_count is None or stopped < worker_count:
+            output = output_queue.get()
+
+            if isinstance(output, StopWorker):
+                stopped += 1
+
+            elif isinstance(output, FeederDone):
+                worker_count = output.worker_count
+
+            elif isinstance(output, WorkerFailed):
+                if error is None:
+                    error = output.exception
+
+            elif error is None:
+                yield output
+
+    finally:
+        # Stop the remaining work if the caller stopped iterating early
+        stopping.set()
+
+        while feeder.is_alive() or any([thread.is_alive() for thread in workers]):
+            while not output_queue.empty():
+                output_queue.get()
+
+            feeder.join(0.01)
+
+    if error is not None:
+        raise error
+
+def run_concurrently(function, items, thread_limit=DEFAULT_THREAD_LIMIT, callback=None,
+                     budget=None, thread_name='network_tools_worker'):
+    """
+    Call the function once for each item using no more than thread_limit threads. This returns once
+    all of the items have been processed.
+
+    The callback will be called with the item and the value returned by the function as each item
+    completes. Calls to the callback are made from the calling thread so that it doesn't need to be
+    thread-safe.
+
+    Arguments:
+    function -- the function to call with each item
+    items -- the items to process (this may be a generator; it is consumed incrementally)
+    thread_limit -- the maximum number of threads to use
+    callback -- a function to call with each item and its result as they complete
+    budget -- a semaphore shared with other pools in order to cap the total operations running
+    thread_name -- the name to assign to the worker threads
+    """
+
+    for item, result in iterate_concurrently(function, items, thread_limit, budget, thread_name):
+        if callback is not None:
+            callback(item, result)
+
+def map_concurrently(function, items, thread_limit=DEFAULT_THREAD_LIMIT, timeout=None,
+                     thread_name='network_tools_worker'):
+    """
+    Call the function once for each item using no more than thread_limit threads and return a
+    tuple of two dictionaries: one of the value returned for each item and one of the exception
+    raised for each item that failed.
+
+    Unlike iterate_concurrently(), a failed item doesn't stop the others. An item that doesn't
+    complete within the timeout is recorded as failing with a LookupTimeout and its thread is
+    abandoned (so that it no longer counts towards the thread_limit).
+
+    Arguments:
+    function -- the function to call with each item
+    items -- the items to process (these ought to be distinct and hashable)
+    thread_limit -- the maximum number of items to process at once
+    timeout -- the number of seconds to wait for each item (None to wait indefinitely)
+    thread_name -- the name to assign to the worker threads
+    """
+
+    if thread_limit is None or thread_limit < 1:
+        thread_limit = DEFAULT_THREAD_LIMIT
+
+    items = iter(items)
+    results = {}
+    errors = {}
+
+    # These are the items running along with the time that they need to be completed by
+    running = {}
+
+    done_queue = Queue()
+    items_exhausted = False
+
+    def worker(item):
+        try:
+            done_queue.put((item, function(item), None))
+        except Exception as exception:
+            done_queue.put((item, None, exception))
+
+    while True:
+
+        # Start more items if there is room
+        while not items_exhausted and len(running) < thread_limit:
+            try:
+                item = next(items)
+            except StopIteration:
+                items_exhausted = True
+                break
+
+            if timeout is None:
+                running[item] = None
+            else:
+                running[item] = time.time() + timeout
+
+            new_thread = threading.Thread(name=thread_name, target=worker, args=(item,))
+            new_thread.daemon = True
+            new_thread.start()
+
+        if not running:
+            break
+
+        # Wait for an item to complete or the next deadline
+        wait = None
+
+        if timeout is not None:
+            wait = max(0, min(running.values()) - time.time())
+
+        try:
+            item, result, exception = done_queue.get(timeout=wait)
+
+            # Ignore the items that already timed out
+            if item in running:
+                del running[item]
+
+                if exception is None:
+                    results[item] = result
+                else:
+                    errors[item] = exception
+
+        except Empty:
+            pass
+
+        # Give up on the items that didn't complete in time
+        now = time.time()
+
+        for item, deadline in list(running.items()):
+            if deadline is not None and deadline <= now:
+                del running[item]
+                errors[item] = LookupTimeout(item, timeout)
+
+    return results, errors
+
@@ -2,7 +2,7 @@
 This defines a REST handler for front-ending the network_tools.conf file.
 """
 
-from network_tools_app.simple_rest_handler import RestHandler, IntegerFieldValidator, BooleanFieldValidator
+from network_tools_app.simple_rest_handler import RestHandler, IntegerFieldValidator, BooleanFieldValidator, ChoiceFieldValidator
 import logging
 import splunk.admin as admin
 
@@ -16,13 +16,41 @@ class NetworkToolsRestHandler(RestHandler):
 
     # Below are the list of parameters that are accepted
     PARAM_INDEX = 'index'
+    PARAM_THREAD_LIMIT = 'thread_limit'
+    PARAM_OUTPUT_MODE = 'output_mode'
+    PARAM_EVENT_FORMAT = 'event_format'
+    PARAM_HEC_URL = 'hec_url'
+    PARAM_HEC_VERIFY_SSL = 'hec_verify_ssl'
+    PARAM_WHOIS_CACHE_KVSTORE = 'whois_cache_kvstore'
+    PARAM_WHOIS_CACHE_TTL = 'whois_cache_ttl'
+    PARAM_PARSE_PROCESSES = 'parse_processes'
+    PARAM_WHOIS_QUERIES_PER_SECOND = 'whois_queries_per_second'
+    PARAM_WHOIS_MAX_CONNECTIONS = 'whois_max_connections'
+    PARAM_WHOIS_CIRCUIT_FAILURES = 'whois_circuit_failures'
+    PARAM_WHOIS_CIRCUIT_COOLDOWN = 'whois_circuit_cooldown'
 
     # Below are the list of valid and required parameters
-    valid_params = [PARAM_INDEX]
+    valid_params = [PARAM_INDEX, PARAM_THREAD_LIMIT, PARAM_OUTPUT_MODE, PARAM_EVENT_FORMAT,
+                    PARAM_HEC_URL, PARAM_HEC_VERIFY_SSL,
+                    PARAM_WHOIS_CACHE_KVSTORE, PARAM_WHOIS_CACHE_TTL, PARAM_PARSE_PROCESSES,
+                    PARAM_WHOIS_QUERIES_PER_SECOND, PARAM_WHOIS_MAX_CONNECTIONS,
+                    PARAM_WHOIS_CIRCUIT_FAILURES, PARAM_WHOIS_CIRCUIT_COOLDOWN]
     required_params = []
 
     # List of fields and how they will be validated
-    field_validators = {}
+    field_validators = {
+        PARAM_THREAD_LIMIT : IntegerFieldValidator(1, 10000),
+        PARAM_OUTPUT_MODE : ChoiceFieldValidator(['stash', 'hec']),
+        PARAM_EVENT_FORMAT : ChoiceFieldValidator(['kv', 'json']),
+        PARAM_HEC_VERIFY_SSL : BooleanFieldValidator(),
+        PARAM_WHOIS_CACHE_KVSTORE : BooleanFieldValidator(),
+        PARAM_WHOIS_CACHE_TTL : IntegerFieldValidator(1, 31536000),
+        PARAM_PARSE_PROCESSES : IntegerFieldValidator(0, 256),
+        PARAM_WHOIS_QUERIES_PER_SECOND : IntegerFieldValidator(0, 1000),
+        PARAM_WHOIS_MAX_CONNECTIONS : IntegerFieldValidator(0, 1000),
+        PARAM_WHOIS_CIRCUIT_FAILURES : IntegerFieldValidator(0, 1000),
+        PARAM_WHOIS_CIRCUIT_COOLDOWN : IntegerFieldValidator(1, 86400)
+    }
 
     # General variables
     app_name = "network_tools"
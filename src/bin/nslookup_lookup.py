@@ -4,8 +4,8 @@ This is a search command for doing nslookups on results.
 
 import logging
 
-from network_tools_app import nslookup
-from network_tools_app.custom_lookup import CustomLookup
+from network_tools_app import nslookup_with_ttl
+from network_tools_app.custom_lookup import CustomLookup, LookupResult
 
 class NSLookup(CustomLookup):
     """
@@ -19,7 +19,9 @@ class NSLookup(CustomLookup):
 
         # Here is a list of the accepted fieldnames
         fieldnames = ['a', 'aaaa', 'query', 'mx', 'ns', 'server', 'hostname']
-        CustomLookup.__init__(self, fieldnames, 'nslookup_lookup_command', logging.DEBUG)
+        # Results are cached for the TTL of the DNS records (this is used when no records were
+        # returned)
+        CustomLookup.__init__(self, fieldnames, 'nslookup_lookup_command', logging.DEBUG, cache_ttl=300)
 
     def do_lookup(self, host):
         """
@@ -27,7 +29,8 @@ class NSLookup(CustomLookup):
         """
 
         self.logger.info("Running nslookup against host=%s", host)
-        output = dict(nslookup(host=host, index=None))
+        result, ttl = nslookup_with_ttl(host=host)
+        output = LookupResult(result, ttl)
 
         if 'host' in output:
             output['hostname'] = output['host']
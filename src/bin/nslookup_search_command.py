@@ -3,24 +3,84 @@ This module provides a Splunk search command that performs a DNS lookup.
 """
 
 from network_tools_app.search_command import SearchCommand
-from network_tools_app import nslookup, get_default_index
+from network_tools_app import nslookup, get_default_index, get_thread_limit, make_event_writer, flush_event_writer
 
 class NSLookup(SearchCommand):
     """
     This search command provides a Splunk interface for doing a DNS lookup.
     """
 
-    def __init__(self, host=None, server=None, index=None):
+    # Use the chunked protocol so that large sets of results can be processed in chunks
+    chunked = True
+
+    def __init__(self, host=None, server=None, index=None, field=None, concurrency=None, lookup_timeout=None):
         SearchCommand.__init__(self, run_in_preview=False, logger_name="nslookup_search_command")
 
         self.host = host
         self.server = server
         self.index = index
+        self.field = field
+
+        # These control how the values of the field are looked up
+        self.concurrency, self.lookup_timeout = self.parse_enrichment_arguments(concurrency, lookup_timeout)
+
+        # The results of the values of the field are written to this writer (see setup())
+        self.writer = None
 
         self.logger.info("NSLookup running against host=%s", host)
 
+    def is_generating(self):
+        # The command generates the results when no field to look up was provided
+        return self.field is None
+
+    def get_index(self, session_key):
+        if self.index is not None:
+            return self.index
+        else:
+            return get_default_index(session_key)
+
+    def setup(self, session_key):
+
+        # The results of every value of the field are written with a single writer so that they are
+        # batched together (instead of a stash file or HEC connection per value)
+        if self.field is not None:
+            self.writer = make_event_writer(self.get_index(session_key), "nslookup_search_command", "nslookup")
+
+    def teardown(self):
+        if self.writer is not None:
+            writer = self.writer
+            self.writer = None
+            flush_event_writer(writer, self.logger)
+
+    def do_nslookup(self, host):
+        """
+        Perform a DNS lookup for a value of the field.
+        """
+
+        output = nslookup(host=host, server=self.server, logger=self.logger, writer=self.writer)
+
+        # Don't overwrite the host field of the results with the name from a reverse lookup
+        if 'host' in output:
+            output['hostname'] = output['host']
+            del output['host']
+
+        return output
+
     def handle_results(self, results, session_key, in_preview):
 
+        # Get the index
+        index = self.get_index(session_key)
+
+        # Look up the values of the field if one was provided
+        if self.field is not None:
+            thread_limit = self.concurrency or get_thread_limit(session_key)
+
+            self.enrich_results(results, self.field, self.do_nslookup,
+                                thread_limit, self.lookup_timeout)
+
+            self.output_results(results)
+            return
+
         # FYI: we ignore results since this is a generating command
 
         # Make sure that the host field was provided
@@ -28,12 +88,6 @@ class NSLookup(SearchCommand):
             self.logger.warn("No host was provided")
             return
 
-        # Get the index
-        if self.index is not None:
-            index = self.index
-        else:
-            index = get_default_index(session_key)
-
         # Do the nslookup
         result = nslookup(host=self.host, server=self.server, index=index, logger=self.logger)
 
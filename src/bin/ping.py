@@ -15,7 +15,7 @@ sys.path.insert(0, path_to_mod_input_lib)
 from modular_input import ModularInput, IntegerField, DurationField, ListField, IPNetworkField, DomainNameField, MultiValidatorField, RangeField
 from modular_input.shortcuts import forgive_splunkd_outages
 
-from network_tools_app.ping_network import ping_all, tcp_ping_all
+from network_tools_app.ping_network import iter_ping_all, iter_tcp_ping_all
 
 class DomainOrIPNetworkField(MultiValidatorField):
    def __init__(self, name, title, description, none_allowed=False, empty_allowed=True,
@@ -55,6 +55,9 @@ class PingInput(ModularInput):
 
         self.threads = {}
 
+        # This limits the number of pings running at once across all of the stanzas
+        self.budget = threading.BoundedSemaphore(self.thread_limit)
+
     @forgive_splunkd_outages
     def get_app_config(self, session_key, stanza="default"):
         """
@@ -168,6 +171,7 @@ class PingInput(ModularInput):
             # Ensure that the thread limit is valid
             if loaded_thread_limit is not None and loaded_thread_limit > 0:
                 self.thread_limit = loaded_thread_limit
+                self.budget = threading.BoundedSemaphore(self.thread_limit)
                 self.logger.debug("Thread limit successfully loaded, thread_limit=%r",
                                   loaded_thread_limit)
 
@@ -191,21 +195,23 @@ class PingInput(ModularInput):
                 last_ran = self.last_ran(input_config.checkpoint_dir, stanza)
                 for dest in dests:
                     try:
-                        def output_result_callback(result):
-                            """
-                            Output the result
-                            """
-                            self.send_result(result, stanza, index, sourcetype, host, source)
-
+                        # Output each result as it completes rather than holding them all in memory
                         if port not in [None, ""]:
-                            results = tcp_ping_all(dest, port, count=runs, logger=self.logger, callback=output_result_callback)
+                            results = iter_tcp_ping_all(dest, port, count=runs, logger=self.logger)
                         else:
-                            results = ping_all(dest, count=runs, logger=self.logger, callback=output_result_callback)
+                            results = iter_ping_all(dest, count=runs, logger=self.logger,
+                                                    thread_limit=self.thread_limit, budget=self.budget)
+
+                        result_count = 0
+
+                        for result in results:
+                            self.send_result(result, stanza, index, sourcetype, host, source)
+                            result_count += 1
 
-                        if len(results) == 1:
+                        if result_count == 1:
                             self.logger.debug("Successfully pinged the host=%s", str(dest))
-                        elif len(results) > 1:
-                            self.logger.info("Successfully pinged all hosts in the network=%s", str(dest))
+                        elif result_count > 1:
+                            self.logger.info("Successfully pinged all hosts in the network=%s, host_count=%i", str(dest), result_count)
                     except Exception as e:
                         self.logger.exception(e)
 
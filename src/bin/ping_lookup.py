@@ -20,7 +20,7 @@ class PingLookup(CustomLookup):
         # Here is a list of the accepted fieldnames
         fieldnames = ['sent', 'received', 'packet_loss', 'min_ping', 'max_ping', 'avg_ping',
                       'jitter', 'return_code', 'raw_output']
-        CustomLookup.__init__(self, fieldnames, 'ping_lookup_command', logging.INFO)
+        CustomLookup.__init__(self, fieldnames, 'ping_lookup_command', logging.INFO, cache_ttl=30)
 
     def do_lookup(self, host):
         """
@@ -6,8 +6,9 @@ import re
 import sys
 
 from network_tools_app.search_command import SearchCommand
-from network_tools_app import get_default_index
-from network_tools_app.ping_network import ping_all, tcp_ping_all
+from network_tools_app import get_default_index, get_thread_limit, ping, tcp_ping
+from network_tools_app import make_event_writer, flush_event_writer
+from network_tools_app.ping_network import iter_ping_all, iter_tcp_ping_all, RESULT_FIELDS, DEFAULT_TCP_TIMEOUT
 from compat import text_type
 
 class Ping(SearchCommand):
@@ -15,9 +16,18 @@ class Ping(SearchCommand):
     This search command provides a Splunk interface for the system's ping command.
     """
 
-    def __init__(self, dest=None, count=1, port=None, index=None, host=None):
+    # Use the chunked protocol so that large sets of results can be processed in chunks
+    chunked = True
+
+    def __init__(self, dest=None, count=1, port=None, index=None, host=None, timeout=None,
+                 field=None, concurrency=None, lookup_timeout=None):
         SearchCommand.__init__(self, run_in_preview=False, logger_name="ping_search_command")
 
+        self.field = field
+
+        # These control how the values of the field are pinged
+        self.concurrency, self.lookup_timeout = self.parse_enrichment_arguments(concurrency, lookup_timeout)
+
         self.dest = None
 
         if dest is not None:
@@ -46,10 +56,76 @@ class Ping(SearchCommand):
         else:
             self.port = None
 
+        if timeout is not None:
+            try:
+                self.timeout = float(timeout)
+            except ValueError:
+                raise ValueError('The timeout parameter must be a number')
+
+            if self.timeout <= 0:
+                raise ValueError('The timeout parameter must be a positive number (greater than zero)')
+
+        else:
+            self.timeout = DEFAULT_TCP_TIMEOUT
+
+        # The results of the values of the field are written to this writer (see setup())
+        self.writer = None
+
         self.logger.info("Ping running")
 
+    def is_generating(self):
+        # The command generates the results when no field to ping was provided
+        return self.field is None
+
+    def get_index(self, session_key):
+        if self.index is not None:
+            return self.index
+        else:
+            return get_default_index(session_key)
+
+    def setup(self, session_key):
+
+        # The results of every value of the field are written with a single writer so that they are
+        # batched together (instead of a stash file or HEC connection per value)
+        if self.field is not None:
+            self.writer = make_event_writer(self.get_index(session_key), "ping_search_command", "ping")
+
+    def teardown(self):
+        if self.writer is not None:
+            writer = self.writer
+            self.writer = None
+            flush_event_writer(writer, self.logger)
+
+    def do_ping(self, dest):
+        """
+        Ping a value of the field and return the fields to add to the results.
+        """
+
+        if self.port is None:
+            _, return_code, result = ping(dest, self.count, logger=self.logger, writer=self.writer)
+            result['return_code'] = return_code
+        else:
+            result = tcp_ping(dest, self.port, self.count, logger=self.logger, timeout=self.timeout, writer=self.writer)
+
+        # Leave out the dest so that it doesn't overwrite the field of the same name in the results
+        return dict([(field, value) for field, value in result.items() if field in RESULT_FIELDS and field != 'dest'])
+
     def handle_results(self, results, session_key, in_preview):
 
+        # Get the index
+        index = self.get_index(session_key)
+
+        # Get the number of hosts that can be pinged at once
+        thread_limit = get_thread_limit(session_key)
+
+        # Ping the values of the field if one was provided
+        if self.field is not None:
+            self.enrich_results(results, self.field, self.do_ping,
+                                self.concurrency or thread_limit, self.lookup_timeout)
+
+            self.output_results(results)
+            return
+
         # FYI: we ignore results since this is a generating command
 
         # Make sure that the dest field was provided
@@ -57,20 +133,14 @@ class Ping(SearchCommand):
             self.logger.warn("No dest was provided")
             return
 
-        # Get the index
-        if self.index is not None:
-            index = self.index
-        else:
-            index = get_default_index(session_key)
-
         # Do the ping
         if self.port is None:
-            results = ping_all(self.dest, self.count, index=index, logger=self.logger)
+            results = iter_ping_all(self.dest, self.count, index=index, logger=self.logger, thread_limit=thread_limit)
         else:
-            results = tcp_ping_all(self.dest, self.port, self.count, index=index, logger=self.logger)
+            results = iter_tcp_ping_all(self.dest, self.port, self.count, index=index, logger=self.logger, timeout=self.timeout)
 
-        # Output the results
-        self.output_results(results)
+        # Output the results as they complete
+        self.output_streaming_results(results, RESULT_FIELDS)
 
 if __name__ == '__main__':
     Ping.execute()
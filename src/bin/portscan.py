@@ -12,10 +12,11 @@ import splunk
 
 path_to_mod_input_lib = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modular_input.zip')
 sys.path.insert(0, path_to_mod_input_lib)
-from modular_input import ModularInput, DurationField, IPNetworkField, DomainNameField, Field, ListField, MultiValidatorField
+from modular_input import ModularInput, DurationField, IPNetworkField, DomainNameField, Field, ListField, MultiValidatorField, StaticListField, FieldValidationException
 from modular_input.shortcuts import forgive_splunkd_outages
 
 from network_tools_app import portscan
+from network_tools_app.portscan import DISCOVERY_METHODS
 from network_tools_app.parseintset import parseIntSet
 
 if sys.version_info.major >= 3:
@@ -54,6 +55,23 @@ class PortRangeField(Field):
 
         return ",".join(value)
 
+class DiscoveryMethodField(StaticListField):
+    """
+    The method to use to find the hosts that are up. A blank value means that discovery isn't used
+    (as opposed to being an invalid method).
+    """
+
+    def __init__(self, name, title, description, none_allowed=True, empty_allowed=True,
+                 required_on_create=None, required_on_edit=None):
+        super(DiscoveryMethodField, self).__init__(name, title, description, none_allowed, empty_allowed, required_on_create, required_on_edit, valid_values=DISCOVERY_METHODS)
+
+    def to_python(self, value, session_key=None):
+
+        if value is not None:
+            value = value.strip() or None
+
+        return StaticListField.to_python(self, value, session_key)
+
 class PortScanInput(ModularInput):
     """
     This is the class that provides the ping functionality for port scanning.
@@ -73,7 +91,9 @@ class PortScanInput(ModularInput):
         args = [
             ListField("dest", "Destination", "The list of hosts or networks to port scan", empty_allowed=True, none_allowed=True, required_on_create=True, required_on_edit=True, instance_class=DomainOrIPNetworkField),
             PortRangeField("ports", "Ports", "The TCP ports to scan", empty_allowed=False, none_allowed=False, required_on_create=True, required_on_edit=True),
-            DurationField("interval", "Interval", "The interval defining how often to perform the check; can include time units (e.g. 15m for 15 minutes, 8h for 8 hours)", empty_allowed=False)
+            DurationField("interval", "Interval", "The interval defining how often to perform the check; can include time units (e.g. 15m for 15 minutes, 8h for 8 hours)", empty_allowed=False),
+            DiscoveryMethodField("discovery", "Host Discovery", "The method to use to find the hosts that are up before scanning them (icmp or tcp); all hosts are scanned if this is blank", empty_allowed=True, none_allowed=True),
+            PortRangeField("discovery_ports", "Discovery Ports", "The TCP ports to check when discovering hosts using TCP", empty_allowed=True, none_allowed=True)
         ]
 
         ModularInput.__init__(self, scheme_args, args, logger_name='portscan_modular_input', logger_level=logging.DEBUG)
@@ -139,6 +159,8 @@ class PortScanInput(ModularInput):
 
         dests = cleaned_params.get("dest", [])
         ports = cleaned_params.get("ports", None)
+        discovery = cleaned_params.get("discovery", None) or None
+        discovery_ports = cleaned_params.get("discovery_ports", None) or None
 
         # Load the thread_limit if necessary
         # This should only be necessary once in the processes lifetime
@@ -167,10 +189,12 @@ class PortScanInput(ModularInput):
 
             # Get the time that the input last ran
             last_ran = self.last_ran(input_config.checkpoint_dir, stanza)
-            for dest in dests:
-                results = portscan(dest, ports, index, sourcetype, source, self.logger)
+            # Scan all of the hosts at once so that the connections are spread across the hosts
+            results = portscan(dests, ports, index, sourcetype, source, self.logger,
+                               discovery=discovery, discovery_ports=discovery_ports,
+                               discovery_sourcetype=sourcetype + "_discovery")
 
-                self.logger.debug("Successfully port scanned the host=%s, ports=%s", str(dest), str(ports))
+            self.logger.debug("Successfully port scanned the hosts=%s, ports=%s, discovery=%s, result_count=%i", ",".join(dests), str(ports), discovery, len(results))
 
             # Save the checkpoint so that we remember when we last ran the input
             self.save_checkpoint_data(input_config.checkpoint_dir, stanza,
@@ -18,8 +18,8 @@ class PortScanLookup(CustomLookup):
         """
 
         # Here is a list of the accepted fieldnames
-        fieldnames = ['dest', 'ports', 'closed_ports', 'open_ports']
-        CustomLookup.__init__(self, fieldnames, 'portscan_lookup_command', logging.INFO)
+        fieldnames = ['dest', 'ports', 'closed_ports', 'open_ports', 'filtered_ports']
+        CustomLookup.__init__(self, fieldnames, 'portscan_lookup_command', logging.INFO, cache_ttl=300)
 
     def do_lookup(self, host, ports=None):
         """
@@ -37,20 +37,30 @@ class PortScanLookup(CustomLookup):
             'dest': host,
             'ports': ports,
             'closed_ports': [],
-            'open_ports': []
+            'open_ports': [],
+            'filtered_ports': []
         }
 
         results = portscan(host, ports)
 
+        # Include the host with each port if more than one host was scanned (such as a CIDR block)
+        multiple_hosts = len(set([result['dest'] for result in results])) > 1
+
         # Convert the results
         for result in results:
-            data['dest'] = result['dest']
+            if multiple_hosts:
+                port = result['dest'] + ':' + result['port']
+            else:
+                data['dest'] = result['dest']
+                port = result['port']
 
             # Add the port to the necessary list
             if result['status'] == 'open':
-                data['open_ports'].append(result['port'])
+                data['open_ports'].append(port)
+            elif result['status'] == 'filtered':
+                data['filtered_ports'].append(port)
             else:
-                data['closed_ports'].append(result['port'])
+                data['closed_ports'].append(port)
 
         self.logger.info("data=%r", data)
 
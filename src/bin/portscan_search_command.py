@@ -8,6 +8,7 @@ import sys
 from network_tools_app.search_command import SearchCommand
 from network_tools_app import get_default_index
 from network_tools_app import portscan
+from network_tools_app.portscan import DISCOVERY_METHODS
 from network_tools_app.parseintset import parseIntSet
 
 class PortScan(SearchCommand):
@@ -15,7 +16,8 @@ class PortScan(SearchCommand):
     This search command provides a Splunk interface for performing port scans.
     """
 
-    def __init__(self, dest=None, ports=None, index=None, host=None, timeout=5):
+    def __init__(self, dest=None, ports=None, index=None, host=None, timeout=5, discovery=None,
+                 discovery_ports=None):
         SearchCommand.__init__(self, run_in_preview=False, logger_name="portscan_search_command")
 
         self.dest = dest
@@ -44,6 +46,23 @@ class PortScan(SearchCommand):
         if self.timeout <= 0:
             raise ValueError('The must be a valid positive integer (greater than zero)')
 
+        # Validate the host discovery options
+        if discovery is not None and discovery.strip().lower() in ('', 'none', 'false'):
+            discovery = None
+
+        if discovery is not None and discovery.lower() not in DISCOVERY_METHODS:
+            raise ValueError('The discovery method must be one of: %s' % ", ".join(DISCOVERY_METHODS))
+
+        self.discovery = discovery.lower() if discovery is not None else None
+
+        if discovery_ports is not None:
+            try:
+                parseIntSet(discovery_ports, True)
+            except ValueError:
+                raise ValueError('The list of discovery ports is invalid')
+
+        self.discovery_ports = discovery_ports
+
         self.logger.info("Port scan running")
 
     def handle_results(self, results, session_key, in_preview):
@@ -62,7 +81,8 @@ class PortScan(SearchCommand):
             index = get_default_index(session_key)
 
         # Do the port scan
-        results = portscan(self.dest, self.ports, index=index, timeout=self.timeout, logger=self.logger)
+        results = portscan(self.dest, self.ports, index=index, timeout=self.timeout, logger=self.logger,
+                           discovery=self.discovery, discovery_ports=self.discovery_ports)
 
         self.logger.info("Port scan complete")
 
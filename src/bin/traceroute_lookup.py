@@ -19,7 +19,7 @@ class TracerouteLookup(CustomLookup):
 
         # Here is a list of the accepted fieldnames
         fieldnames = ['return_code', 'raw_output', 'hops']
-        CustomLookup.__init__(self, fieldnames, 'traceroute_lookup_command', logging.INFO)
+        CustomLookup.__init__(self, fieldnames, 'traceroute_lookup_command', logging.INFO, cache_ttl=300)
 
     def do_lookup(self, host):
         """
@@ -4,7 +4,7 @@ This is a search command for doing whois lookups on results.
 
 import logging
 
-from network_tools_app import whois, get_default_index
+from network_tools_app import whois, get_default_index, make_parse_pool, configure_whois_governor, make_event_writer, flush_event_writer
 from network_tools_app.custom_lookup import CustomLookup
 from network_tools_app.dict_translate import translate
 
@@ -45,17 +45,61 @@ class WhoisLookup(CustomLookup):
         for rule in self.TRANSLATION_RULES:
             fieldnames.append(rule[1])
     
-        CustomLookup.__init__(self, fieldnames, 'whois_lookup_command', logging.INFO)
+        # Whois records rarely change so the results are cached for hours
+        CustomLookup.__init__(self, fieldnames, 'whois_lookup_command', logging.INFO, cache_ttl=6 * 3600)
+
+        # The responses are parsed in other processes if enabled so that the parsing isn't limited
+        # to one core
+        self.parse_pool = make_parse_pool()
+
+        # The queries sent to each whois server are limited so that the servers don't block us
+        self.whois_governor = configure_whois_governor(logger=self.logger)
+
+        # The results of every row are written with a single writer so that they are batched into
+        # as few stash files as possible (see execute())
+        self.writer = None
+
+    def execute(self):
+        self.writer = make_event_writer(get_default_index(), "whois_search_command", "whois")
+
+        try:
+            CustomLookup.execute(self)
+        finally:
+            try:
+                flush_event_writer(self.writer, self.logger)
+            finally:
+                self.writer = None
+
+                if self.parse_pool is not None:
+                    self.parse_pool.close()
+
+                self.whois_governor.log_statistics(self.logger)
 
     def do_lookup(self, host):
         """
         Perform a whois lookup against the given host.
         """
 
-        index = get_default_index()
-        self.logger.info("Running whois against host=%s using index=%s", host, index)
-        output = whois(host=host, index=index, logger=self.logger)
+        self.logger.info("Running whois against host=%s", host)
+
+        # The untranslated result is returned (and thus cached) so that the same event can be
+        # indexed again when the result is loaded from the cache
+        return whois(host=host, logger=self.logger, parse_pool=self.parse_pool, writer=self.writer)
+
+    def on_cache_hit(self, output, host):
+        """
+        Index the cached result so that every lookup is recorded, just like the ones that query the
+        whois servers.
+        """
+
+        self.logger.info("Using the cached whois result of host=%s", host)
+        self.writer.write_event(output)
 
-        return translate(output, self.TRANSLATION_RULES)
+    def add_result(self, result_dict, output_dict, fieldnames, only_overwrite_empty=False):
+        CustomLookup.add_result(self, result_dict, translate(output_dict, self.TRANSLATION_RULES),
+                                fieldnames, only_overwrite_empty)
 
-WhoisLookup.main()
+# The worker processes of the parse pool import this module so the lookup must only run when this is
+# the main module
+if __name__ == '__main__':
+    WhoisLookup.main()
@@ -3,7 +3,8 @@ This module provides a Splunk search command that runs a whois.
 """
 
 from network_tools_app.search_command import SearchCommand
-from network_tools_app import whois, get_default_index
+from network_tools_app import whois, get_default_index, get_thread_limit, make_whois_cache, make_parse_pool
+from network_tools_app import configure_whois_governor, make_event_writer, flush_event_writer
 from network_tools_app.flatten import dict_to_table
 
 class Whois(SearchCommand):
@@ -11,9 +12,15 @@ class Whois(SearchCommand):
     A search command for performing whois lookups.
     """
 
-    def __init__(self, host=None, field=None, index=None):
+    # Use the chunked protocol so that large sets of results can be processed in chunks
+    chunked = True
+
+    def __init__(self, host=None, field=None, index=None, concurrency=None, lookup_timeout=None):
         SearchCommand.__init__(self, run_in_preview=False, logger_name="whois_search_command")
 
+        # These control how the values of the field are looked up
+        self.concurrency, self.lookup_timeout = self.parse_enrichment_arguments(concurrency, lookup_timeout)
+
         self.host = host
         self.index = index
 
@@ -22,16 +29,79 @@ class Whois(SearchCommand):
 
         self.field = field
 
+        # These are created once per run by setup()
+        self.parse_pool = None
+        self.shared_cache = None
+        self.whois_governor = None
+        self.writer = None
+
+    def is_generating(self):
+        # The command generates the results when no field to look up was provided
+        return self.field is None
+
+    def setup(self, session_key):
+
+        # Get the processes to parse the responses in (if enabled); these are started first since
+        # the processes must be forked before any threads are running
+        self.parse_pool = make_parse_pool(session_key)
+
+        # Get the cache that is shared across the search heads (if it is enabled)
+        self.shared_cache = make_whois_cache(session_key, self.logger)
+
+        # Limit the rate of the queries sent to each whois server
+        self.whois_governor = configure_whois_governor(session_key, self.logger)
+
+        # The results of every value of the field are written with a single writer so that they are
+        # batched together (instead of a stash file or HEC connection per value)
+        if self.field is not None:
+            self.writer = make_event_writer(get_default_index(session_key), "whois_search_command", "whois")
+
+    def teardown(self):
+        try:
+            if self.writer is not None:
+                writer = self.writer
+                self.writer = None
+                flush_event_writer(writer, self.logger)
+        finally:
+            if self.shared_cache is not None:
+                self.shared_cache.close()
+                self.shared_cache = None
+
+            if self.parse_pool is not None:
+                self.parse_pool.close()
+                self.parse_pool = None
+
+            if self.whois_governor is not None:
+                self.whois_governor.log_statistics(self.logger)
+                self.whois_governor = None
+
     def handle_results(self, results, session_key, in_preview):
 
         # Get the index to output to
         index = get_default_index(session_key)
 
-        # Make sure that the host field was provided
-        if self.host is None:
+        # Make sure that the host field was provided (unless the results are being looked up)
+        if self.host is None and self.field is None:
             self.logger.warn("No host was provided")
             return
 
+        self.lookup_results(results, session_key, index, self.shared_cache)
+
+    def do_whois(self, host, index, shared_cache=None):
+        """
+        Perform a whois and add the result to the shared cache.
+        """
+
+        output = whois(host=host, index=index, logger=self.logger, parse_pool=self.parse_pool,
+                       writer=self.writer)
+
+        if shared_cache is not None:
+            shared_cache.set(host, output)
+
+        return output
+
+    def lookup_results(self, results, session_key, index, shared_cache=None):
+
         if results is None or len(results) == 0:
             # FYI: we ignore results since this is a generating command
 
@@ -41,8 +111,14 @@ class Whois(SearchCommand):
             else:
                 index = get_default_index(session_key)
 
-            # Do the whois
-            output = whois(host=self.host, index=index, logger=self.logger)
+            # Do the whois (unless it is in the shared cache)
+            output = None
+
+            if shared_cache is not None:
+                output = shared_cache.get(self.host)
+
+            if output is None:
+                output = self.do_whois(self.host, index, shared_cache)
 
             # Convert the output to a series of rows for better output in the search output
             processed = dict_to_table(output)
@@ -54,28 +130,19 @@ class Whois(SearchCommand):
             self.output_results(processed)
         
         else:
-            
-            # Make a cache to store previously looked up results
-            cache = {}
-
-            for result in results:
-                
-                # Process each result
-                if self.field in result:
-                    
-                    host_to_lookup = result[self.field]
-
-                    # See if we looked up the host already
-                    if host_to_lookup in cache:
-                        output = cache[host_to_lookup]
-
-                    # Otherwise, pull the host from the cache
-                    else:
-                        output = whois(host=host_to_lookup, index=index, logger=self.logger)
-                        cache[host_to_lookup] = output
-
-                    # Add the output
-                    result.update(output)
+
+            # Load the results that other searches already looked up with a batch of requests
+            outputs = {}
+
+            if shared_cache is not None:
+                values = [self.get_lookup_value(result, self.field) for result in results]
+                outputs.update(shared_cache.get_many([value for value in values if value]))
+
+            # Look up the rest of the values concurrently
+            thread_limit = self.concurrency or get_thread_limit(session_key)
+
+            self.enrich_results(results, self.field, lambda host: self.do_whois(host, index, shared_cache),
+                                thread_limit, self.lookup_timeout, outputs)
 
             # Output the results
             self.output_results(results)
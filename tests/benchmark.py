@@ -0,0 +1,538 @@
+# coding=utf-8
+'''
+Benchmarks for the performance sensitive parts of the app. Run them with:
+
+    python benchmark.py [name]
+
+The following benchmarks are included:
+
+* event_writer: events per second when serializing flattened whois results
+* whois_parse: whois responses parsed per second by the parse pool as the processes increase
+* startup: the time that each search command and lookup script takes to import its modules
+* whois_rules: domain whois responses parsed per second with the indexed rule engine
+* whois_contacts: domain whois responses whose contacts are found per second with the prefilter
+* whois_dates: whois date strings parsed per second with the remembered date formats
+'''
+
+import sys
+import os
+import re
+import ast
+import glob
+import time
+import subprocess
+import timeit
+import random
+import threading
+import multiprocessing
+from datetime import datetime
+
+sys.path.append(os.path.join("..", "src", "bin"))
+
+from network_tools_app.event_writer import CachedWriter, utc
+from network_tools_app.flatten import flatten
+from network_tools_app.parse_pool import ParsePool, parse_domain_whois
+from network_tools_app.pythonwhois import parse
+
+def make_whois_result(contact_count=40):
+    """
+    Make a result resembling an IP whois (RDAP) lookup once it has been flattened. Results like
+    these can have hundreds of fields.
+    """
+
+    objects = {}
+
+    for number in range(contact_count):
+        handle = "CONTACT-%i-ARIN" % number
+
+        objects[handle] = {
+            'handle': handle,
+            'roles': ['technical', 'abuse', 'administrative'],
+            'contact': {
+                'name': 'Network Operations Center %i' % number,
+                'kind': 'group',
+                'address': [{'type': None, 'value': '123 Main Street\nSuite "%i"\nAnytown' % number}],
+                'phone': [{'type': ['work', 'voice'], 'value': '+1-555-555-%04i' % number}],
+                'email': [{'type': None, 'value': 'noc%i@example.com' % number}],
+            },
+            'events': [{'action': 'last changed', 'timestamp': '2019-10-%02iT12:00:00-04:00' % (number % 28 + 1), 'actor': None}],
+            'links': ['https://rdap.arin.net/registry/entity/%s' % handle],
+            'status': None
+        }
+
+    return flatten({
+        'query': '8.8.8.8',
+        'asn': '15169',
+        'asn_cidr': '8.8.8.0/24',
+        'asn_country_code': 'US',
+        'asn_date': '1992-12-01',
+        'asn_registry': 'arin',
+        'network': {
+            'cidr': '8.8.8.0/24',
+            'name': 'LVLT-GOGL-8-8-8',
+            'handle': 'NET-8-8-8-0-1',
+            'start_address': '8.8.8.0',
+            'end_address': '8.8.8.255',
+            'ip_version': 'v4',
+            'links': ['https://rdap.arin.net/registry/ip/8.0.0.0', 'https://whois.arin.net/rest/net/NET-8-8-8-0-1'],
+        },
+        'objects': objects,
+        'raw': 'x' * 4096
+    }, ignore_blanks=True)
+
+def make_raw_whois(domain="example%i.com", number=0):
+    """
+    Make the raw responses of a domain whois lookup resembling those from the Verisign registry and
+    a registrar.
+    """
+
+    domain = domain % number
+
+    registry = """   Domain Name: %(upper)s
+   Registry Domain ID: %(number)i_DOMAIN_COM-VRSN
+   Registrar WHOIS Server: whois.registrar.example
+   Registrar URL: http://www.registrar.example
+   Updated Date: 2019-09-09T15:39:04Z
+   Creation Date: 1997-09-15T04:00:00Z
+   Registry Expiry Date: 2028-09-14T04:00:00Z
+   Registrar: Example Registrar, Inc.
+   Registrar IANA ID: 292
+   Registrar Abuse Contact Email: abusecomplaints@registrar.example
+   Registrar Abuse Contact Phone: +1.2083895740
+   Domain Status: clientDeleteProhibited https://icann.org/epp#clientDeleteProhibited
+   Domain Status: clientTransferProhibited https://icann.org/epp#clientTransferProhibited
+   Name Server: NS1.%(upper)s
+   Name Server: NS2.%(upper)s
+   DNSSEC: unsigned
+   URL of the ICANN Whois Inaccuracy Complaint Form: https://www.icann.org/wicf/
+>>> Last update of whois database: 2019-10-21T12:00:00Z <<<
+"""
+
+    registrar = """Domain Name: %(domain)s
+Registry Domain ID: %(number)i_DOMAIN_COM-VRSN
+Registrar WHOIS Server: whois.registrar.example
+Registrar URL: http://www.registrar.example
+Updated Date: 2019-09-09T15:39:04+0000
+Creation Date: 1997-09-15T07:00:00+0000
+Registrar Registration Expiration Date: 2028-09-13T07:00:00+0000
+Registrar: Example Registrar, Inc.
+Registrar IANA ID: 292
+Registrar Abuse Contact Email: abusecomplaints@registrar.example
+Registrar Abuse Contact Phone: +1.2083895740
+Domain Status: clientUpdateProhibited (https://www.icann.org/epp#clientUpdateProhibited)
+Domain Status: clientTransferProhibited (https://www.icann.org/epp#clientTransferProhibited)
+Registrant Organization: Example Organization %(number)i
+Registrant Name: Domain Administrator
+Registrant Street: 1600 Amphitheatre Parkway
+Registrant City: Mountain View
+Registrant State/Province: CA
+Registrant Postal Code: 94043
+Registrant Country: US
+Registrant Phone: +1.6502530000
+Registrant Email: admin@%(domain)s
+Admin Organization: Example Organization %(number)i
+Admin Name: Domain Administrator
+Admin Street: 1600 Amphitheatre Parkway
+Admin City: Mountain View
+Admin State/Province: CA
+Admin Postal Code: 94043
+Admin Country: US
+Admin Phone: +1.6502530000
+Admin Email: admin@%(domain)s
+Tech Organization: Example Organization %(number)i
+Tech Name: Domain Administrator
+Tech Street: 1600 Amphitheatre Parkway
+Tech City: Mountain View
+Tech State/Province: CA
+Tech Postal Code: 94043
+Tech Country: US
+Tech Phone: +1.6502530000
+Tech Email: admin@%(domain)s
+Name Server: ns1.%(domain)s
+Name Server: ns2.%(domain)s
+DNSSEC: unsigned
+URL of the ICANN WHOIS Data Problem Reporting System: http://wdprs.internic.net/
+>>> Last update of WHOIS database: 2019-10-21T11:54:13+0000 <<<
+"""
+
+    values = {'domain': domain, 'upper': domain.upper(), 'number': number}
+
+    return [registry % values, registrar % values]
+
+def legacy_event_to_string(writer, result, event_time=None, ignore_empty_fields=True):
+    """
+    This is how events were serialized before the serializer was optimized (it is used as the
+    baseline for the benchmark).
+    """
+
+    if event_time is None:
+        event_time = datetime.now(utc)
+
+    event = event_time.strftime("%m/%d/%Y %H:%M:%S UTC")
+
+    basic_fields = writer.get_basic_fields(result)
+    basic_fields["_time"] = time.mktime(event_time.timetuple())
+
+    for key in basic_fields:
+        event = event + ", %s=\"%s\"" % (key, basic_fields[key])
+
+    for key in result:
+        converted_key = writer.convert_special_fields(key)
+
+        if converted_key is None or len(converted_key) == 0:
+            pass
+        elif converted_key.startswith("_"):
+            pass
+        elif not isinstance(result[key], list):
+            result_value = str(result[key])
+
+            if len(result_value) <= 0 and ignore_empty_fields == True:
+                pass
+            else:
+                event = event + ", %s=\"%s\"" % (converted_key, writer.escape_value(result_value))
+        else:
+            for value in result[key]:
+                value = str(value)
+
+                if len(value) <= 0 and ignore_empty_fields:
+                    pass
+                else:
+                    event = event + ", %s=\"%s\"" % (converted_key, writer.escape_value(value))
+
+    return event
+
+def report(name, count, duration, baseline=None):
+    """
+    Print the rate of the operation (and the speedup relative to the baseline rate).
+    """
+
+    rate = count / duration
+
+    if baseline is None:
+        print("%-28s %10.0f per second" % (name, rate))
+    else:
+        print("%-28s %10.0f per second (%.1fx)" % (name, rate, rate / baseline))
+
+    return rate
+
+def benchmark_event_writer(count=2000):
+    """
+    Compare the number of flattened whois results that can be serialized per second.
+    """
+
+    writer = CachedWriter()
+    result = make_whois_result()
+
+    print("Serializing a flattened whois result with %i fields" % len(result))
+
+    # Make sure the serializer produces the same output as the original implementation
+    event_time = datetime.now(utc)
+    assert writer.event_to_string(result, event_time) == legacy_event_to_string(writer, result, event_time)
+
+    baseline = report("legacy event_to_string", count, timeit.timeit(lambda: legacy_event_to_string(writer, result), number=count))
+    report("event_to_string", count, timeit.timeit(lambda: writer.event_to_string(result), number=count), baseline)
+    report("event_to_json", count, timeit.timeit(lambda: writer.event_to_json(result), number=count), baseline)
+
+def benchmark_whois_parse(count=200):
+    """
+    Compare the number of whois responses that can be parsed per second by threads (which are
+    limited by the GIL) and by parse pools with an increasing number of processes.
+    """
+
+    responses = [make_raw_whois(number=number) for number in range(count)]
+    thread_count = 16
+
+    print("Parsing %i domain whois responses from %i threads (%i CPUs)" % (count, thread_count, multiprocessing.cpu_count()))
+
+    def parse_all(parse):
+        remaining = list(responses)
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if not remaining:
+                        return
+
+                    raw_data = remaining.pop()
+
+                parse(raw_data)
+
+        threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+    baseline = report("threads", count, timeit.timeit(lambda: parse_all(parse_domain_whois), number=1))
+
+    processes = 1
+
+    while processes <= max(2, multiprocessing.cpu_count()):
+        with ParsePool(processes) as parse_pool:
+            # Start the processes before the timing begins
+            parse_pool.parse_domain_whois(responses[0])
+
+            report("parse pool (%i processes)" % processes, count, timeit.timeit(lambda: parse_all(parse_pool.parse_domain_whois), number=1), baseline)
+
+        processes = processes * 2
+
+def get_script_imports(path):
+    """
+    Get the source code of the import statements at the top level of the script (including those
+    within try blocks, which are used for Python 2+3 compatibility).
+    """
+
+    with open(path) as script_file:
+        source = script_file.read()
+
+    lines = source.splitlines()
+    imports = []
+
+    def add_imports(nodes, indent=""):
+        for node in nodes:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                imports.append(lines[node.lineno - 1].strip())
+
+            elif isinstance(node, ast.Try if hasattr(ast, 'Try') else ast.TryExcept):
+                # Only include the first choice of the compatibility imports
+                add_imports(node.body)
+
+    add_imports(ast.parse(source).body)
+
+    return imports
+
+def time_imports(imports, runs=3):
+    """
+    Get the lowest number of seconds that a new Python process took to run the import statements.
+    """
+
+    code = "\n".join([
+        "import sys, time",
+        "sys.path.insert(0, %r)" % os.path.abspath(os.path.join("..", "src", "bin")),
+        "started_at = time.time()",
+        "try:",
+    ] + ["    " + statement for statement in imports] + [
+        "except ImportError:",
+        "    pass",
+        "print(time.time() - started_at)"
+    ])
+
+    durations = []
+
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-W", "ignore", "-c", code])
+        durations.append(float(output.decode('utf-8').strip().splitlines()[-1]))
+
+    return min(durations)
+
+def benchmark_startup():
+    """
+    Measure the cold import time of each search command and lookup script (each one runs in a new
+    process for every search so this is paid on every invocation).
+    """
+
+    scripts = sorted(glob.glob(os.path.join("..", "src", "bin", "*_search_command.py")) +
+                     glob.glob(os.path.join("..", "src", "bin", "*_lookup.py")))
+
+    print("Import time of each script in a new process (the lowest of 3 runs)")
+
+    for script in scripts:
+        duration = time_imports(get_script_imports(script))
+        print("%-28s %10.1f ms" % (os.path.basename(script), duration * 1000))
+
+def match_every_rule(raw_data):
+    """
+    Get the fields of the whois response by running every regex of the grammar against every line
+    (this is how parse_raw_whois() worked before the rule engine).
+    """
+
+    data = {}
+
+    for segment in raw_data:
+        for rule_key, rule_regexes in parse.grammar['_data'].items():
+            if rule_key not in data:
+                for line in segment.splitlines():
+                    for regex in rule_regexes:
+                        result = re.search(regex, line)
+
+                        if result is not None:
+                            val = result.group("val").strip()
+
+                            if val != "":
+                                data.setdefault(rule_key, []).append(val)
+
+    return data
+
+def match_indexed_rules(raw_data):
+    """
+    Get the fields of the whois response using the rule engine.
+    """
+
+    data = {}
+
+    for segment in raw_data:
+        for rule_key, values in parse.data_rule_engine.match(segment, data):
+            data[rule_key] = values
+
+    return data
+
+def benchmark_whois_rules(count=200):
+    """
+    Compare the number of domain whois responses that can be parsed per second when every regex is
+    run against every line and when the rule engine picks the regexes for each line.
+    """
+
+    responses = [make_raw_whois(number=number) for number in range(count)]
+
+    print("Matching the grammar against %i domain whois responses" % count)
+
+    baseline = report("every rule", count, timeit.timeit(lambda: [match_every_rule(raw_data) for raw_data in responses], number=1))
+    report("indexed rules", count, timeit.timeit(lambda: [match_indexed_rules(raw_data) for raw_data in responses], number=1), baseline)
+    report("parse_raw_whois", count, timeit.timeit(lambda: [parse_domain_whois(raw_data) for raw_data in responses], number=1))
+
+CONTACT_REGEXES = [
+    parse.registrant_regexes,
+    parse.tech_contact_regexes,
+    parse.admin_contact_regexes,
+    parse.billing_contact_regexes
+]
+
+def search_every_contact_regex(raw_data):
+    """
+    Find the contacts by running each contact regex against each segment until one matches (this is
+    how parse_registrants() worked before the prefilter).
+    """
+
+    for contact_regexes in CONTACT_REGEXES:
+        for segment in raw_data:
+            for regex in contact_regexes.regexes:
+                if regex.search(segment) is not None:
+                    break
+
+def search_prefiltered_contact_regexes(raw_data):
+    """
+    Find the contacts by running only the contact regexes whose literal text is in the segment.
+    """
+
+    for contact_regexes in CONTACT_REGEXES:
+        for segment in raw_data:
+            contact_regexes.search(segment)
+
+def benchmark_whois_contacts(count=200):
+    """
+    Compare the number of domain whois responses whose contacts can be found per second with and
+    without the prefilter. The responses include a registry response (which has no contacts) with a
+    long disclaimer like those of the large registries.
+    """
+
+    disclaimer = "NOTICE: By submitting a WHOIS query, you agree to abide by the following terms of use. You agree\nthat you may use this Data only for lawful purposes and that under no circumstances will you\n"
+    responses = [[registry + disclaimer * 20, registrar] for registry, registrar in (make_raw_whois(number=number) for number in range(count))]
+
+    print("Finding the contacts in %i domain whois responses" % count)
+
+    baseline = report("every regex", count, timeit.timeit(lambda: [search_every_contact_regex(raw_data) for raw_data in responses], number=1))
+    report("prefiltered regexes", count, timeit.timeit(lambda: [search_prefiltered_contact_regexes(raw_data) for raw_data in responses], number=1), baseline)
+
+    # The registry response alone shows the cost of the regexes that don't match
+    responses = [raw_data[:1] for raw_data in responses]
+
+    baseline = report("every regex (no contacts)", count, timeit.timeit(lambda: [search_every_contact_regex(raw_data) for raw_data in responses], number=1))
+    report("prefiltered (no contacts)", count, timeit.timeit(lambda: [search_prefiltered_contact_regexes(raw_data) for raw_data in responses], number=1), baseline)
+
+# These are the formats of the dates returned by a variety of whois servers
+WHOIS_DATE_FORMATS = [
+    "%(year)04i-%(month)02i-%(day)02iT%(hour)02i:%(minute)02i:%(second)02iZ",
+    "%(year)04i-%(month)02i-%(day)02iT%(hour)02i:%(minute)02i:%(second)02i.0Z",
+    "%(year)04i-%(month)02i-%(day)02iT%(hour)02i:%(minute)02i:%(second)02i+0000",
+    "%(year)04i-%(month)02i-%(day)02i %(hour)02i:%(minute)02i:%(second)02i",
+    "%(year)04i-%(month)02i-%(day)02i",
+    "%(year)04i/%(month)02i/%(day)02i",
+    "%(year)04i/%(month)02i/%(day)02i %(hour)02i:%(minute)02i:%(second)02i (JST)",
+    "%(year)04i.%(month)02i.%(day)02i %(hour)02i:%(minute)02i:%(second)02i",
+    "%(year)04i%(month)02i%(day)02i",
+    "%(day)02i-%(month_abbreviation)s-%(year)04i",
+    "%(day)02i-%(month_abbreviation)s-%(year)04i %(hour)02i:%(minute)02i:%(second)02i UTC",
+    "%(day)i %(month_abbreviation)s %(year)04i",
+    "%(day)02i.%(month)02i.%(year)04i",
+    "%(day)02i/%(month)02i/%(year)04i",
+    "%(month_abbreviation)s %(day)i, %(year)04i",
+    "Mon %(month_abbreviation)s %(day)02i %(hour)02i:%(minute)02i:%(second)02i GMT %(year)04i",
+    "%(day)02i-%(month_name)s-%(year)04i",
+    "before Aug-1996",
+]
+
+def make_whois_dates(count, seed=0):
+    """
+    Make date strings in the formats that whois servers use.
+    """
+
+    generator = random.Random(seed)
+    dates = []
+
+    for _ in range(count):
+        date = datetime(generator.randint(1985, 2035), generator.randint(1, 12), generator.randint(1, 28),
+                        generator.randint(0, 23), generator.randint(0, 59), generator.randint(0, 59))
+
+        values = {
+            'year': date.year,
+            'month': date.month,
+            'day': date.day,
+            'hour': date.hour,
+            'minute': date.minute,
+            'second': date.second,
+            'month_abbreviation': date.strftime("%b"),
+            'month_name': date.strftime("%B")
+        }
+
+        dates.append(generator.choice(WHOIS_DATE_FORMATS) % values)
+
+    return dates
+
+def match_every_date_format(date):
+    """
+    Find the first date format that matches the date string by trying each of them (this is how
+    parse_dates() worked before the formats were remembered).
+    """
+
+    for rule in parse.grammar['_dateformats']:
+        result = re.match(rule, date)
+
+        if result is not None:
+            return result
+
+def benchmark_whois_dates(count=5000):
+    """
+    Compare the number of whois date strings whose format can be found per second by trying every
+    format and by remembering the format that matched each shape of date.
+    """
+
+    dates = make_whois_dates(count)
+
+    print("Parsing %i date strings in %i formats" % (count, len(WHOIS_DATE_FORMATS)))
+
+    baseline = report("every format", count, timeit.timeit(lambda: [match_every_date_format(date) for date in dates], number=1))
+
+    # Start with no remembered formats
+    parse.date_shape_cache.clear()
+    report("remembered formats", count, timeit.timeit(lambda: [parse.match_date_format(date) for date in dates], number=1), baseline)
+
+    report("parse_dates", count, timeit.timeit(lambda: [parse.parse_dates([date]) for date in dates], number=1))
+
+BENCHMARKS = {
+    'event_writer': benchmark_event_writer,
+    'whois_parse': benchmark_whois_parse,
+    'startup': benchmark_startup,
+    'whois_rules': benchmark_whois_rules,
+    'whois_contacts': benchmark_whois_contacts,
+    'whois_dates': benchmark_whois_dates,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS.keys())
+
+    for name in names:
+        print("== %s ==" % name)
+        BENCHMARKS[name]()
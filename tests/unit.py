@@ -12,25 +12,88 @@ The following test cases are included:
 * TestTracerouteParser
 * TestTCPPing
 * TestPingNetwork
+* TestICMPEchoEngine
+* TestWorkerPool
+* TestTCPPingEngine
+* TestBufferedStashNewWriter
+* TestEventWriter
+* TestHECEventWriter
+* TestKVStoreCache
+* TestParsePool
+* TestRuleEngine
+* TestContactPrefilter
+* TestParseDates
+* TestRootServerCache
+* TestWhoisGovernor
+* TestChunkedSearchCommand
+* TestCustomLookup
+* TestResultCache
+* TestCompiledData
+* TestAppConfig
+* TestDiscoveryMethodField
 '''
 
 import unittest
 import sys
 import os
 import json
+import re
 import errno
 import collections
+import itertools
+import socket
+import threading
+import time
+import shutil
+import tempfile
+import zlib
+import csv
+import io
+import logging
+from timeit import default_timer as timer
 
 sys.path.append(os.path.join("..", "src", "bin"))
 
-from network_tools_app import ping, traceroute, whois, nslookup, tcp_ping
+from network_tools_app import ping, traceroute, whois, nslookup, tcp_ping, make_event_writer
+from network_tools_app import get_app_config, get_default_index, clear_app_config_cache
+import network_tools_app
 from network_tools_app.dict_translate import translate, is_array, merge_values, translate_key, prepare_translation_rules
 from network_tools_app.flatten import flatten, flatten_to_table
 from network_tools_app import pingparser, tracerouteparser
-from network_tools_app.ping_network import ping_all, tcp_ping_all
-from network_tools_app.portscan import port_scan
+from network_tools_app.ping_network import ping_all, tcp_ping_all, iter_ping_all, iter_tcp_ping_all, NetworkDestinationTooHigh
+from network_tools_app.portscan import port_scan, parse_hosts, interleave, TooManyHostsException, RTTEstimator, PortScanner, discover_hosts
+from network_tools_app import icmp
+from network_tools_app import tcp_engine
+from network_tools_app.tcp_engine import TCPPingEngine
+from network_tools_app.worker_pool import run_concurrently, iterate_concurrently, map_concurrently, LookupTimeout
 from network_tools_app.parseintset import parseIntSet
-from portscan import PortRangeField
+from network_tools_app.custom_lookup import CustomLookup, LookupResult
+from network_tools_app.result_cache import ResultCache
+from network_tools_app.compiled_data import load_compiled, get_compiled_path
+from network_tools_app.ipwhois.utils import get_countries, read_countries
+from network_tools_app.kvstore_cache import KVStoreCache
+from network_tools_app.parse_pool import ParsePool, parse_domain_whois
+from network_tools_app.pythonwhois import parse as whois_parse
+from network_tools_app.pythonwhois import net as whois_net
+from network_tools_app.pythonwhois.shared import WhoisException
+from network_tools_app.whois_governor import WhoisGovernor, ServerLimiter, CircuitOpenError, governor as whois_governor
+from network_tools_app.search_command import SearchCommand, ChunkedProtocol
+from network_tools_app.event_writer import StashNewWriter, BufferedStashNewWriter, CachedWriter, HECEventWriter, HECException, utc
+from datetime import datetime
+from portscan import PortRangeField, DiscoveryMethodField
+from modular_input import FieldValidationException
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+try:
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from urllib.parse import urlparse, parse_qs
 
 class TestPing(unittest.TestCase):
 
@@ -69,11 +132,59 @@ class TestTraceroute(unittest.TestCase):
 
         self.assertGreater(len(parsed), 0)
 
+class FlushCountingWriter(CachedWriter):
+    """
+    A writer that stores the events and counts how many times it was flushed.
+    """
+
+    flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+    @classmethod
+    def factory(cls, writers):
+        """
+        Get a replacement for make_event_writer() that adds the writers it makes to the list.
+        """
+
+        def make_writer(index, source, sourcetype, session_key=None):
+            writers.append(cls())
+            return writers[-1]
+
+        return make_writer
+
 class TestWhois(unittest.TestCase):
     """
     This tests the whois functionality which performs whois requests on IPs and domain names.
     """
 
+    def test_search_command_single_writer(self):
+        import whois_search_command
+
+        writers = []
+        original_make_event_writer = whois_search_command.make_event_writer
+        original_domain_whois = network_tools_app.domain_whois
+
+        try:
+            whois_search_command.make_event_writer = FlushCountingWriter.factory(writers)
+            network_tools_app.domain_whois = lambda host, parse_pool=None: {'registrar': 'Example'}
+            command = whois_search_command.Whois(field='host')
+
+            # Every value in every chunk should be written with one writer that is flushed once
+            command.setup(None)
+            command.chunk_output = []
+            command.handle_results([{'host': 'a.example'}, {'host': 'b.example'}], None, False)
+            command.handle_results([{'host': 'c.example'}], None, False)
+            command.teardown()
+        finally:
+            whois_search_command.make_event_writer = original_make_event_writer
+            network_tools_app.domain_whois = original_domain_whois
+
+        self.assertEqual(len(writers), 1)
+        self.assertEqual(sorted([event['query'] for event in writers[0].stored_events]), ['a.example', 'b.example', 'c.example'])
+        self.assertEqual(writers[0].flushes, 1)
+
     def test_do_whois(self):
         """
         Test an IP whois
@@ -96,6 +207,32 @@ class TestNSLookup(unittest.TestCase):
     Tests nslookup functionality which kicks off an nslookup using network_tools_app::nslookup.
     """
 
+    def test_search_command_single_writer(self):
+        import nslookup_search_command
+
+        writers = []
+        original_make_event_writer = nslookup_search_command.make_event_writer
+        original_nslookup_with_ttl = network_tools_app.nslookup_with_ttl
+
+        try:
+            nslookup_search_command.make_event_writer = FlushCountingWriter.factory(writers)
+            network_tools_app.nslookup_with_ttl = lambda host, server=None: ({'host': host, 'a': ['127.0.0.1']}, 60)
+            command = nslookup_search_command.NSLookup(field='host', index='main')
+
+            # Every value in every chunk should be written with one writer that is flushed once
+            command.setup(None)
+            command.chunk_output = []
+            command.handle_results([{'host': 'a.example'}, {'host': 'b.example'}], None, False)
+            command.handle_results([{'host': 'c.example'}], None, False)
+            command.teardown()
+        finally:
+            nslookup_search_command.make_event_writer = original_make_event_writer
+            network_tools_app.nslookup_with_ttl = original_nslookup_with_ttl
+
+        self.assertEqual(len(writers), 1)
+        self.assertEqual(len(writers[0].stored_events), 3)
+        self.assertEqual(writers[0].flushes, 1)
+
     def test_do_nslookup(self):
         """
         Test performing an nslookup.
@@ -738,6 +875,49 @@ class TestTCPPing(unittest.TestCase):
         self.assertGreaterEqual(result['max_ping'], 0)
         self.assertGreaterEqual(result['avg_ping'], 0)
 
+    def test_ping_writer(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(50)
+
+        try:
+            writer = CachedWriter()
+            result = tcp_ping('127.0.0.1', port=server.getsockname()[1], count=1, writer=writer)
+        finally:
+            server.close()
+
+        # The result should be written to the writer that was provided
+        self.assertEqual(result['received'], 1)
+        self.assertEqual(len(writer.stored_events), 1)
+
+    def test_search_command_single_writer(self):
+        import ping_search_command
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(50)
+
+        writers = []
+        original_make_event_writer = ping_search_command.make_event_writer
+
+        try:
+            ping_search_command.make_event_writer = FlushCountingWriter.factory(writers)
+            command = ping_search_command.Ping(field='dest', port=str(server.getsockname()[1]), index='main')
+
+            # Every value in every chunk should be written with one writer that is flushed once
+            command.setup(None)
+            command.chunk_output = []
+            command.handle_results([{'dest': '127.0.0.1'}, {'dest': 'localhost'}], None, False)
+            command.handle_results([{'dest': '127.0.0.2'}], None, False)
+            command.teardown()
+        finally:
+            ping_search_command.make_event_writer = original_make_event_writer
+            server.close()
+
+        self.assertEqual(len(writers), 1)
+        self.assertEqual(len(writers[0].stored_events), 3)
+        self.assertEqual(writers[0].flushes, 1)
+
 class TestPingNetwork(unittest.TestCase):
     """
     Test pinging using TCP.
@@ -756,82 +936,2347 @@ class TestPingNetwork(unittest.TestCase):
         self.assertGreaterEqual(result[0]['max_ping'], 0)
         self.assertGreaterEqual(result[0]['avg_ping'], 0)
 
-class TestSplitIntSet(unittest.TestCase):
+    def test_ping_all_network(self):
+        results = []
+        result = ping_all('127.0.0.0/29', count=1, callback=results.append)
+
+        self.assertEqual(len(result), 6)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(result[0]['dest_network'], '127.0.0.0/29')
+
+    def test_ping_all_limit(self):
+        with self.assertRaises(NetworkDestinationTooHigh):
+            ping_all('10.0.0.0/16')
+
+    def test_iter_ping_all_large_network(self):
+        """
+        Make sure that large networks are swept incrementally.
+        """
+
+        results = list(itertools.islice(iter_ping_all('127.0.0.0/16', count=1), 10))
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0]['dest_network'], '127.0.0.0/16')
+
+    def test_iter_tcp_ping_all_large_network(self):
+        results = list(itertools.islice(iter_tcp_ping_all('127.0.0.0/16', port=1), 10))
+
+        self.assertEqual(len(results), 10)
+
+class TestICMPEchoEngine(unittest.TestCase):
     """
-    Test splitting of a list of integers.
+    Test the built-in ICMP echo engine.
     """
 
-    def test_combination(self):
-        result = parseIntSet("80-90,8443")
+    def test_checksum(self):
+        packet = icmp.make_echo_request(1234, 1, b'abcdefgh')
 
-        self.assertEqual(len(result), 12)
-        self.assertEqual(result, set([80, 81, 82, 83, 84, 85, 86, 87, 88, 89, 90, 8443]))
+        # The checksum of a packet that includes its checksum must be zero
+        self.assertEqual(icmp.checksum(packet), 0)
 
-    def test_single(self):
-        result = parseIntSet("80")
+    def test_parse_echo_reply(self):
+        packet = bytearray(icmp.make_echo_request(1234, 7, b'abcdefgh'))
 
-        self.assertEqual(len(result), 1)
-        self.assertEqual(result, set([80]))
+        # Echo requests should be ignored
+        self.assertEqual(icmp.parse_echo_reply(bytes(packet), False), None)
 
-    def test_duplicates(self):
-        result = parseIntSet("80-90,89")
-        self.assertEqual(result, set([80, 81, 82, 83, 84, 85, 86, 87, 88, 89, 90]))
+        packet[0] = icmp.ICMP_ECHO_REPLY
+        self.assertEqual(icmp.parse_echo_reply(bytes(packet), False), (1234, 7))
 
-        self.assertEqual(len(result), 11)
+    def test_statistics_match_ping_parser(self):
+        """
+        Make sure the engine's statistics use the same format as the parsed output of ping.
+        """
 
-    def test_extra_spaces(self):
-        result = parseIntSet(" 80-90 , 8443 ")
+        result = icmp.calculate_statistics('127.0.0.1', 3, [0.1, 0.2, 0.3])
+        output = """PING 127.0.0.1 (127.0.0.1) 56(84) bytes of data.
 
-        self.assertEqual(len(result), 12)
-        self.assertEqual(result, set([80, 81, 82, 83, 84, 85, 86, 87, 88, 89, 90, 8443]))
+--- 127.0.0.1 ping statistics ---
+3 packets transmitted, 3 received, 0% packet loss
+rtt min/avg/max/mdev = 0.100/0.200/0.300/0.082 ms"""
+
+        self.assertEqual(result, pingparser.parse(output))
+
+    def test_statistics_no_replies(self):
+        result = icmp.calculate_statistics('10.0.0.1', 4, [])
+
+        self.assertEqual(result['received'], '0')
+        self.assertEqual(result['packet_loss'], '100')
+        self.assertEqual(result['avg_ping'], 'NA')
+
+    @unittest.skipUnless(icmp.is_available(), "ICMP sockets cannot be opened by this process")
+    def test_ping_hosts(self):
+        engine = icmp.ICMPEchoEngine(timeout=1, interval=0.1)
+        results = engine.ping_hosts(['127.0.0.1', '127.0.0.2'], count=3)
+
+        self.assertEqual(len(results), 2)
+
+        for output, return_code, parsed in results:
+            self.assertEqual(return_code, 0)
+            self.assertGreater(len(output), 0)
+            self.assertEqual(parsed['received'], '3')
+
+    @unittest.skipUnless(icmp.is_available(), "ICMP sockets cannot be opened by this process")
+    def test_kernel_timestamps(self):
+        sock, is_raw = icmp.open_icmp_socket()
+
+        try:
+            if not icmp.enable_kernel_timestamps(sock):
+                self.skipTest("Kernel timestamps are not supported")
+
+            sock.sendto(icmp.make_echo_request(1234, 1, b'abcdefgh'), ('127.0.0.1', 0))
+            time.sleep(0.3)
+
+            # The time should be when the reply arrived rather than when it was read
+            _, _, received_at = icmp.receive_packet(sock, True)
+            self.assertGreater(timer() - received_at, 0.25)
+        finally:
+            sock.close()
+
+    @unittest.skipUnless(icmp.is_available(), "ICMP sockets cannot be opened by this process")
+    def test_ping_unresolvable(self):
+        _, return_code, _ = icmp.ICMPEchoEngine(timeout=1).ping("doesnotexist.invalid")
+
+        self.assertEqual(return_code, 2)
+
+class TestWorkerPool(unittest.TestCase):
+    """
+    Test the pool of threads used for running operations concurrently.
+    """
+
+    def test_run_concurrently(self):
+        results = {}
+
+        def store_result(item, result):
+            results[item] = result
+
+        run_concurrently(lambda item: item * 2, range(100), 10, store_result)
+
+        self.assertEqual(len(results), 100)
+        self.assertEqual(results[7], 14)
+
+    def test_thread_limit(self):
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def track(_):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+
+            time.sleep(0.01)
+
+            with lock:
+                running[0] -= 1
+
+        run_concurrently(track, range(50), 5)
+
+        self.assertLessEqual(max_running[0], 5)
+        self.assertGreater(max_running[0], 1)
+
+    def test_budget(self):
+        budget = threading.BoundedSemaphore(2)
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def track(_):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+
+            time.sleep(0.01)
+
+            with lock:
+                running[0] -= 1
+
+        run_concurrently(track, range(20), 10, budget=budget)
+
+        self.assertLessEqual(max_running[0], 2)
+
+    def test_map_concurrently(self):
+        def double(item):
+            if item == 13:
+                raise ValueError("Unlucky")
+
+            return item * 2
+
+        results, errors = map_concurrently(double, range(50), 5)
+
+        # A failure shouldn't stop the other items
+        self.assertEqual(len(results), 49)
+        self.assertEqual(results[7], 14)
+        self.assertEqual(list(errors.keys()), [13])
+        self.assertTrue(isinstance(errors[13], ValueError))
+
+    def test_map_concurrently_timeout(self):
+        def wait(item):
+            if item == 'slow':
+                time.sleep(2)
+
+            return item
+
+        started_at = time.time()
+        results, errors = map_concurrently(wait, ['slow', 'a', 'b', 'c'], 2, timeout=0.2)
+
+        # The slow item shouldn't hold up the others or its slot in the pool
+        self.assertLess(time.time() - started_at, 1)
+        self.assertEqual(sorted(results.keys()), ['a', 'b', 'c'])
+        self.assertTrue(isinstance(errors['slow'], LookupTimeout))
+
+    def test_iterate_concurrently_generator(self):
+        """
+        Make sure that the items are consumed incrementally and that iteration can be stopped early.
+        """
+
+        consumed = [0]
+
+        def items():
+            for item in range(100000):
+                consumed[0] += 1
+                yield item
+
+        results = list(itertools.islice(iterate_concurrently(lambda item: item, items(), 4), 5))
+
+        self.assertEqual(len(results), 5)
+        self.assertLess(consumed[0], 100)
+
+    def test_exception(self):
+        def fail(item):
+            if item == 3:
+                raise ValueError("Failed on purpose")
 
-    def test_error_reporting(self):
         with self.assertRaises(ValueError):
-            parseIntSet("80-90 , tree", True)
+            run_concurrently(fail, range(10), 4)
 
-        result = parseIntSet("80-81, tree")
-        self.assertEqual(len(result), 2)
-        self.assertEqual(result, set([80, 81]))
+    def test_tcp_ping_all_network_concurrently(self):
+        results = []
+        start = time.time()
 
-class TestPortScan(unittest.TestCase):
+        # Nothing listens on port 1 so each probe fails quickly
+        tcp_ping_all('127.0.0.0/28', port=1, count=1, callback=results.append)
+
+        self.assertEqual(len(results), 14)
+        self.assertEqual(results[0]['dest_network'], '127.0.0.0/28')
+        self.assertLess(time.time() - start, 5)
+
+class TestTCPPingEngine(unittest.TestCase):
     """
-    Test port scanning using TCP.
+    Test the selector-based TCP ping engine.
     """
 
-    def test_port_scan(self):
-        results = port_scan('textcritical.net', '80-81')
-        self.assertEqual(len(results), 2)
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('0.0.0.0', 0))
+        self.server.listen(1024)
+        self.port = self.server.getsockname()[1]
 
-    def test_port_scan_single(self):
-        results = port_scan('textcritical.net', '80')
-        self.assertEqual(len(results), 1)
+    def tearDown(self):
+        self.server.close()
 
-        self.assertEqual(results[0]['status'], 'open')
-        self.assertEqual(results[0]['dest'], 'textcritical.net')
-        self.assertEqual(results[0]['port'], 'TCP\\80')
+    def test_ping_open_port(self):
+        result = TCPPingEngine(timeout=1).ping('127.0.0.1', self.port, count=3)
 
-    def test_port_scan_preparsed(self):
-        results = port_scan('textcritical.net', [80, 443])
-        self.assertEqual(len(results), 2)
+        self.assertEqual(result['dest'], '127.0.0.1')
+        self.assertEqual(result['sent'], 3)
+        self.assertEqual(result['received'], 3)
+        self.assertEqual(result['packet_loss'], 0)
+        self.assertGreaterEqual(result['jitter'], 0)
+        self.assertGreaterEqual(result['max_ping'], result['min_ping'])
 
-class TestPortRangeField(unittest.TestCase):
+    def test_ping_closed_port(self):
+        result = TCPPingEngine(timeout=1).ping('127.0.0.1', 1, count=2)
+
+        self.assertEqual(result['sent'], 2)
+        self.assertEqual(result['received'], 0)
+        self.assertEqual(result['packet_loss'], 100)
+
+    def test_ping_unresolvable(self):
+        result = TCPPingEngine(timeout=1).ping('doesnotexist.invalid', 80, count=2)
+
+        self.assertEqual(result['sent'], 2)
+        self.assertEqual(result['packet_loss'], 100)
+
+    def test_interval(self):
+        start = time.time()
+        TCPPingEngine(timeout=1, interval=0.2).ping('127.0.0.1', self.port, count=3)
+
+        self.assertGreaterEqual(time.time() - start, 0.4)
+
+    def test_many_hosts(self):
+        hosts = ['127.0.%i.%i' % (i // 250, i % 250 + 1) for i in range(500)]
+        results = list(TCPPingEngine(timeout=2).iter_ping(hosts, self.port, count=2))
+
+        self.assertEqual(len(results), 500)
+        self.assertEqual(sum([result['received'] for _, result in results]), 1000)
+
+    def test_select_fallback(self):
+        # Python 2 doesn't have the selectors module
+        original_selectors = tcp_engine.selectors
+        tcp_engine.selectors = None
+
+        try:
+            hosts = ['127.0.0.1', '127.0.0.2', '127.0.0.3']
+            results = dict(TCPPingEngine(timeout=1).iter_ping(hosts, self.port, count=2))
+            closed_result = TCPPingEngine(timeout=1).ping('127.0.0.1', 1, count=2)
+        finally:
+            tcp_engine.selectors = original_selectors
+
+        self.assertEqual(sorted(results.keys()), hosts)
+        self.assertEqual(sum([result['received'] for result in results.values()]), 6)
+        self.assertEqual(closed_result['packet_loss'], 100)
+
+class TestBufferedStashNewWriter(unittest.TestCase):
     """
-    Test the port range field.
+    Test the writer that batches events into stash files.
     """
 
-    field = None
+    class TemporaryDirectoryWriter(BufferedStashNewWriter):
+        """
+        Writes the stash files to a temporary directory instead of the spool directory.
+        """
+
+        def __init__(self, directory, temporary_directory=None, **kwargs):
+            BufferedStashNewWriter.__init__(self, index='main', source_name='test', sourcetype='test', **kwargs)
+            self.directory = directory
+            self.temporary_directory = temporary_directory or directory
+            self.file_count = 0
+
+        def get_file_name(self):
+            self.file_count += 1
+            return os.path.join(self.directory, "%i.stash_output" % self.file_count)
+
+        def get_temporary_directory(self):
+            return self.temporary_directory
 
     def setUp(self):
-        self.field = PortRangeField('name', 'title', 'description')
+        self.directory = tempfile.mkdtemp()
 
-    def test_to_string(self):
-        value = self.field.to_string([80, 443])
+    def tearDown(self):
+        shutil.rmtree(self.directory)
 
-        self.assertEqual(value, "80,443")
-    def test_to_python(self):
-        value = self.field.to_python("80,443")
+    def test_written_outside_of_spool(self):
+        temporary_directory = tempfile.mkdtemp()
+        original_rename = os.rename
+        renames = []
 
-        self.assertEqual(value, set([80, 443]))
+        def rename(source, destination):
+            # The file should be complete before it appears in the spool directory
+            with open(source) as stash_file:
+                renames.append((os.listdir(self.directory), stash_file.read().count(StashNewWriter.LINE_BREAKER)))
+
+            original_rename(source, destination)
+
+        os.rename = rename
+
+        try:
+            writer = self.TemporaryDirectoryWriter(self.directory, temporary_directory)
+            writer.write_events([{'dest': '10.0.0.1'}, {'dest': '10.0.0.2'}])
+            writer.flush()
+        finally:
+            os.rename = original_rename
+
+        try:
+            self.assertEqual(renames, [([], 2)])
+            self.assertEqual(os.listdir(temporary_directory), [])
+            self.assertEqual(len(self.read_events()), 2)
+        finally:
+            shutil.rmtree(temporary_directory)
+
+    def read_events(self):
+        events = []
+
+        for file_name in sorted(os.listdir(self.directory)):
+            with open(os.path.join(self.directory, file_name)) as stash_file:
+                content = stash_file.read()
+
+            self.assertTrue(content.startswith("***SPLUNK*** "))
+            events.extend(content.split(StashNewWriter.LINE_BREAKER + "\n")[1:])
+
+        return events
+
+    def test_flush(self):
+        writer = self.TemporaryDirectoryWriter(self.directory)
+
+        for port in range(100):
+            self.assertEqual(writer.write_event({'port': port}), None)
+
+        self.assertEqual(len(os.listdir(self.directory)), 0)
+        self.assertNotEqual(writer.flush(), None)
+
+        # Every event should be in the single file and each should include the sourcetype
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        events = self.read_events()
+        self.assertEqual(len(events), 100)
+        self.assertTrue(events[99].startswith('sourcetype="test"'))
+        self.assertTrue('port="99"' in events[99])
+
+        # Flushing an empty buffer shouldn't create a file
+        self.assertEqual(writer.flush(), None)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_max_events(self):
+        with self.TemporaryDirectoryWriter(self.directory, max_events=10) as writer:
+            for port in range(25):
+                writer.write_event({'port': port})
+
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        self.assertEqual(len(self.read_events()), 25)
+
+    def test_max_bytes(self):
+        with self.TemporaryDirectoryWriter(self.directory, max_bytes=1024) as writer:
+            for _ in range(10):
+                writer.write_event({'data': 'a' * 500})
+
+        self.assertEqual(len(os.listdir(self.directory)), 5)
+
+    def test_max_delay(self):
+        writer = self.TemporaryDirectoryWriter(self.directory, max_delay=0.1)
+        writer.write_event({'port': 1})
+
+        time.sleep(0.2)
+
+        self.assertNotEqual(writer.write_event({'port': 2}), None)
+        self.assertEqual(len(self.read_events()), 2)
+
+    def test_threads(self):
+        writer = self.TemporaryDirectoryWriter(self.directory, max_events=50)
+
+        def write_events(thread_number):
+            for port in range(100):
+                writer.write_event({'thread': thread_number, 'port': port})
+
+        threads = [threading.Thread(target=write_events, args=(number,)) for number in range(5)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        writer.flush()
+
+        self.assertEqual(len(self.read_events()), 500)
+
+class TestEventWriter(unittest.TestCase):
+    """
+    Test the serialization of events.
+    """
+
+    event_time = datetime(2020, 1, 2, 3, 4, 5, tzinfo=utc)
+
+    def setUp(self):
+        self.writer = CachedWriter()
+
+    def test_event_to_string(self):
+        result = collections.OrderedDict([
+            ('dest', '10.0.0.1'),
+            ('host', 'router'),
+            ('_raw', 'raw'),
+            ('punct', '...'),
+            ('empty', ''),
+            ('ports', ['22', '', 80]),
+            ('message', 'a "quoted" \\ value')
+        ])
+
+        event = self.writer.event_to_string(result, self.event_time)
+
+        self.assertTrue(event.startswith("01/02/2020 03:04:05 UTC, _time=\""))
+        self.assertTrue(event.endswith(', dest="10.0.0.1", orig_host="router", orig_raw="raw", ports="22", ports="80", message="a \\"quoted\\" \\\\ value"'))
+
+    def test_event_to_string_include_empty(self):
+        event = self.writer.event_to_string({'empty': ''}, self.event_time, ignore_empty_fields=False)
+        self.assertTrue(event.endswith(', empty=""'))
+
+    def test_event_to_json(self):
+        result = collections.OrderedDict([
+            ('dest', '10.0.0.1'),
+            ('host', 'router'),
+            ('_hidden', 'value'),
+            ('empty', ''),
+            ('ports', ['22', '', 80]),
+            ('count', 5)
+        ])
+
+        event = json.loads(self.writer.event_to_json(result, self.event_time))
+
+        self.assertEqual(list(event.keys())[0], '_time')
+        self.assertEqual(event['dest'], '10.0.0.1')
+        self.assertEqual(event['orig_host'], 'router')
+        self.assertEqual(event['ports'], ['22', '80'])
+        self.assertEqual(event['count'], '5')
+        self.assertFalse('empty' in event)
+        self.assertFalse('_hidden' in event)
+
+    def test_stash_writer_json_format(self):
+        writer = StashNewWriter('main', 'test', sourcetype='test', event_format='json')
+        self.assertEqual(json.loads(writer.format_event({'dest': '10.0.0.1'}))['dest'], '10.0.0.1')
+
+        with self.assertRaises(ValueError):
+            StashNewWriter('main', 'test', event_format='xml')
+
+class FakeCollectorHandler(BaseHTTPRequestHandler):
+    """
+    Acts like an HTTP Event Collector by recording the events that are posted to it.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        collector = self.server.collector
+        body = self.rfile.read(int(self.headers['Content-Length']))
+
+        with collector.lock:
+            collector.requests.append((self.path, dict(self.headers.items()), body))
+            collector.connections.add(self.client_address)
+
+            # Fail the first requests if requested
+            if collector.failures_remaining > 0:
+                collector.failures_remaining -= 1
+                status = collector.failure_status
+            else:
+                status = 200
+
+        if status == 200:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = zlib.decompress(body, 31)
+
+            with collector.lock:
+                collector.events.extend([json.loads(line) for line in body.decode('utf-8').split("\n")])
+
+        response = b'{"text":"Success","code":0}'
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        collector = self.server.collector
+
+        # Act like the storage/passwords endpoint that the HEC token is read from
+        with collector.lock:
+            collector.password_requests.append((self.path, self.headers.get('Authorization')))
+
+        response = json.dumps({'entry': [{'name': 'network_tools:hec_token:', 'content': {'clear_password': 'token'}}]}).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+class FakeCollector(ThreadingMixIn, HTTPServer):
+    """
+    A local stand-in for an HTTP Event Collector.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, failures=0, failure_status=503):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeCollectorHandler)
+        self.collector = self
+        self.lock = threading.Lock()
+        self.requests = []
+        self.events = []
+        self.connections = set()
+        self.password_requests = []
+        self.failures_remaining = failures
+        self.failure_status = failure_status
+
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%i" % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class TestHECEventWriter(unittest.TestCase):
+    """
+    Test sending events to an HTTP Event Collector.
+    """
+
+    def setUp(self):
+        self.collector = None
+
+    def tearDown(self):
+        if self.collector is not None:
+            self.collector.stop()
+
+    def test_send_events(self):
+        self.collector = FakeCollector()
+
+        with HECEventWriter(self.collector.url, 'token', index='main', source_name='test', sourcetype='portscan', host='scanner', max_events=10) as writer:
+            for port in range(25):
+                writer.write_event({'dest': '10.0.0.1', 'port': port})
+
+        self.assertEqual(len(self.collector.events), 25)
+        self.assertEqual(len(self.collector.requests), 3)
+
+        # The metadata should be included with each event
+        event = self.collector.events[0]
+        self.assertEqual(event['index'], 'main')
+        self.assertEqual(event['source'], 'test')
+        self.assertEqual(event['sourcetype'], 'portscan')
+        self.assertEqual(event['host'], 'scanner')
+        self.assertTrue('dest="10.0.0.1"' in event['event'])
+
+        # The requests should be authenticated, compressed and posted to the event endpoint
+        path, headers, _ = self.collector.requests[0]
+        headers = dict([(name.lower(), value) for name, value in headers.items()])
+
+        self.assertEqual(path, '/services/collector/event')
+        self.assertEqual(headers['authorization'], 'Splunk token')
+        self.assertEqual(headers['content-encoding'], 'gzip')
+
+    def test_persistent_connections(self):
+        self.collector = FakeCollector()
+
+        with HECEventWriter(self.collector.url, 'token', max_events=1, connection_count=2) as writer:
+            for port in range(20):
+                writer.write_event({'port': port})
+
+        self.assertEqual(len(self.collector.requests), 20)
+        self.assertLessEqual(len(self.collector.connections), 2)
+
+    def test_json_format(self):
+        self.collector = FakeCollector()
+
+        with HECEventWriter(self.collector.url, 'token', event_format='json', use_gzip=False) as writer:
+            writer.write_event({'dest': '10.0.0.1', 'ports': ['22', '80']})
+
+        self.assertEqual(self.collector.events[0]['event'], {'dest': '10.0.0.1', 'ports': ['22', '80']})
+
+    def test_retry(self):
+        self.collector = FakeCollector(failures=2)
+
+        with HECEventWriter(self.collector.url, 'token', backoff=0.01) as writer:
+            writer.write_event({'port': 22})
+
+        self.assertEqual(len(self.collector.requests), 3)
+        self.assertEqual(len(self.collector.events), 1)
+
+    def test_failure(self):
+        self.collector = FakeCollector(failures=1, failure_status=403)
+        writer = HECEventWriter(self.collector.url, 'bad_token', backoff=0.01)
+        writer.write_event({'port': 22})
+
+        with self.assertRaises(HECException):
+            writer.flush()
+
+        # Client errors shouldn't be retried
+        self.assertEqual(len(self.collector.requests), 1)
+        writer.close()
+
+    def test_invalid_url(self):
+        with self.assertRaises(ValueError):
+            HECEventWriter('ftp://localhost', 'token')
+
+    def test_make_event_writer(self):
+        splunk_home = tempfile.mkdtemp()
+        original_splunk_home = os.environ.get('SPLUNK_HOME')
+        original_get_hec_token = network_tools_app.get_hec_token
+
+        try:
+            conf_dir = os.path.join(splunk_home, 'etc', 'apps', 'network_tools', 'local')
+            os.makedirs(conf_dir)
+
+            with open(os.path.join(conf_dir, 'network_tools.conf'), 'w') as conf_file:
+                conf_file.write("[default]\noutput_mode = hec\nhec_url = http://127.0.0.1:8088\nhec_verify_ssl = false\n")
+
+            os.environ['SPLUNK_HOME'] = splunk_home
+            network_tools_app.get_hec_token = lambda session_key: 'token' if session_key == 'session' else None
+
+            writer = make_event_writer('main', 'test', 'portscan', session_key='session')
+
+            self.assertTrue(isinstance(writer, HECEventWriter))
+            self.assertEqual(writer.token, 'token')
+            self.assertEqual(writer.verify_ssl, False)
+
+            # Without a session key, the token can't be read so the events are written to stash files
+            self.assertTrue(isinstance(make_event_writer('main', 'test', 'portscan'), BufferedStashNewWriter))
+        finally:
+            network_tools_app.get_hec_token = original_get_hec_token
+
+            if original_splunk_home is None:
+                del os.environ['SPLUNK_HOME']
+            else:
+                os.environ['SPLUNK_HOME'] = original_splunk_home
+
+            shutil.rmtree(splunk_home)
+
+    def test_get_hec_token(self):
+        self.collector = FakeCollector()
+
+        self.assertEqual(network_tools_app.get_hec_token('session', self.collector.url), 'token')
+        self.assertEqual(self.collector.password_requests, [('/servicesNS/nobody/network_tools/storage/passwords/network_tools:hec_token:?output_mode=json', 'Splunk session')])
+
+    def test_flush_event_writer(self):
+        self.collector = FakeCollector()
+
+        for _ in range(5):
+            writer = HECEventWriter(self.collector.url, 'token', connection_count=3)
+            writer.write_event({'port': 22})
+            network_tools_app.flush_event_writer(writer)
+
+        # The sender threads should be stopped once the events are sent (the threads of the
+        # collector may still be handling the closed connections so they aren't counted)
+        self.assertEqual(len(self.collector.events), 5)
+        self.assertEqual([thread for thread in threading.enumerate() if thread.name == 'hec_sender'], [])
+
+class FakeKVStoreHandler(BaseHTTPRequestHandler):
+    """
+    Acts like the REST endpoint of a KV store collection (supporting the queries that the cache
+    uses).
+    """
+
+    def send_json(self, value):
+        response = json.dumps(value).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        kvstore = self.server.kvstore
+        query = json.loads(parse_qs(urlparse(self.path).query)['query'][0])
+
+        keys = [condition['_key'] for condition in query['$or']]
+        expires_after = query['expires']['$gt']
+
+        with kvstore.lock:
+            kvstore.reads.append(keys)
+            documents = [kvstore.documents[key] for key in keys if key in kvstore.documents and kvstore.documents[key]['expires'] > expires_after]
+
+        self.send_json(documents)
+
+    def do_POST(self):
+        kvstore = self.server.kvstore
+        documents = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+
+        with kvstore.lock:
+            kvstore.writes.append(documents)
+
+            for document in documents:
+                kvstore.documents[document['_key']] = document
+
+        self.send_json([document['_key'] for document in documents])
+
+    def log_message(self, *args):
+        pass
+
+class FakeKVStore(ThreadingMixIn, HTTPServer):
+    """
+    A local stand-in for the KV store REST API.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeKVStoreHandler)
+        self.kvstore = self
+        self.lock = threading.Lock()
+        self.documents = {}
+        self.reads = []
+        self.writes = []
+
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%i" % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class TestKVStoreCache(unittest.TestCase):
+    """
+    Test the cache of results that is stored in the KV store.
+    """
+
+    def setUp(self):
+        self.kvstore = FakeKVStore()
+
+    def tearDown(self):
+        self.kvstore.stop()
+
+    def test_get_many(self):
+        cache = KVStoreCache('whois_cache', 'session_key', server_uri=self.kvstore.url, batch_size=10)
+
+        for number in range(25):
+            cache.set('host%i' % number, {'query': 'host%i' % number, 'nameservers': ['a', 'b']})
+
+        cache.close()
+
+        results = cache.get_many(['host%i' % number for number in range(30)])
+
+        self.assertEqual(len(results), 25)
+        self.assertEqual(results['host3'], {'query': 'host3', 'nameservers': ['a', 'b']})
+        self.assertEqual(cache.hits, 25)
+        self.assertEqual(cache.misses, 5)
+
+        # The keys should have been read in batches
+        self.assertEqual(len(self.kvstore.reads), 3)
+
+    def test_batched_writes(self):
+        cache = KVStoreCache('whois_cache', 'session_key', server_uri=self.kvstore.url, batch_size=10)
+
+        for number in range(25):
+            cache.set('host%i' % number, {'query': 'host%i' % number})
+
+        cache.close()
+
+        self.assertEqual(len(self.kvstore.documents), 25)
+        self.assertTrue(len(self.kvstore.writes) < 25)
+        self.assertTrue(max([len(documents) for documents in self.kvstore.writes]) <= 10)
+
+    def test_expired(self):
+        cache = KVStoreCache('whois_cache', 'session_key', ttl=-1, server_uri=self.kvstore.url)
+        cache.set('textcritical.net', {'query': 'textcritical.net'})
+        cache.close()
+
+        self.assertEqual(len(self.kvstore.documents), 1)
+        self.assertEqual(cache.get('textcritical.net'), None)
+
+    def test_unavailable(self):
+        url = self.kvstore.url
+        self.kvstore.stop()
+
+        # The cache ought to act like it is empty if the KV store cannot be reached
+        cache = KVStoreCache('whois_cache', 'session_key', server_uri=url)
+
+        self.assertEqual(cache.get_many(['textcritical.net']), {})
+
+        cache.set('textcritical.net', {'query': 'textcritical.net'})
+        cache.close()
+
+        self.kvstore = FakeKVStore()
+
+SAMPLE_DOMAIN_WHOIS = """Domain Name: textcritical.net
+Registrar WHOIS Server: whois.registrar.example
+Updated Date: 2019-09-09T15:39:04+0000
+Creation Date: 2011-09-15T07:00:00+0000
+Registrar Registration Expiration Date: 2028-09-13T07:00:00+0000
+Registrar: Example Registrar, Inc.
+Registrant Name: Domain Administrator
+Registrant City: Mountain View
+Registrant Country: US
+Registrant Email: admin@textcritical.net
+Name Server: ns1.textcritical.net
+Name Server: ns2.textcritical.net
+"""
+
+class TestParsePool(unittest.TestCase):
+    """
+    Test parsing whois responses in worker processes.
+    """
+
+    def test_parse(self):
+        with ParsePool(2) as parse_pool:
+            result = parse_pool.parse_domain_whois([SAMPLE_DOMAIN_WHOIS])
+
+        # The result should match parsing the response in this process
+        self.assertEqual(result, parse_domain_whois([SAMPLE_DOMAIN_WHOIS]))
+        self.assertEqual(result['registrar'], ['Example Registrar, Inc.'])
+        self.assertEqual(result['nameservers'], ['ns1.textcritical.net', 'ns2.textcritical.net'])
+        self.assertEqual(result['creation_date'], [datetime(2011, 9, 15, 7, 0)])
+
+    def test_threads(self):
+        results = []
+
+        with ParsePool(2) as parse_pool:
+            responses = [[SAMPLE_DOMAIN_WHOIS.replace('textcritical', 'host%i' % number)] for number in range(20)]
+            run_concurrently(parse_pool.parse_domain_whois, responses, thread_limit=5,
+                             callback=lambda raw_data, result: results.append(result))
+
+        self.assertEqual(len(results), 20)
+        self.assertEqual(len(set([result['nameservers'][0] for result in results])), 20)
+
+    def test_resolve_handles(self):
+        original_fetch_nic_contact = whois_parse.fetch_nic_contact
+        fetched = []
+
+        def fetch_nic_contact(handle, lookup_server):
+            fetched.append((handle, lookup_server, threading.current_thread().name))
+            return {'handle': handle, 'name': ' Jane Doe ', 'email': 'jane@example.com'}
+
+        response = SAMPLE_DOMAIN_WHOIS + "admin-c: EX1-TEST\nContact: jane@example.com\n"
+
+        try:
+            whois_parse.fetch_nic_contact = fetch_nic_contact
+
+            with ParsePool(2) as parse_pool:
+                result = parse_pool.parse_domain_whois([response], 'whois.registrar.example')
+        finally:
+            whois_parse.fetch_nic_contact = original_fetch_nic_contact
+
+        # The handle should have been looked up on this thread (through the governor) rather than
+        # in the worker process
+        self.assertEqual(fetched, [('EX1-TEST', 'whois.registrar.example', threading.current_thread().name)])
+        self.assertEqual(result['contacts']['admin'], {'handle': 'EX1-TEST', 'name': 'Jane Doe', 'email': 'jane@example.com'})
+        self.assertNotIn('jane@example.com', result.get('emails', []))
+
+# These are responses in the formats of a variety of whois servers
+SAMPLE_WHOIS_CORPUS = [
+    [SAMPLE_DOMAIN_WHOIS],
+    ["""   Domain Name: TEXTCRITICAL.NET
+   Registry Domain ID: 1677425442_DOMAIN_NET-VRSN
+   Registrar WHOIS Server: whois.registrar.example
+   Updated Date: 2019-09-09T15:39:04Z
+   Creation Date: 2011-09-15T04:00:00Z
+   Registry Expiry Date: 2028-09-14T04:00:00Z
+   Registrar: Example Registrar, Inc.
+   Domain Status: clientTransferProhibited https://icann.org/epp#clientTransferProhibited
+   Name Server: NS1.TEXTCRITICAL.NET
+   Name Server: NS2.TEXTCRITICAL.NET
+>>> Last update of whois database: 2019-10-21T12:00:00Z <<<
+
+NOTICE: The expiration date displayed in this record is the date the
+registrar's sponsorship of the domain name registration in the registry is
+currently set to expire.
+""", SAMPLE_DOMAIN_WHOIS],
+    ["""
+    Domain name:
+        example.co.uk
+
+    Registrar:
+        Example Registrar Ltd [Tag = EXAMPLE]
+        URL: http://www.registrar.example
+
+    Relevant dates:
+        Registered on: 26-Feb-2001
+        Expiry date:  26-Feb-2021
+        Last updated:  08-Feb-2019
+
+    Registration status:
+        Registered until expiry date.
+
+    Name servers:
+        ns1.example.co.uk         192.0.2.1
+        ns2.example.co.uk
+
+"""],
+    ["""Domain: example.de
+Nserver: ns1.example.de
+Nserver: ns2.example.de 192.0.2.2
+Status: connect
+Changed: 2018-03-12T21:44:25+01:00
+"""],
+    ["""[ JPRS database provides information on network administration. ]
+Domain Information: [ドメイン情報]
+[Domain Name]                   EXAMPLE.JP
+[Registrant]                    Example Société Co.,Ltd.
+[Name Server]                   ns1.example.jp
+[Name Server]                   ns2.example.jp
+[Created on]                    2001/02/26
+[Expires on]                    2021/02/28
+[Status]                        Active
+[Last Updated]                  2020/03/01 01:05:09 (JST)
+"""],
+    ["""domain:       example.ru
+nserver:      ns1.example.ru.
+nserver:      ns2.example.ru.
+state:        REGISTERED, DELEGATED, VERIFIED
+org:          Example LLC
+registrar:    RU-CENTER-RU
+created:      1999-03-04T21:00:00Z
+paid-till:    2021-03-05T21:00:00Z
+source:       TCI
+"""],
+    ["""DOMAIN NAME: EXAMPLE.COM
+EXPIRES ON: 2020-01-01
+REGISTRAR: EXAMPLE REGISTRAR
+Registrant Email: ADMIN AT EXAMPLE DOT COM
+Contact: hostmaster@example.com
+"""],
+    ["""domain:      example.fr
+holder-c:    EX1-FRNIC
+admin-c:     EX2-FRNIC
+tech-c:      EX2-FRNIC
+
+nic-hdl:     EX1-FRNIC
+type:        ORGANIZATION
+contact:     Example SARL
+address:     1 rue Example
+address:     75001 Paris
+country:     FR
+e-mail:      admin@example.fr
+changed:     01/01/2015 nic@nic.fr
+
+nic-hdl:     EX2-FRNIC
+type:        PERSON
+contact:     Jean Example
+address:     1 rue Example
+address:     75001 Paris
+country:     FR
+e-mail:      tech@example.fr
+changed:     01/01/2015 nic@nic.fr
+"""],
+]
+
+class TestRuleEngine(unittest.TestCase):
+    """
+    Test the rule engine that matches the lines of whois responses against the grammar.
+    """
+
+    def match_every_rule(self, raw_data):
+        # This is how the fields were found before the rule engine (every regex against every line)
+        data = {}
+
+        for segment in raw_data:
+            for rule_key, rule_regexes in whois_parse.grammar['_data'].items():
+                if (rule_key in data) == False:
+                    for line in segment.splitlines():
+                        for regex in rule_regexes:
+                            result = regex.search(line)
+
+                            if result is not None:
+                                val = result.group("val").strip()
+                                if val != "":
+                                    try:
+                                        data[rule_key].append(val)
+                                    except KeyError as e:
+                                        data[rule_key] = [val]
+
+        return data
+
+    def match_indexed_rules(self, raw_data):
+        data = {}
+
+        for segment in raw_data:
+            for rule_key, values in whois_parse.data_rule_engine.match(segment, data):
+                data[rule_key] = values
+
+        return data
+
+    def test_same_output(self):
+        for raw_data in SAMPLE_WHOIS_CORPUS:
+            expected = self.match_every_rule(raw_data)
+
+            # Compare the order of the fields too since it affects the order of the output
+            self.assertEqual(list(self.match_indexed_rules(raw_data).items()), list(expected.items()))
+
+    def test_parse_raw_whois(self):
+        data = whois_parse.parse_raw_whois(SAMPLE_WHOIS_CORPUS[1])
+
+        self.assertEqual(data['registrar'], ['Example Registrar, Inc.'])
+        self.assertEqual(data['nameservers'], ['NS1.TEXTCRITICAL.NET', 'NS2.TEXTCRITICAL.NET'])
+        self.assertEqual(data['creation_date'], [datetime(2011, 9, 15, 4, 0)])
+
+    def test_required_literal(self):
+        self.assertEqual(whois_parse.required_literal(re.compile(r'Creation Date:\s?(?P<val>.+)', re.IGNORECASE)), 'creation date:')
+        self.assertEqual(whois_parse.required_literal(re.compile(r'Exp(?:iry)? Date\s?(?P<val>.+)')), ' Date')
+        self.assertEqual(whois_parse.required_literal(re.compile(r'(?P<val>[\w.-]+@[\w.-]+)')), '@')
+        self.assertEqual(whois_parse.required_literal(re.compile(r'(?P<val>\S+)')), None)
+
+class TestContactPrefilter(unittest.TestCase):
+    """
+    Test skipping the contact regexes whose literal text isn't in the whois response.
+    """
+
+    def search_every_regex(self, regexes, segment):
+        for regex in regexes:
+            match = regex.search(segment)
+
+            if match is not None:
+                return match
+
+        return None
+
+    def test_same_matches(self):
+        for contact_regexes in [whois_parse.registrant_regexes, whois_parse.tech_contact_regexes,
+                                whois_parse.admin_contact_regexes, whois_parse.billing_contact_regexes]:
+            for raw_data in SAMPLE_WHOIS_CORPUS:
+                for segment in raw_data:
+                    expected = self.search_every_regex(contact_regexes.regexes, segment)
+                    match = contact_regexes.search(segment)
+
+                    if expected is None:
+                        self.assertEqual(match, None)
+                    else:
+                        self.assertEqual(match.re, expected.re)
+                        self.assertEqual(match.groupdict(), expected.groupdict())
+
+    def test_candidates(self):
+        regexes = whois_parse.PrefilteredRegexes([re.compile(r'Registrant Name: (?P<name>.+)'),
+                                                  re.compile(r'owner-id:\s*(?P<handle>.+)', re.IGNORECASE),
+                                                  re.compile(r'(?P<name>.+)')])
+
+        candidates = list(regexes.candidates("OWNER-ID: EX1\n"))
+        self.assertEqual([regex.pattern for regex in candidates], [r'owner-id:\s*(?P<handle>.+)', r'(?P<name>.+)'])
+
+        self.assertEqual(regexes.search("Registrant Name: Example\n").group('name'), 'Example')
+
+    def test_parse_registrants(self):
+        # The contacts in this response are referenced by their NIC handles
+        contacts = whois_parse.parse_registrants(SAMPLE_WHOIS_CORPUS[-1])
+
+        self.assertEqual(contacts['registrant']['name'], 'Example SARL')
+        self.assertEqual(contacts['registrant']['email'], 'admin@example.fr')
+        self.assertEqual(contacts['tech']['name'], 'Jean Example')
+        self.assertEqual(contacts['billing'], None)
+
+class TestParseDates(unittest.TestCase):
+    """
+    Test parsing whois dates with the formats remembered for each shape of date.
+    """
+
+    def setUp(self):
+        whois_parse.date_shape_cache.clear()
+
+    def test_parse_dates(self):
+        self.assertEqual(whois_parse.parse_dates(['2019-09-09T15:39:04Z', '2011-09-15']),
+                         [datetime(2019, 9, 9, 15, 39, 4), datetime(2011, 9, 15)])
+
+        self.assertEqual(whois_parse.parse_dates(['15-Sep-1997']), [datetime(1997, 9, 15)])
+        self.assertEqual(whois_parse.parse_dates(['Sep 15, 1997']), [datetime(1997, 9, 15)])
+        self.assertEqual(whois_parse.parse_dates(['not a date']), None)
+
+    def test_remembered_format(self):
+        whois_parse.parse_dates(['2019-09-09T15:39:04Z'])
+        self.assertEqual(list(whois_parse.date_shape_cache.keys()), ['9999-99-99T99:99:99Z'])
+
+        # Dates with the same shape should use the remembered format
+        self.assertEqual(whois_parse.parse_dates(['2028-12-31T01:02:03Z']), [datetime(2028, 12, 31, 1, 2, 3)])
+        self.assertEqual(len(whois_parse.date_shape_cache), 1)
+
+    def test_same_format_as_every_format(self):
+        for date in ['2019-09-09T15:39:04.0Z', '2019/09/09 15:39:04 (JST)', '09.09.2019', '9 Sep 2019',
+                     'Mon Sep 09 15:39:04 GMT 2019', '09-September-2019', '20190909', 'before Aug-1996']:
+            expected = None
+
+            for rule in whois_parse.grammar['_dateformats']:
+                expected = rule.match(date)
+
+                if expected is not None:
+                    break
+
+            result = whois_parse.match_date_format(date)
+
+            if expected is None:
+                self.assertEqual(result, None)
+            else:
+                for name in expected.re.groupindex:
+                    self.assertEqual(result.group(name), expected.group(name))
+
+class TestRootServerCache(unittest.TestCase):
+    """
+    Test caching the root WHOIS server of each TLD that IANA refers lookups to.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.requests = []
+
+        self.original_whois_request = whois_net.whois_request
+        self.original_referral_cache = whois_net.referral_cache
+
+        whois_net.whois_request = self.whois_request
+        whois_net.referral_cache = ResultCache(os.path.join(self.cache_dir, 'lookup_cache.sqlite'))
+        whois_net.root_server_cache.clear()
+
+    def tearDown(self):
+        whois_net.referral_cache.close()
+
+        whois_net.whois_request = self.original_whois_request
+        whois_net.referral_cache = self.original_referral_cache
+        whois_net.root_server_cache.clear()
+
+        shutil.rmtree(self.cache_dir)
+
+    def whois_request(self, domain, server, port=43):
+        self.requests.append((domain, server))
+
+        if server == 'whois.iana.org':
+            return "domain:       %s\n\nrefer:        whois.nic.%s\n" % (domain.split('.')[-1].upper(), domain.split('.')[-1])
+        else:
+            return "Domain Name: %s\n" % domain
+
+    def test_get_root_server(self):
+        self.assertEqual(whois_net.get_root_server('textcritical.net'), 'whois.nic.net')
+        self.assertEqual(whois_net.get_root_server('example.NET'), 'whois.nic.net')
+        self.assertEqual(whois_net.get_root_server('example.org'), 'whois.nic.org')
+
+        # IANA should only be asked once for each TLD
+        self.assertEqual(self.requests, [('textcritical.net', 'whois.iana.org'), ('example.org', 'whois.iana.org')])
+
+    def test_shared_between_processes(self):
+        whois_net.get_root_server('textcritical.net')
+
+        # Another process would only have the cache on disk
+        whois_net.root_server_cache.clear()
+
+        self.assertEqual(whois_net.get_root_server('example.net'), 'whois.nic.net')
+        self.assertEqual(len(self.requests), 1)
+
+    def test_expired(self):
+        original_ttl = whois_net.ROOT_SERVER_TTL
+        whois_net.ROOT_SERVER_TTL = 0
+
+        try:
+            whois_net.get_root_server('textcritical.net')
+            whois_net.get_root_server('example.net')
+        finally:
+            whois_net.ROOT_SERVER_TTL = original_ttl
+
+        self.assertEqual(len(self.requests), 2)
+
+    def test_get_whois_raw(self):
+        self.assertEqual(whois_net.get_whois_raw('textcritical.net', with_server_list=True),
+                         (['Domain Name: textcritical.net\n'], ['whois.nic.net']))
+
+        whois_net.get_whois_raw('example.net')
+
+        self.assertEqual(self.requests, [('textcritical.net', 'whois.iana.org'),
+                                         ('textcritical.net', 'whois.nic.net'),
+                                         ('example.net', 'whois.nic.net')])
+
+        # The exceptions should still be used instead of IANA
+        whois_net.get_whois_raw('example.ps')
+        self.assertEqual(self.requests[-1], ('example.ps', 'whois.pnina.ps'))
+
+class TestWhoisGovernor(unittest.TestCase):
+    """
+    Test limiting the queries sent to each whois server.
+    """
+
+    def setUp(self):
+        self.requests = []
+        self.original_send_whois_request = whois_net.send_whois_request
+
+        whois_net.send_whois_request = self.send_whois_request
+
+        whois_governor.reset()
+        whois_governor.configure(queries_per_second=0, max_connections=0, circuit_failures=3, circuit_cooldown=60)
+
+    def tearDown(self):
+        whois_net.send_whois_request = self.original_send_whois_request
+
+        whois_governor.configure()
+        whois_governor.reset()
+
+    def send_whois_request(self, domain, server, port=43):
+        self.requests.append((domain, server))
+
+        if server == 'whois.down.test':
+            raise WhoisException("Caught exception socket.error : timed out")
+
+        return "Domain Name: %s\n" % domain
+
+    def fail_queries(self, limiter, count):
+        for _ in range(count):
+            limiter.acquire()
+            limiter.release(failed=True)
+
+    def test_rate_limit(self):
+        limiter = ServerLimiter('whois.example.test', queries_per_second=20, max_connections=0)
+
+        started = time.time()
+
+        # The first 20 queries are allowed as a burst and the next 10 have to wait for tokens
+        for _ in range(30):
+            limiter.acquire()
+            limiter.release()
+
+        self.assertGreaterEqual(time.time() - started, 0.4)
+
+        statistics = limiter.get_statistics()
+        self.assertEqual(statistics['queries'], 30)
+        self.assertEqual(statistics['delayed'], 10)
+
+    def test_max_connections(self):
+        limiter = ServerLimiter('whois.example.test', queries_per_second=0, max_connections=2)
+
+        def query():
+            limiter.acquire()
+            time.sleep(0.05)
+            limiter.release()
+
+        threads = [threading.Thread(target=query) for _ in range(6)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        statistics = limiter.get_statistics()
+        self.assertEqual(statistics['queries'], 6)
+        self.assertEqual(statistics['max_concurrent'], 2)
+
+    def test_circuit_opens(self):
+        limiter = ServerLimiter('whois.example.test', queries_per_second=0, circuit_failures=3, circuit_cooldown=60)
+
+        self.fail_queries(limiter, 2)
+
+        # A success resets the count of failures
+        limiter.acquire()
+        limiter.release()
+
+        self.fail_queries(limiter, 3)
+
+        self.assertRaises(CircuitOpenError, limiter.acquire)
+
+        statistics = limiter.get_statistics()
+        self.assertEqual(statistics['circuit'], 'open')
+        self.assertEqual(statistics['circuit_opens'], 1)
+        self.assertEqual(statistics['failures'], 5)
+        self.assertEqual(statistics['rejected'], 1)
+
+    def test_circuit_cooldown(self):
+        limiter = ServerLimiter('whois.example.test', queries_per_second=0, circuit_failures=1, circuit_cooldown=0.1)
+
+        self.fail_queries(limiter, 1)
+        self.assertRaises(CircuitOpenError, limiter.acquire)
+
+        time.sleep(0.15)
+
+        # A single query is let through to test the server; the others fail until it finishes
+        limiter.acquire()
+        self.assertRaises(CircuitOpenError, limiter.acquire)
+
+        # The circuit opens again if the test fails
+        limiter.release(failed=True)
+        self.assertRaises(CircuitOpenError, limiter.acquire)
+
+        time.sleep(0.15)
+
+        limiter.acquire()
+        limiter.release()
+
+        self.assertEqual(limiter.get_statistics()['circuit'], 'closed')
+        self.assertEqual(limiter.get_statistics()['circuit_opens'], 2)
+
+    def test_query_context(self):
+        governor = WhoisGovernor()
+        governor.configure(queries_per_second=0, circuit_failures=2)
+
+        # Exceptions and queries flagged as failed both count as failures
+        try:
+            with governor.query('whois.example.test'):
+                raise socket.error("timed out")
+        except socket.error:
+            pass
+
+        with governor.query('WHOIS.example.test') as query:
+            query.failed = True
+
+        self.assertRaises(CircuitOpenError, governor.query('whois.example.test').__enter__)
+
+        # Other servers aren't affected
+        with governor.query('whois.other.test'):
+            pass
+
+        self.assertEqual([statistics['server'] for statistics in governor.get_statistics()],
+                         ['whois.example.test', 'whois.other.test'])
+
+    def test_whois_request(self):
+        for _ in range(3):
+            self.assertRaises(WhoisException, whois_net.whois_request, 'textcritical.net', 'whois.down.test')
+
+        # The server shouldn't be queried once the circuit opens
+        self.assertRaises(WhoisException, whois_net.whois_request, 'textcritical.net', 'whois.down.test')
+        self.assertEqual(len(self.requests), 3)
+
+        self.assertEqual(whois_net.whois_request('textcritical.net', 'whois.up.test'), "Domain Name: textcritical.net\n")
+
+    def test_ipwhois_fails_fast(self):
+        from network_tools_app.ipwhois.net import Net
+        from network_tools_app.ipwhois.exceptions import WhoisLookupError
+
+        self.fail_queries(whois_governor.get_limiter('whois.down.test'), 3)
+
+        started = time.time()
+        self.assertRaises(WhoisLookupError, Net('74.125.225.229').get_whois, server='whois.down.test')
+        self.assertLess(time.time() - started, 1)
+
+        self.assertEqual(whois_governor.get_limiter('whois.down.test').get_statistics()['rejected'], 1)
+
+    def test_log_statistics(self):
+        messages = []
+
+        class Logger(object):
+            def info(self, message, *args):
+                messages.append(message % args)
+
+        whois_net.whois_request('textcritical.net', 'whois.up.test')
+        whois_governor.log_statistics(Logger())
+
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0].startswith("Whois limiter statistics, server=whois.up.test, queries=1, failures=0"))
+
+class EchoSearchCommand(SearchCommand):
+    """
+    A search command that echoes the host field of each result (or generates results if no field
+    is provided).
+    """
+
+    chunked = True
+    chunk_size = 10
+
+    def __init__(self, field=None, count="0"):
+        SearchCommand.__init__(self, run_in_preview=True, logger_name='test_search_command')
+        self.logger = logging.getLogger('test_search_command')
+        self.field = field
+        self.count = int(count)
+        self.chunk_sizes = []
+        self.calls = []
+
+    def is_generating(self):
+        return self.field is None
+
+    def setup(self, session_key):
+        self.calls.append(('setup', session_key))
+
+    def teardown(self):
+        self.calls.append(('teardown',))
+
+    def handle_results(self, results, session_key, in_preview):
+        self.chunk_sizes.append(len(results))
+        self.calls.append(('handle_results', len(results)))
+
+        if self.is_generating():
+            self.output_streaming_results(({'number': number} for number in range(self.count)), ['number'])
+            return
+
+        for result in results:
+            if result[self.field] == 'fail':
+                raise ValueError("The command failed")
+
+            result['echo'] = result[self.field]
+            result['letters'] = list(result[self.field])
+
+        self.output_results(results)
+
+class TestChunkedSearchCommand(unittest.TestCase):
+    """
+    Test running search commands with the chunked protocol.
+    """
+
+    def make_chunk(self, metadata, body=''):
+        metadata = json.dumps(metadata).encode('utf-8')
+        body = body.encode('utf-8')
+
+        return b'chunked 1.0,' + str(len(metadata)).encode('utf-8') + b',' + str(len(body)).encode('utf-8') + b'\n' + metadata + body
+
+    def make_results(self, hosts):
+        return 'host,_raw\n' + ''.join(['%s,event\n' % host for host in hosts])
+
+    def run_command(self, args, chunks):
+        input_stream = io.BytesIO(self.make_chunk({'action': 'getinfo', 'preview': False, 'searchinfo': {'args': args, 'session_key': 'session_key'}}) + b''.join(chunks))
+        output_stream = io.BytesIO()
+
+        EchoSearchCommand.execute_chunked(ChunkedProtocol(input_stream, output_stream))
+
+        output_stream.seek(0)
+        protocol = ChunkedProtocol(output_stream)
+        output = []
+
+        while True:
+            chunk = protocol.read_chunk()
+
+            if chunk is None:
+                return output
+
+            output.append(chunk)
+
+    def test_streaming(self):
+        chunks = [
+            self.make_chunk({'action': 'execute', 'finished': False}, self.make_results(['a', 'b'])),
+            self.make_chunk({'action': 'execute', 'finished': False}, self.make_results(['c'])),
+            self.make_chunk({'action': 'execute', 'finished': True}, self.make_results(['de']))
+        ]
+
+        output = self.run_command(['field=host'], chunks)
+
+        # The getinfo response should be followed by the output of each chunk
+        self.assertEqual(len(output), 4)
+        self.assertEqual(output[0][0], {'type': 'stateful', 'generating': False})
+        self.assertEqual([metadata['finished'] for metadata, _ in output[1:]], [False, False, True])
+
+        results = ChunkedProtocol.decode_results(output[1][1])
+        self.assertEqual([result['echo'] for result in results], ['a', 'b'])
+        self.assertEqual(results[0]['_raw'], 'event')
+
+        # Lists should be output as multi-value fields
+        results = list(csv.DictReader(io.StringIO(output[3][1])))
+        self.assertEqual(results[0]['letters'], 'd\ne')
+        self.assertEqual(results[0]['__mv_letters'], '$d$;$e$')
+
+    def test_multivalue_round_trip(self):
+        body = 'host,__mv_host,letters,__mv_letters\n' + \
+               'a,,"d\ne","$d$;$e$"\n' + \
+               '"b\nc","$b$;$c$","x$y\nz","$x$$y$;$z$"\n'
+
+        results = ChunkedProtocol.decode_results(body)
+
+        # Multi-value fields should be decoded into lists (dollar signs are escaped by doubling)
+        self.assertEqual(results, [{'host': 'a', 'letters': ['d', 'e']}, {'host': ['b', 'c'], 'letters': ['x$y', 'z']}])
+
+        # Encoding the results should write the multi-value fields back out
+        encoded = list(csv.DictReader(io.StringIO(ChunkedProtocol.encode_results(results))))
+        self.assertEqual(encoded[0]['__mv_letters'], '$d$;$e$')
+        self.assertEqual(encoded[1]['host'], 'b\nc')
+        self.assertEqual(encoded[1]['__mv_host'], '$b$;$c$')
+        self.assertEqual(encoded[1]['__mv_letters'], '$x$$y$;$z$')
+        self.assertEqual(ChunkedProtocol.decode_results(ChunkedProtocol.encode_results(results)), results)
+
+    def test_multivalue_passthrough(self):
+        chunks = [
+            self.make_chunk({'action': 'execute', 'finished': True}, 'host,tags,__mv_tags\na,"x\ny","$x$;$y$"\n')
+        ]
+
+        output = self.run_command(['field=host'], chunks)
+
+        # The multi-value fields of the input should still be multi-valued in the output
+        results = list(csv.DictReader(io.StringIO(output[1][1])))
+        self.assertEqual(results[0]['__mv_tags'], '$x$;$y$')
+        self.assertEqual(results[0]['echo'], 'a')
+
+    def test_generating(self):
+        # Splunk sends another (empty) chunk each time the command is ready to send more
+        chunks = [self.make_chunk({'action': 'execute'}) for _ in range(3)]
+
+        output = self.run_command(['count=25'], chunks)
+
+        self.assertEqual(output[0][0], {'type': 'stateful', 'generating': True})
+        self.assertEqual([metadata['finished'] for metadata, _ in output[1:]], [False, False, True])
+
+        numbers = []
+
+        for _, body in output[1:]:
+            numbers.extend([int(result['number']) for result in ChunkedProtocol.decode_results(body)])
+
+        self.assertEqual(numbers, list(range(25)))
+
+    def test_error(self):
+        chunks = [
+            self.make_chunk({'action': 'execute', 'finished': False}, self.make_results(['a', 'fail'])),
+            self.make_chunk({'action': 'execute', 'finished': True}, self.make_results(['b']))
+        ]
+
+        output = self.run_command(['field=host'], chunks)
+
+        self.assertEqual(len(output), 2)
+        self.assertEqual(output[1][0]['finished'], True)
+        self.assertEqual(output[1][0]['inspector']['messages'], [['ERROR', 'The command failed']])
+
+    def test_setup_once(self):
+        chunks = [
+            self.make_chunk({'action': 'execute', 'finished': False}, self.make_results(['a', 'b'])),
+            self.make_chunk({'action': 'execute', 'finished': False}, self.make_results(['fail'])),
+            self.make_chunk({'action': 'execute', 'finished': True}, self.make_results(['c']))
+        ]
+
+        command = EchoSearchCommand(field='host')
+        command.run_chunked(ChunkedProtocol(io.BytesIO(b''.join(chunks)), io.BytesIO()), {'searchinfo': {'session_key': 'session_key'}})
+
+        # The resources should be created once for all of the chunks and released even though the
+        # command failed
+        self.assertEqual(command.calls, [('setup', 'session_key'), ('handle_results', 2), ('handle_results', 1), ('teardown',)])
+
+    def test_enrich_results(self):
+        command = EchoSearchCommand(field='host')
+        lookups = collections.Counter()
+        results = [{'host': host, 'index': index} for index, host in enumerate(['a', 'b', 'a', 'slow', '', 'c', 'b'])]
+
+        def lookup(host):
+            lookups[host] += 1
+
+            if host == 'slow':
+                time.sleep(2)
+
+            return {'upper': host.upper()}
+
+        command.enrich_results(results, 'host', lookup, 3, timeout=0.5, outputs={'c': {'upper': 'cached'}})
+
+        # The results should keep their order and each value should be looked up once
+        self.assertEqual([result['index'] for result in results], list(range(7)))
+        self.assertEqual([result.get('upper') for result in results], ['A', 'B', 'A', None, None, 'cached', 'B'])
+        self.assertEqual(lookups, collections.Counter({'a': 1, 'b': 1, 'slow': 1}))
+
+    def test_invalid_arguments(self):
+        output = self.run_command(['unknown=1'], [])
+
+        self.assertEqual(len(output), 1)
+        self.assertEqual(output[0][0]['finished'], True)
+        self.assertEqual(output[0][0]['inspector']['messages'][0][0], 'ERROR')
+
+class CountingLookup(CustomLookup):
+    """
+    A lookup that counts how many times each host was looked up.
+    """
+
+    def __init__(self, thread_limit=25, cache_ttl=None, cache_path=None, delay=0.001):
+        CustomLookup.__init__(self, ['echo_host'], 'test_lookup_command', logging.INFO, thread_limit, cache_ttl, cache_path)
+        self.logger = logging.getLogger('test_lookup_command')
+        self.delay = delay
+        self.counts = collections.Counter()
+        self.counts_lock = threading.Lock()
+
+    def do_lookup(self, host):
+        with self.counts_lock:
+            self.counts[host] += 1
+
+        if host == 'fail':
+            raise ValueError("The lookup failed")
+
+        time.sleep(self.delay)
+
+        # Results for hosts starting with "short" get their own TTL
+        if host.startswith('short'):
+            return LookupResult({'echo_host': host}, ttl=0.2)
+
+        return {'echo_host': host}
+
+class IndexingLookup(CountingLookup):
+    """
+    A lookup that records the results that would be indexed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        CountingLookup.__init__(self, *args, **kwargs)
+        self.indexed = []
+
+    def do_lookup(self, host):
+        output = CountingLookup.do_lookup(self, host)
+        self.indexed.append(output)
+        return output
+
+    def on_cache_hit(self, output, host):
+        self.indexed.append(output)
+
+class TestCustomLookup(unittest.TestCase):
+    """
+    Test the base class of the lookups.
+    """
+
+    def run_lookup(self, lookup, hosts):
+        original_stdin, original_stdout, original_argv = sys.stdin, sys.stdout, sys.argv
+
+        input_csv = io.StringIO()
+        writer = csv.writer(input_csv, lineterminator='\n')
+        writer.writerow(['host', 'echo_host'])
+
+        for host in hosts:
+            writer.writerow([host, ''])
+
+        input_csv.seek(0)
+
+        try:
+            sys.stdin = input_csv
+            sys.stdout = io.StringIO()
+            sys.argv = ['test_lookup.py', 'host']
+
+            lookup.execute()
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdin, sys.stdout, sys.argv = original_stdin, original_stdout, original_argv
+
+        return list(csv.DictReader(io.StringIO(output)))
+
+    def test_deduplication(self):
+        # The lookups are slow enough that every row arrives while the lookup of its host is
+        # still running
+        lookup = CountingLookup(delay=0.5)
+        hosts = ['host%i' % (number % 50) for number in range(2000)]
+
+        rows = self.run_lookup(lookup, hosts)
+
+        # Every row should be output with its own result but each host should be looked up once
+        self.assertEqual(len(rows), 2000)
+        self.assertEqual(sorted([row['host'] for row in rows]), sorted(hosts))
+
+        for row in rows:
+            self.assertEqual(row['echo_host'], row['host'])
+
+        self.assertEqual(set(lookup.counts.values()), set([1]))
+        self.assertEqual(len(lookup.counts), 50)
+
+    def test_bounded_threads(self):
+        lookup = CountingLookup(thread_limit=5)
+        thread_count = threading.active_count()
+
+        rows = self.run_lookup(lookup, ['host%i' % number for number in range(500)])
+
+        self.assertEqual(len(rows), 500)
+        self.assertEqual(len(lookup.threads), 5)
+        self.assertEqual(threading.active_count(), thread_count)
+
+    def test_single_thread(self):
+        lookup = CountingLookup(thread_limit=1)
+        rows = self.run_lookup(lookup, ['a', 'b', 'a'])
+
+        self.assertEqual([row['echo_host'] for row in rows], ['a', 'b', 'a'])
+
+        # The result of a completed lookup isn't kept so the last row is looked up again
+        self.assertEqual(lookup.counts['a'], 2)
+
+    def test_completed_released(self):
+        lookup = CountingLookup(thread_limit=1)
+        self.run_lookup(lookup, ['host%i' % number for number in range(100)])
+
+        # Nothing should be retained once the rows of each lookup have been written out
+        self.assertEqual(lookup.pending, {})
+        self.assertEqual(lookup.lookup_count, 100)
+
+    def test_cache_deduplication(self):
+        cache_dir = tempfile.mkdtemp()
+
+        try:
+            # Rows that arrive after the lookup completed should be served from the cache
+            lookup = CountingLookup(thread_limit=1, cache_ttl=60, cache_path=os.path.join(cache_dir, 'lookup_cache.sqlite'))
+            rows = self.run_lookup(lookup, ['a', 'b', 'a'])
+
+            self.assertEqual([row['echo_host'] for row in rows], ['a', 'b', 'a'])
+            self.assertEqual(lookup.counts['a'], 1)
+            self.assertEqual(lookup._cache.hits, 1)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_failed_lookup(self):
+        lookup = CountingLookup()
+        rows = self.run_lookup(lookup, ['fail', 'a', 'fail'])
+
+        # The rows whose lookup failed should still be output
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(sorted([row['echo_host'] for row in rows]), ['', '', 'a'])
+
+    def test_cache(self):
+        cache_dir = tempfile.mkdtemp()
+
+        try:
+            cache_path = os.path.join(cache_dir, 'lookup_cache.sqlite')
+            first_lookup = CountingLookup(cache_ttl=60, cache_path=cache_path)
+            self.run_lookup(first_lookup, ['a', 'b', 'fail'])
+
+            # The results should be loaded from the cache by the next invocation (except for the
+            # one that failed)
+            second_lookup = CountingLookup(cache_ttl=60, cache_path=cache_path)
+            rows = self.run_lookup(second_lookup, ['a', 'b', 'fail', 'c'])
+
+            self.assertEqual(sorted([row['echo_host'] for row in rows]), ['', 'a', 'b', 'c'])
+            self.assertEqual(set(second_lookup.counts.keys()), set(['fail', 'c']))
+            self.assertEqual(second_lookup._cache.hits, 2)
+            self.assertEqual(second_lookup._cache.misses, 2)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_cache_hit_indexed(self):
+        cache_dir = tempfile.mkdtemp()
+
+        try:
+            cache_path = os.path.join(cache_dir, 'lookup_cache.sqlite')
+            self.run_lookup(IndexingLookup(cache_ttl=60, cache_path=cache_path), ['a'])
+
+            # The result loaded from the cache should be indexed like the one that was looked up
+            lookup = IndexingLookup(cache_ttl=60, cache_path=cache_path)
+            self.run_lookup(lookup, ['a'])
+
+            self.assertEqual(len(lookup.counts), 0)
+            self.assertEqual(lookup.indexed, [{'echo_host': 'a'}])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_whois_lookup_single_writer(self):
+        import whois_lookup
+
+        cache_dir = tempfile.mkdtemp()
+        writers = []
+        original_make_event_writer = whois_lookup.make_event_writer
+        original_domain_whois = network_tools_app.domain_whois
+
+        def make_lookup():
+            lookup = whois_lookup.WhoisLookup()
+            lookup.logger = logging.getLogger('test_lookup_command')
+            lookup.cache_path = os.path.join(cache_dir, 'lookup_cache.sqlite')
+            return lookup
+
+        try:
+            whois_lookup.make_event_writer = FlushCountingWriter.factory(writers)
+            network_tools_app.domain_whois = lambda host, parse_pool=None: {'registrar': 'Example'}
+
+            # The results of the lookups and of the cache hits should each be written with one
+            # writer per run that is flushed once
+            self.run_lookup(make_lookup(), ['a.example', 'b.example', 'c.example'])
+            rows = self.run_lookup(make_lookup(), ['a.example', 'b.example', 'd.example'])
+        finally:
+            whois_lookup.make_event_writer = original_make_event_writer
+            network_tools_app.domain_whois = original_domain_whois
+            shutil.rmtree(cache_dir)
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(len(writers), 2)
+        self.assertEqual([len(writer.stored_events) for writer in writers], [3, 3])
+        self.assertEqual([writer.flushes for writer in writers], [1, 1])
+
+    def test_cache_result_ttl(self):
+        cache_dir = tempfile.mkdtemp()
+
+        try:
+            cache_path = os.path.join(cache_dir, 'lookup_cache.sqlite')
+            self.run_lookup(CountingLookup(cache_ttl=60, cache_path=cache_path), ['a', 'short'])
+            time.sleep(0.3)
+
+            # The result with the short TTL should have expired
+            lookup = CountingLookup(cache_ttl=60, cache_path=cache_path)
+            self.run_lookup(lookup, ['a', 'short'])
+
+            self.assertEqual(set(lookup.counts.keys()), set(['short']))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_cache_disabled(self):
+        lookup = CountingLookup()
+        self.run_lookup(lookup, ['a'])
+
+        self.assertEqual(lookup.cache, None)
+
+class TestResultCache(unittest.TestCase):
+    """
+    Test the persistent cache of lookup results.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.cache_dir, 'cache', 'lookup_cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_set(self):
+        cache = ResultCache(self.cache_path)
+
+        self.assertEqual(cache.get('whois', 'textcritical.net'), None)
+        cache.set('whois', 'textcritical.net', {'registrar': 'Example', 'nameservers': ['a', 'b']}, 60)
+
+        self.assertEqual(cache.get('whois', 'textcritical.net'), {'registrar': 'Example', 'nameservers': ['a', 'b']})
+        self.assertEqual(cache.get('ping', 'textcritical.net'), None)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+
+        cache.close()
+
+    def test_shared(self):
+        # The entries should be visible to other connections (such as other lookup processes)
+        cache = ResultCache(self.cache_path)
+        cache.set('whois', 'textcritical.net', {'registrar': 'Example'}, 60)
+
+        self.assertEqual(ResultCache(self.cache_path).get('whois', 'textcritical.net'), {'registrar': 'Example'})
+
+        cache.close()
+
+    def test_expiration(self):
+        cache = ResultCache(self.cache_path)
+        cache.set('ping', '127.0.0.1', {'sent': 1}, 0.1)
+        cache.set('ping', 'localhost', {'sent': 1}, 0)
+
+        time.sleep(0.2)
+
+        self.assertEqual(cache.get('ping', '127.0.0.1'), None)
+        self.assertEqual(cache.get('ping', 'localhost'), None)
+
+        cache.close()
+
+    def test_eviction(self):
+        cache = ResultCache(self.cache_path, max_bytes=1000)
+
+        for number in range(10):
+            cache.set('whois', 'host%i' % number, {'raw': 'x' * 200}, 60)
+            time.sleep(0.01)
+
+        # Use one of the older entries so that it is kept
+        self.assertNotEqual(cache.get('whois', 'host0'), None)
+        cache.close()
+
+        cache = ResultCache(self.cache_path)
+        kept = [number for number in range(10) if cache.get('whois', 'host%i' % number) is not None]
+
+        self.assertTrue(len(kept) < 10)
+        self.assertTrue(0 in kept)
+        self.assertTrue(9 in kept)
+
+        cache.close()
+
+class TestCompiledData(unittest.TestCase):
+    """
+    Test the loading of reference datasets from precompiled copies.
+    """
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.data_dir, 'countries.csv')
+        self.builds = 0
+
+        self.write_source('US,United States\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def write_source(self, content):
+        with open(self.source_path, 'w') as source_file:
+            source_file.write(content)
+
+    def read_source(self):
+        self.builds += 1
+
+        with open(self.source_path) as source_file:
+            return dict(row for row in csv.reader(source_file))
+
+    def test_load_compiled(self):
+        self.assertEqual(load_compiled('countries', [self.source_path], self.read_source), {'US': 'United States'})
+        self.assertTrue(os.path.exists(get_compiled_path('countries', self.source_path)))
+
+        # The second load should use the compiled copy
+        self.assertEqual(load_compiled('countries', [self.source_path], self.read_source), {'US': 'United States'})
+        self.assertEqual(self.builds, 1)
+
+    def test_rebuild_on_change(self):
+        load_compiled('countries', [self.source_path], self.read_source)
+
+        self.write_source('US,United States\nCA,Canada\n')
+
+        self.assertEqual(load_compiled('countries', [self.source_path], self.read_source), {'US': 'United States', 'CA': 'Canada'})
+        self.assertEqual(self.builds, 2)
+
+    def test_corrupt_copy(self):
+        compiled_path = get_compiled_path('countries', self.source_path)
+        os.makedirs(os.path.dirname(compiled_path))
+
+        with open(compiled_path, 'wb') as compiled_file:
+            compiled_file.write(b'not marshal data')
+
+        self.assertEqual(load_compiled('countries', [self.source_path], self.read_source), {'US': 'United States'})
+        self.assertEqual(load_compiled('countries', [self.source_path], self.read_source), {'US': 'United States'})
+        self.assertEqual(self.builds, 1)
+
+    def test_unwritable_directory(self):
+        # The dataset should still load when the copy can't be saved
+        compiled_path = get_compiled_path('countries', self.source_path)
+
+        with open(os.path.dirname(compiled_path), 'w') as blocking_file:
+            blocking_file.write('')
+
+        self.assertEqual(load_compiled('countries', [self.source_path], self.read_source), {'US': 'United States'})
+        self.assertEqual(load_compiled('countries', [self.source_path], self.read_source), {'US': 'United States'})
+        self.assertEqual(self.builds, 2)
+
+    def test_get_countries(self):
+        countries = get_countries()
+
+        self.assertEqual(countries, read_countries())
+        self.assertEqual(countries['US'], 'United States')
+
+        # Changes to the returned dictionary shouldn't affect later calls
+        countries['US'] = 'Changed'
+        self.assertEqual(get_countries()['US'], 'United States')
+
+        self.assertEqual(get_countries(is_legacy_xml=True), read_countries(is_legacy_xml=True))
+
+class TestAppConfig(unittest.TestCase):
+    """
+    Test the caching of the app configuration.
+    """
+
+    def setUp(self):
+        self.splunk_home = tempfile.mkdtemp()
+        self.original_splunk_home = os.environ.get('SPLUNK_HOME')
+        os.environ['SPLUNK_HOME'] = self.splunk_home
+
+        self.default_conf = os.path.join(self.splunk_home, 'etc', 'apps', 'network_tools', 'default', 'network_tools.conf')
+        self.local_conf = os.path.join(self.splunk_home, 'etc', 'apps', 'network_tools', 'local', 'network_tools.conf')
+
+        self.write_conf(self.default_conf, 'main')
+        clear_app_config_cache()
+
+    def tearDown(self):
+        if self.original_splunk_home is None:
+            del os.environ['SPLUNK_HOME']
+        else:
+            os.environ['SPLUNK_HOME'] = self.original_splunk_home
+
+        clear_app_config_cache()
+        shutil.rmtree(self.splunk_home)
+
+    def write_conf(self, path, index, mtime=None):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path, 'w') as conf_file:
+            conf_file.write('[default]\nindex = %s\nthread_limit = 5\n' % index)
+
+        # Make sure that the change is detected even if the file system's mtime isn't precise
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_conf_files_cached(self):
+        app_config = get_app_config(None)
+
+        self.assertEqual(app_config.index, 'main')
+        self.assertIs(get_app_config(None), app_config)
+
+    def test_conf_files_changed(self):
+        self.assertEqual(get_default_index(), 'main')
+
+        self.write_conf(self.default_conf, 'network', time.time() + 10)
+        self.assertEqual(get_default_index(), 'network')
+
+        # Adding a local conf file should be detected too
+        self.write_conf(self.local_conf, 'local_index')
+        self.assertEqual(get_default_index(), 'local_index')
+
+    def test_rest_cached(self):
+        calls = []
+
+        class FakeNetworkToolsConfig(object):
+            @staticmethod
+            def build_id(name, namespace, owner):
+                return name
+
+            @staticmethod
+            def get(id, sessionKey=None):
+                calls.append(sessionKey)
+                return network_tools_app.AttrDict(index='rest_index')
+
+        original_config_class = network_tools_app.NetworkToolsConfig
+        original_ttl = network_tools_app.APP_CONFIG_CACHE_TTL
+        network_tools_app.NetworkToolsConfig = FakeNetworkToolsConfig
+
+        try:
+            self.assertEqual(get_default_index('session_one'), 'rest_index')
+            self.assertEqual(get_default_index('session_one'), 'rest_index')
+            self.assertEqual(calls, ['session_one'])
+
+            # Other session keys shouldn't use the same entry
+            get_default_index('session_two')
+            self.assertEqual(calls, ['session_one', 'session_two'])
+
+            # The entry should be loaded again once it expires
+            network_tools_app.APP_CONFIG_CACHE_TTL = 0
+            clear_app_config_cache()
+            get_default_index('session_one')
+            get_default_index('session_one')
+            self.assertEqual(calls, ['session_one', 'session_two', 'session_one', 'session_one'])
+        finally:
+            network_tools_app.NetworkToolsConfig = original_config_class
+            network_tools_app.APP_CONFIG_CACHE_TTL = original_ttl
+
+class TestSplitIntSet(unittest.TestCase):
+    """
+    Test splitting of a list of integers.
+    """
+
+    def test_combination(self):
+        result = parseIntSet("80-90,8443")
+
+        self.assertEqual(len(result), 12)
+        self.assertEqual(result, set([80, 81, 82, 83, 84, 85, 86, 87, 88, 89, 90, 8443]))
+
+    def test_single(self):
+        result = parseIntSet("80")
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result, set([80]))
+
+    def test_duplicates(self):
+        result = parseIntSet("80-90,89")
+        self.assertEqual(result, set([80, 81, 82, 83, 84, 85, 86, 87, 88, 89, 90]))
+
+        self.assertEqual(len(result), 11)
+
+    def test_extra_spaces(self):
+        result = parseIntSet(" 80-90 , 8443 ")
+
+        self.assertEqual(len(result), 12)
+        self.assertEqual(result, set([80, 81, 82, 83, 84, 85, 86, 87, 88, 89, 90, 8443]))
+
+    def test_error_reporting(self):
+        with self.assertRaises(ValueError):
+            parseIntSet("80-90 , tree", True)
+
+        result = parseIntSet("80-81, tree")
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result, set([80, 81]))
+
+class TestPortScan(unittest.TestCase):
+    """
+    Test port scanning using TCP.
+    """
+
+    def test_port_scan(self):
+        results = port_scan('textcritical.net', '80-81')
+        self.assertEqual(len(results), 2)
+
+    def test_port_scan_single(self):
+        results = port_scan('textcritical.net', '80')
+        self.assertEqual(len(results), 1)
+
+        self.assertEqual(results[0]['status'], 'open')
+        self.assertEqual(results[0]['dest'], 'textcritical.net')
+        self.assertEqual(results[0]['port'], 'TCP\\80')
+
+    def test_port_scan_preparsed(self):
+        results = port_scan('textcritical.net', [80, 443])
+        self.assertEqual(len(results), 2)
+
+    def test_port_scan_local(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(5)
+        port = server.getsockname()[1]
+
+        callbacks = []
+
+        try:
+            results = port_scan('127.0.0.1', [1, port], callback=lambda host, port, status: callbacks.append(status), timeout=1)
+        finally:
+            server.close()
+
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(results[0]['status'], 'closed')
+        self.assertEqual(results[1]['status'], 'open')
+        self.assertEqual(results[1]['port'], 'TCP\\' + str(port))
+
+    def test_port_scan_thread_count(self):
+        concurrency = []
+
+        class RecordingPortScanner(PortScanner):
+            def __init__(self, timeout, max_concurrent, *args, **kwargs):
+                concurrency.append(max_concurrent)
+                super(RecordingPortScanner, self).__init__(timeout, max_concurrent, *args, **kwargs)
+
+        original_port_scanner = network_tools_app.portscan.PortScanner
+        network_tools_app.portscan.PortScanner = RecordingPortScanner
+
+        try:
+            results = port_scan('127.0.0.1', [1], thread_count=3, timeout=1)
+        finally:
+            network_tools_app.portscan.PortScanner = original_port_scanner
+
+        self.assertEqual(concurrency, [3])
+        self.assertEqual(results[0]['status'], 'closed')
+
+    def test_port_scan_select_fallback(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(5)
+        port = server.getsockname()[1]
+
+        # Python 2 doesn't have the selectors module
+        original_selectors = tcp_engine.selectors
+        tcp_engine.selectors = None
+
+        try:
+            results = port_scan('127.0.0.1', [1, port], timeout=1)
+        finally:
+            tcp_engine.selectors = original_selectors
+            server.close()
+
+        self.assertEqual([result['status'] for result in results], ['closed', 'open'])
+
+    def test_port_scan_all_ports(self):
+        start = time.time()
+        results = port_scan('127.0.0.1', '1-65535', timeout=1)
+
+        self.assertEqual(len(results), 65535)
+        self.assertLess(time.time() - start, 30)
+
+    def test_port_scan_no_leaked_threads(self):
+        thread_count = threading.active_count()
+        port_scan('127.0.0.1', '1-100', timeout=1)
+
+        self.assertEqual(threading.active_count(), thread_count)
+
+    def test_parse_hosts(self):
+        self.assertEqual(parse_hosts('127.0.0.1, textcritical.net'), ['127.0.0.1', 'textcritical.net'])
+        self.assertEqual(parse_hosts(['127.0.0.1', '10.0.0.0/30']), ['127.0.0.1', '10.0.0.1', '10.0.0.2'])
+        self.assertEqual(len(parse_hosts('10.0.0.0/24')), 254)
+
+    def test_parse_hosts_limit(self):
+        with self.assertRaises(TooManyHostsException):
+            parse_hosts('10.0.0.0/8')
+
+    def test_interleave(self):
+        pairs = list(interleave(['10.0.0.1', '10.0.0.2'], [22, 80]))
+        self.assertEqual(pairs, [('10.0.0.1', 22), ('10.0.0.2', 22), ('10.0.0.1', 80), ('10.0.0.2', 80)])
+
+    def test_port_scan_multiple_hosts(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('0.0.0.0', 0))
+        server.listen(5)
+        port = server.getsockname()[1]
+
+        try:
+            results = port_scan('127.0.0.1,127.0.0.2', [1, port], timeout=1)
+        finally:
+            server.close()
+
+        self.assertEqual([result['dest'] for result in results], ['127.0.0.1', '127.0.0.1', '127.0.0.2', '127.0.0.2'])
+        self.assertEqual([result['status'] for result in results], ['closed', 'open', 'closed', 'open'])
+
+    def test_port_scan_cidr(self):
+        results = port_scan('127.0.0.0/29', [1], timeout=1)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[0]['dest'], '127.0.0.1')
+
+    def test_port_scan_filtered(self):
+        # Fill the listen backlog so that further connection attempts are dropped
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(0)
+        port = server.getsockname()[1]
+
+        clients = []
+
+        try:
+            for _ in range(3):
+                client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                client.setblocking(False)
+                client.connect_ex(('127.0.0.1', port))
+                clients.append(client)
+
+            time.sleep(0.1)
+
+            start = time.time()
+            results = port_scan('127.0.0.1', [1, 2, 3, port], timeout=5)
+            duration = time.time() - start
+        finally:
+            for client in clients:
+                client.close()
+
+            server.close()
+
+        self.assertEqual([result['status'] for result in results], ['closed', 'closed', 'closed', 'filtered'])
+
+        # The filtered port shouldn't need to wait out the full timeout
+        self.assertLess(duration, 4)
+
+    def test_rtt_estimator(self):
+        estimator = RTTEstimator(min_timeout=0.1, max_timeout=5, initial_timeout=1)
+        self.assertEqual(estimator.get_timeout(), 1)
+
+        estimator.add_sample(0.2)
+        self.assertAlmostEqual(estimator.get_timeout(), 0.6)
+
+        # The timeout must stay within the bounds
+        estimator.add_sample(0.0)
+        self.assertGreaterEqual(estimator.get_timeout(), 0.1)
+
+        for _ in range(10):
+            estimator.add_sample(30)
+
+        self.assertEqual(estimator.get_timeout(), 5)
+
+    def test_timeout_without_samples(self):
+        scanner = PortScanner(timeout=5)
+        scanner.add_rtt_sample('fast.example', 0.001)
+
+        # A fast host shouldn't shorten the timeout of the hosts that haven't responded yet
+        self.assertEqual(scanner.get_timeout('fast.example'), 0.1)
+        self.assertEqual(scanner.get_timeout('slow.example'), 1)
+
+        # A slow scan should lengthen it though
+        for _ in range(10):
+            scanner.add_rtt_sample('other.example', 2)
+
+        self.assertGreater(scanner.get_timeout('slow.example'), 1)
+
+    def test_rtt_excludes_consumer(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(50)
+
+        scanner = PortScanner(timeout=2)
+
+        try:
+            for _ in scanner.iter_scan([('127.0.0.1', server.getsockname()[1])] * 5):
+                time.sleep(0.2)
+        finally:
+            server.close()
+
+        # The time spent by the consumer shouldn't be included in the round-trip times
+        self.assertLess(scanner.estimators['127.0.0.1'].smoothed_rtt, 0.1)
+
+    def test_discover_hosts_tcp(self):
+        results = list(discover_hosts(['127.0.0.1', 'doesnotexist.invalid'], 'tcp', [1, 2], timeout=1))
+
+        self.assertEqual(sorted(results), [('127.0.0.1', 'up', 'tcp'), ('doesnotexist.invalid', 'down', 'tcp')])
+
+    def test_discover_hosts_invalid_method(self):
+        with self.assertRaises(ValueError):
+            list(discover_hosts(['127.0.0.1'], 'arp'))
+
+    def test_port_scan_discovery(self):
+        discovered = []
+
+        results = port_scan('127.0.0.1,doesnotexist.invalid', [1, 2], timeout=1, discovery='tcp',
+                            discovery_callback=lambda host, status, method: discovered.append((host, status)))
+
+        self.assertEqual(sorted(discovered), [('127.0.0.1', 'up'), ('doesnotexist.invalid', 'down')])
+
+        # Only the host that is up should have been scanned
+        self.assertEqual(len(results), 2)
+        self.assertEqual(set([result['dest'] for result in results]), set(['127.0.0.1']))
+
+    def test_port_scan_discovery_icmp(self):
+        results = port_scan('127.0.0.1', [1], timeout=1, discovery='icmp')
+
+        self.assertEqual(len(results), 1)
+
+class TestPortRangeField(unittest.TestCase):
+    """
+    Test the port range field.
+    """
+
+    field = None
+
+    def setUp(self):
+        self.field = PortRangeField('name', 'title', 'description')
+
+    def test_to_string(self):
+        value = self.field.to_string([80, 443])
+
+        self.assertEqual(value, "80,443")
+    def test_to_python(self):
+        value = self.field.to_python("80,443")
+
+        self.assertEqual(value, set([80, 443]))
+
+class TestDiscoveryMethodField(unittest.TestCase):
+    """
+    Test the field of the host discovery method.
+    """
+
+    def setUp(self):
+        self.field = DiscoveryMethodField('discovery', 'title', 'description')
+
+    def test_to_python(self):
+        self.assertEqual(self.field.to_python('tcp'), 'tcp')
+        self.assertEqual(self.field.to_python(' icmp '), 'icmp')
+
+    def test_blank(self):
+        # A blank value means that all of the hosts are scanned
+        self.assertEqual(self.field.to_python(''), None)
+        self.assertEqual(self.field.to_python('  '), None)
+        self.assertEqual(self.field.to_python(None), None)
+
+    def test_invalid(self):
+        with self.assertRaises(FieldValidationException):
+            self.field.to_python('arp')
 
 if __name__ == '__main__':
     unittest.main()